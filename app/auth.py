@@ -1,17 +1,29 @@
+import re
+from typing import Optional
 from fastapi import Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from .settings import OPENAI_API_KEY
-from .db import SessionLocal
+from .db import AsyncSessionLocal
 from .models import User
+from .services.auth_cache import api_key_cache, MISSING
 
 DOCS_WHITELIST = {"/","/auth/signup","/auth/login", "/docs", "/docs/", "/redoc", "/redoc/", "/openapi.json", "/health"}
+# Carry their own authorization (an HMAC signature checked by the route)
+SIGNED_PATHS = re.compile(r"/files/[^/]+/content")
+
+
+async def _lookup_user_id(token: str) -> Optional[str]:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(User.id).where(User.api_key == token))
 
 
 async def auth_middleware(request: Request, call_next):
     # Allow unauthenticated access for docs and CORS preflight requests
     if request.method == "OPTIONS" or request.url.path in DOCS_WHITELIST:
         return await call_next(request)
+    if "signature" in request.query_params and SIGNED_PATHS.fullmatch(request.url.path):
+        return await call_next(request)
 
     auth_header = request.headers.get("authorization")
     if not auth_header or not auth_header.lower().startswith("bearer "):
@@ -29,20 +41,20 @@ async def auth_middleware(request: Request, call_next):
         request.state.user_id = None
         return await call_next(request)
 
-    db: Session = SessionLocal()
-    try:
-        user = db.query(User).filter(User.api_key == token).first()
-        if not user:
-            return JSONResponse(
-                status_code=401,
-                content={"error": "Invalid API key"},
-                headers={
-                    "Access-Control-Allow-Origin": request.headers.get("origin", ""),
-                    "Access-Control-Allow-Credentials": "true",
-                },
-            )
-        request.state.user_id = user.id
-    finally:
-        db.close()
+    user_id = api_key_cache.get(token)
+    if user_id is MISSING:
+        generation = api_key_cache.generation
+        user_id = await _lookup_user_id(token)
+        api_key_cache.set(token, user_id, generation)
+    if user_id is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Invalid API key"},
+            headers={
+                "Access-Control-Allow-Origin": request.headers.get("origin", ""),
+                "Access-Control-Allow-Credentials": "true",
+            },
+        )
+    request.state.user_id = user_id
 
     return await call_next(request)
@@ -1,6 +1,8 @@
 from contextlib import contextmanager
 from datetime import datetime
 from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .settings import DATABASE_URL
 
@@ -30,5 +32,26 @@ def get_db():
     finally:
         db.close()
 
+
+# Async drivers for the dialects we support; DATABASE_URL stays a sync URL so Alembic keeps working
+_ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def async_url(url: str) -> str:
+    u = make_url(url)
+    driver = _ASYNC_DRIVERS.get(u.get_backend_name())
+    if driver is None:
+        return url
+    return u.set(drivername=f"{u.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+async_engine = create_async_engine(async_url(DATABASE_URL), pool_pre_ping=True)
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+
+# expire_on_commit=False: attributes can't lazy-load under asyncio, keep them readable after commit
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def utcnow():
     return datetime.utcnow()
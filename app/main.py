@@ -1,11 +1,35 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from .auth import auth_middleware
 from .db import engine, Base
 from fastapi.middleware.cors import CORSMiddleware
 from .settings import APP_NAME, APP_VERSION, CORS_ORIGINS
 from .routers import openai_proxy, conversations, users, files
+from .services import backend_pool, derivative_store, message_writer, ollama_client
 
-app = FastAPI(title=APP_NAME, version=APP_VERSION)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await ollama_client.start()
+    backend_pool.start()
+    message_writer.start()
+    try:
+        yield
+    finally:
+        await message_writer.stop()
+        await backend_pool.stop()
+        await ollama_client.aclose()
+        derivative_store.shutdown()
+
+
+app = FastAPI(title=APP_NAME, version=APP_VERSION, lifespan=lifespan)
+
+
+@app.exception_handler(httpx.TimeoutException)
+async def ollama_timeout_handler(_: Request, exc: httpx.TimeoutException):
+    return JSONResponse(status_code=504, content={"detail": f"Upstream timeout: {exc.__class__.__name__}"})
 
 # CORS middleware
 app.add_middleware(
@@ -14,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Auth middleware
@@ -1,4 +1,5 @@
 import os
+import re
 from logging.config import fileConfig
 from sqlalchemy import pool
 from sqlalchemy import engine_from_config
@@ -28,6 +29,14 @@ else:
 # Retrieve the configuration section
 config_section = config.get_section(config.config_ini_section)
 
+# The full-text index (migrations 0007/0015) lives outside the models: FTS5
+# tables and their shadow tables, fts_rowid and tsvector columns, and their indexes
+SEARCH_OBJECTS = re.compile(r"\w+_fts(_\w+)?|fts_rowid|\w+_tsv|ix_\w+_(fts_rowid|tsv)")
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep autogenerate from dropping the search index objects the models don't declare."""
+    return not (reflected and compare_to is None and SEARCH_OBJECTS.fullmatch(name or ""))
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode."""
     url = config.get_main_option("sqlalchemy.url")
@@ -37,6 +46,7 @@ def run_migrations_offline():
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
         compare_type=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -56,11 +66,17 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             compare_type=True,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
             context.run_migrations()
 
+    # Work migrations deferred until their changes are committed, such as
+    # removing stored files the old rows pointed at
+    for action in config.attributes.pop("after_commit", []):
+        action()
+
 # Determine if we are running in offline mode
 if context.is_offline_mode():
     run_migrations_offline()
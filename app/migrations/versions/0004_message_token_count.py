@@ -0,0 +1,49 @@
+"""add cached token_count to messages
+
+Revision ID: 0004_message_token_count
+Revises: 0003_files
+Create Date: 2026-10-17
+"""
+import math
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_message_token_count"
+down_revision = "0003_files"
+branch_labels = None
+depends_on = None
+
+BATCH = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    # Frozen copy of app.tokens.estimate_tokens, so later changes to it don't change this migration
+    return math.ceil(len(text.encode("utf-8")) / 4) + 4
+
+
+def upgrade() -> None:
+    op.add_column("messages", sa.Column("token_count", sa.Integer(), nullable=False, server_default="0"))
+
+    # Backfill in id order, one batch at a time, so large tables don't load into memory at once
+    messages = sa.table("messages", sa.column("id", sa.String), sa.column("content", sa.Text), sa.column("token_count", sa.Integer))
+    conn = op.get_bind()
+    last_id = ""
+    while True:
+        rows = conn.execute(
+            sa.select(messages.c.id, messages.c.content)
+            .where(messages.c.id > last_id)
+            .order_by(messages.c.id)
+            .limit(BATCH)
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            messages.update().where(messages.c.id == sa.bindparam("_id")).values(token_count=sa.bindparam("_count")),
+            [{"_id": row.id, "_count": estimate_tokens(row.content or "")} for row in rows],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    op.drop_column("messages", "token_count")
@@ -0,0 +1,29 @@
+"""add conversation_contexts for Ollama context reuse
+
+Revision ID: 0005_conversation_contexts
+Revises: 0004_message_token_count
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_conversation_contexts"
+down_revision = "0004_message_token_count"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversation_contexts",
+        sa.Column("conversation_id", sa.String(length=32), sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("model", sa.String(length=255), primary_key=True),
+        sa.Column("context", sa.LargeBinary(), nullable=False),
+        sa.Column("token_count", sa.Integer(), nullable=False),
+        sa.Column("last_message_id", sa.String(length=32), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=False), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("conversation_contexts")
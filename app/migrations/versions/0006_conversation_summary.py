@@ -0,0 +1,38 @@
+"""add summary columns to conversations
+
+Revision ID: 0006_conversation_summary
+Revises: 0005_conversation_contexts
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_conversation_summary"
+down_revision = "0005_conversation_contexts"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("conversations", sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("conversations", sa.Column("last_message_preview", sa.String(length=255), nullable=True))
+    op.add_column("conversations", sa.Column("last_message_at", sa.DateTime(timezone=False), nullable=True))
+
+    op.execute(
+        """
+        UPDATE conversations SET
+            message_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id),
+            last_message_preview = (
+                SELECT SUBSTR(m.content, 1, 120) FROM messages m
+                WHERE m.conversation_id = conversations.id
+                ORDER BY m.created_at DESC LIMIT 1
+            ),
+            last_message_at = (SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id)
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("conversations", "last_message_at")
+    op.drop_column("conversations", "last_message_preview")
+    op.drop_column("conversations", "message_count")
@@ -0,0 +1,76 @@
+"""full-text search index over messages and conversation titles
+
+SQLite: FTS5 external-content tables with sync triggers.
+Postgres: generated tsvector columns with GIN indexes.
+
+Revision ID: 0007_fulltext_search
+Revises: 0006_conversation_summary
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0007_fulltext_search"
+down_revision = "0006_conversation_summary"
+branch_labels = None
+depends_on = None
+
+
+# The schema as of this revision; app.services.search has the current one
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN"
+    " INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN"
+    " INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN"
+    " INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);"
+    " INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(title, content='conversations', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN"
+    " INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF title ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title);"
+    " INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title); END",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+    "INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS messages_fts_ai",
+    "DROP TRIGGER IF EXISTS messages_fts_ad",
+    "DROP TRIGGER IF EXISTS messages_fts_au",
+    "DROP TABLE IF EXISTS messages_fts",
+    "DROP TRIGGER IF EXISTS conversations_fts_ai",
+    "DROP TRIGGER IF EXISTS conversations_fts_ad",
+    "DROP TRIGGER IF EXISTS conversations_fts_au",
+    "DROP TABLE IF EXISTS conversations_fts",
+]
+POSTGRES_SCHEMA = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING GIN (content_tsv)",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS title_tsv tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('simple', coalesce(title, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_title_tsv ON conversations USING GIN (title_tsv)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS ix_messages_content_tsv",
+    "ALTER TABLE messages DROP COLUMN IF EXISTS content_tsv",
+    "DROP INDEX IF EXISTS ix_conversations_title_tsv",
+    "ALTER TABLE conversations DROP COLUMN IF EXISTS title_tsv",
+]
+
+
+def _run(sqlite, postgres) -> None:
+    conn = op.get_bind()
+    for stmt in sqlite if conn.dialect.name == "sqlite" else postgres if conn.dialect.name == "postgresql" else []:
+        conn.exec_driver_sql(stmt)
+
+
+def upgrade() -> None:
+    _run(SQLITE_SCHEMA, POSTGRES_SCHEMA)
+
+
+def downgrade() -> None:
+    _run(SQLITE_DROP, POSTGRES_DROP)
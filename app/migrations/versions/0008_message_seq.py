@@ -0,0 +1,50 @@
+"""add per-conversation message sequence numbers
+
+Revision ID: 0008_message_seq
+Revises: 0007_fulltext_search
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_message_seq"
+down_revision = "0007_fulltext_search"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # server_default keeps both ADD COLUMNs in place on SQLite (no table rebuild,
+    # which would drop the full-text triggers on messages)
+    op.add_column("messages", sa.Column("seq", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("conversations", sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"))
+
+    # Number existing messages in their old display order; rowid breaks
+    # same-second ties on SQLite, where created_at has one-second resolution
+    tiebreak = "rowid" if op.get_bind().dialect.name == "sqlite" else "id"
+    op.execute(
+        f"""
+        UPDATE messages SET seq = ranked.rn
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY conversation_id ORDER BY created_at, {tiebreak}
+            ) AS rn
+            FROM messages
+        ) AS ranked
+        WHERE messages.id = ranked.id
+        """
+    )
+    op.execute(
+        """
+        UPDATE conversations SET last_seq = COALESCE(
+            (SELECT MAX(m.seq) FROM messages m WHERE m.conversation_id = conversations.id), 0
+        )
+        """
+    )
+    op.create_index("ix_messages_conversation_seq", "messages", ["conversation_id", "seq"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_conversation_seq", table_name="messages")
+    op.drop_column("conversations", "last_seq")
+    op.drop_column("messages", "seq")
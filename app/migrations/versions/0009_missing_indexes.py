@@ -0,0 +1,27 @@
+"""add secondary indexes for the per-user and per-file lookups
+
+Revision ID: 0009_missing_indexes
+Revises: 0008_message_seq
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0009_missing_indexes"
+down_revision = "0008_message_seq"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # messages.conversation_id is already the leading column of ix_messages_conversation_seq
+    op.create_index(
+        "ix_conversations_user_archived_created", "conversations", ["user_id", "archived", "created_at"]
+    )
+    op.create_index("ix_files_owner", "files", ["owner"])
+    op.create_index("ix_message_files_file_id", "message_files", ["file_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_message_files_file_id", table_name="message_files")
+    op.drop_index("ix_files_owner", table_name="files")
+    op.drop_index("ix_conversations_user_archived_created", table_name="conversations")
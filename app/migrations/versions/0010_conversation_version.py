@@ -0,0 +1,21 @@
+"""add a version counter to conversations for ETags
+
+Revision ID: 0010_conversation_version
+Revises: 0009_missing_indexes
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_conversation_version"
+down_revision = "0009_missing_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("conversations", sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    op.drop_column("conversations", "version")
@@ -0,0 +1,109 @@
+"""turn messages into a tree with an active leaf per conversation
+
+Revision ID: 0011_message_branches
+Revises: 0010_conversation_version
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_message_branches"
+down_revision = "0010_conversation_version"
+branch_labels = None
+depends_on = None
+
+# The full-text index from 0007, which a SQLite table rebuild takes with it
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN"
+    " INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN"
+    " INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN"
+    " INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);"
+    " INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(title, content='conversations', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN"
+    " INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF title ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title);"
+    " INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title); END",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+    "INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS messages_fts_ai",
+    "DROP TRIGGER IF EXISTS messages_fts_ad",
+    "DROP TRIGGER IF EXISTS messages_fts_au",
+    "DROP TABLE IF EXISTS messages_fts",
+    "DROP TRIGGER IF EXISTS conversations_fts_ai",
+    "DROP TRIGGER IF EXISTS conversations_fts_ad",
+    "DROP TRIGGER IF EXISTS conversations_fts_au",
+    "DROP TABLE IF EXISTS conversations_fts",
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        # SQLite can add a REFERENCES column in place, but Alembic only knows
+        # to do it through a table rebuild
+        op.execute("ALTER TABLE messages ADD COLUMN parent_id VARCHAR(32) REFERENCES messages (id)")
+    else:
+        op.add_column(
+            "messages", sa.Column("parent_id", sa.String(length=32), sa.ForeignKey("messages.id"), nullable=True)
+        )
+    op.add_column("conversations", sa.Column("active_leaf_id", sa.String(length=32), nullable=True))
+
+    # Existing conversations are a single branch: each message's parent is the one before it
+    op.execute(
+        """
+        UPDATE messages SET parent_id = (
+            SELECT p.id FROM messages p
+            WHERE p.conversation_id = messages.conversation_id AND p.seq < messages.seq
+            ORDER BY p.seq DESC LIMIT 1
+        )
+        """
+    )
+    op.execute(
+        """
+        UPDATE conversations SET active_leaf_id = (
+            SELECT m.id FROM messages m
+            WHERE m.conversation_id = conversations.id
+            ORDER BY m.seq DESC LIMIT 1
+        )
+        """
+    )
+    op.create_index("ix_messages_parent_id", "messages", ["parent_id"])
+
+
+def downgrade() -> None:
+    # Keeps only the active branch, as the linear model can't represent the others
+    op.execute(
+        """
+        WITH RECURSIVE path(id, parent_id) AS (
+            SELECT m.id, m.parent_id FROM messages m
+            JOIN conversations c ON m.id = c.active_leaf_id
+            UNION ALL
+            SELECT m.id, m.parent_id FROM messages m JOIN path ON m.id = path.parent_id
+        )
+        DELETE FROM messages
+        WHERE id NOT IN (SELECT id FROM path)
+          AND conversation_id IN (SELECT id FROM conversations WHERE active_leaf_id IS NOT NULL)
+        """
+    )
+    op.drop_index("ix_messages_parent_id", table_name="messages")
+    op.drop_column("conversations", "active_leaf_id")
+    conn = op.get_bind()
+    if conn.dialect.name == "sqlite":
+        # SQLite rebuilds the table to drop a foreign key column, taking the
+        # full-text triggers and rowids with it
+        for stmt in SQLITE_DROP:
+            conn.exec_driver_sql(stmt)
+        with op.batch_alter_table("messages") as batch:
+            batch.drop_column("parent_id")
+        for stmt in SQLITE_SCHEMA:
+            conn.exec_driver_sql(stmt)
+    else:
+        op.drop_column("messages", "parent_id")
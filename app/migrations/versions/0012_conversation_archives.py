@@ -0,0 +1,79 @@
+"""add conversation_archives for compacted archived conversations
+
+Revision ID: 0012_conversation_archives
+Revises: 0011_message_branches
+Create Date: 2026-10-17
+"""
+import gzip
+import json
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012_conversation_archives"
+down_revision = "0011_message_branches"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing archived conversations are compacted by `python -m app.services.archive`
+    op.create_table(
+        "conversation_archives",
+        sa.Column(
+            "conversation_id",
+            sa.String(length=32),
+            sa.ForeignKey("conversations.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("codec", sa.String(length=16), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("message_count", sa.Integer(), nullable=False),
+        sa.Column("raw_size", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=False), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def downgrade() -> None:
+    # Archived messages would be lost with the table; restore their rows first.
+    # Each archive is a JSON list of messages, as written by this revision.
+    conn = op.get_bind()
+    messages = sa.table(
+        "messages",
+        *(sa.column(name) for name in ("id", "conversation_id", "parent_id", "seq", "role", "content", "token_count")),
+        sa.column("created_at", sa.DateTime()),
+    )
+    message_files = sa.table("message_files", sa.column("message_id"), sa.column("file_id"))
+    archives = conn.execute(sa.text("SELECT conversation_id, codec, data FROM conversation_archives")).all()
+    for conversation_id, codec, data in archives:
+        payload = json.loads(_decompress(codec, data))
+        conn.execute(
+            messages.insert(),
+            [
+                {**{name: m[name] for name in ("id", "parent_id", "seq", "role", "content", "token_count")},
+                 "conversation_id": conversation_id,
+                 "created_at": datetime.fromisoformat(m["created_at"])}
+                for m in payload
+            ],
+        )
+        wanted = sorted({file_id for m in payload for file_id in m["file_ids"]})
+        # Files deleted while the conversation was archived are dropped from their messages
+        kept = set()
+        if wanted:
+            existing = sa.text("SELECT id FROM files WHERE id IN :ids").bindparams(sa.bindparam("ids", expanding=True))
+            kept = set(conn.execute(existing, {"ids": wanted}).scalars())
+        links = [
+            {"message_id": m["id"], "file_id": file_id} for m in payload for file_id in m["file_ids"] if file_id in kept
+        ]
+        if links:
+            conn.execute(message_files.insert(), links)
+    op.drop_table("conversation_archives")
@@ -0,0 +1,22 @@
+"""add a content hash to files
+
+Revision ID: 0013_file_sha256
+Revises: 0012_conversation_archives
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013_file_sha256"
+down_revision = "0012_conversation_archives"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("files", sa.Column("sha256", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("files") as batch:
+        batch.drop_column("sha256")
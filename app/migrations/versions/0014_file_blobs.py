@@ -0,0 +1,125 @@
+"""store file content once per SHA-256 in reference-counted blobs
+
+Revision ID: 0014_file_blobs
+Revises: 0013_file_sha256
+Create Date: 2026-10-17
+"""
+import hashlib
+import os
+from typing import Any, Callable, List, Tuple
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0014_file_blobs"
+down_revision = "0013_file_sha256"
+branch_labels = None
+depends_on = None
+
+# Files read per query while moving them onto blobs
+BATCH_SIZE = 500
+BLOB_PREFIX = "blobs"
+CHUNK_SIZE = 1024 * 1024
+
+
+def _storage() -> Tuple[Any, Callable[[str], str]]:
+    """The upload filesystem and a function giving a stored path's full location."""
+    from app.settings import FILE_STORAGE_BACKEND, FILE_STORAGE_LOCAL_PATH, FILE_STORAGE_S3_BUCKET
+
+    if FILE_STORAGE_BACKEND == "s3":
+        import s3fs
+
+        return s3fs.S3FileSystem(), lambda path: f"{FILE_STORAGE_S3_BUCKET}/{path}"
+    import fsspec
+
+    return fsspec.filesystem("file", auto_mkdir=True), lambda path: os.path.join(FILE_STORAGE_LOCAL_PATH, path)
+
+
+def _after_commit(fs, full_paths: List[str]) -> None:
+    # env.py runs these once the migration transaction has committed; removing
+    # the objects earlier would lose them if it rolled back
+    def remove() -> None:
+        for path in full_paths:
+            if fs.exists(path):
+                fs.rm(path)
+
+    context.config.attributes.setdefault("after_commit", []).append(remove)
+
+
+def move_to_blobs(conn, fs, full_path: Callable[[str], str], batch_size: int) -> List[str]:
+    """Point files stored under their own path at shared blobs, copying content that is new.
+
+    Nothing is removed: returns the files' old objects, to delete once the
+    transaction has committed. Files whose object is missing are left as
+    they are.
+    """
+    replaced: List[str] = []
+    last = ""
+    while True:
+        batch = conn.execute(
+            sa.text(
+                "SELECT id, path, sha256, size FROM files WHERE id > :last AND path NOT LIKE :prefix"
+                " ORDER BY id LIMIT :limit"
+            ),
+            {"last": last, "prefix": f"{BLOB_PREFIX}/%", "limit": batch_size},
+        ).all()
+        if not batch:
+            return replaced
+        for file_id, path, sha256, size in batch:
+            source = full_path(path)
+            if not fs.exists(source):
+                continue
+            if not sha256:
+                digest = hashlib.sha256()
+                with fs.open(source, "rb") as f:
+                    while chunk := f.read(CHUNK_SIZE):
+                        digest.update(chunk)
+                sha256 = digest.hexdigest()
+            blob = f"{BLOB_PREFIX}/{sha256[:2]}/{sha256}"
+            shared = conn.execute(
+                sa.text("UPDATE blobs SET ref_count = ref_count + 1 WHERE sha256 = :sha256"), {"sha256": sha256}
+            ).rowcount
+            if not shared:
+                # Identical content, so overwriting a copy left by a rolled-back run is harmless
+                fs.copy(source, full_path(blob))
+                conn.execute(
+                    sa.text("INSERT INTO blobs (sha256, path, size, ref_count) VALUES (:sha256, :path, :size, 1)"),
+                    {"sha256": sha256, "path": blob, "size": size},
+                )
+            conn.execute(
+                sa.text("UPDATE files SET path = :path, sha256 = :sha256 WHERE id = :id"),
+                {"path": blob, "sha256": sha256, "id": file_id},
+            )
+            replaced.append(source)
+        last = batch[-1][0]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "blobs",
+        sa.Column("sha256", sa.String(length=64), primary_key=True),
+        sa.Column("path", sa.String(length=1024), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("created_at", sa.DateTime(timezone=False), server_default=sa.func.now(), nullable=False),
+    )
+    fs, full_path = _storage()
+    _after_commit(fs, move_to_blobs(op.get_bind(), fs, full_path, BATCH_SIZE))
+
+
+def downgrade() -> None:
+    # Give every file its own copy again, at the per-file path uploads used before
+    fs, full_path = _storage()
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text("SELECT id, name, path FROM files WHERE path LIKE :prefix"), {"prefix": f"{BLOB_PREFIX}/%"}
+    ).all()
+    for file_id, name, path in rows:
+        own = f"{file_id}{os.path.splitext(name)[1]}"
+        source = full_path(path)
+        if fs.exists(source):
+            fs.copy(source, full_path(own))
+        conn.execute(sa.text("UPDATE files SET path = :path WHERE id = :id"), {"path": own, "id": file_id})
+    blobs = [full_path(path) for (path,) in conn.execute(sa.text("SELECT path FROM blobs")).all()]
+    op.drop_table("blobs")
+    _after_commit(fs, blobs)
@@ -0,0 +1,82 @@
+"""key the SQLite full-text index on a stable fts_rowid column
+
+The FTS5 tables from 0007 point at the implicit rowid of messages and
+conversations, which VACUUM or a table rebuild may renumber. Postgres
+uses generated columns and is unaffected.
+
+Revision ID: 0015_stable_search_rowids
+Revises: 0014_file_blobs
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0015_stable_search_rowids"
+down_revision = "0014_file_blobs"
+branch_labels = None
+depends_on = None
+
+TABLES = {"messages": "content", "conversations": "title"}
+TOKENIZE = "tokenize='unicode61 remove_diacritics 2'"
+
+
+def _drop(conn, table: str) -> None:
+    fts = f"{table}_fts"
+    for stmt in (
+        f"DROP TRIGGER IF EXISTS {fts}_ai",
+        f"DROP TRIGGER IF EXISTS {fts}_ad",
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+        f"DROP TABLE IF EXISTS {fts}",
+    ):
+        conn.exec_driver_sql(stmt)
+
+
+def _create(conn, table: str, column: str, key: str) -> None:
+    fts = f"{table}_fts"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});"
+    if key == "rowid":
+        ai = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.rowid, new.{column});"
+        content = f"content='{table}'"
+    else:
+        ai = (
+            f"UPDATE {table} SET {key} = (SELECT coalesce(max({key}), 0) + 1 FROM {table}) WHERE rowid = new.rowid;"
+            f" INSERT INTO {fts}(rowid, {column}) SELECT {key}, {column} FROM {table} WHERE rowid = new.rowid;"
+        )
+        content = f"content='{table}', content_rowid='{key}'"
+    for stmt in (
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, {content}, {TOKENIZE})",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {ai} END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN {delete}"
+        f" INSERT INTO {fts}(rowid, {column}) VALUES (new.{key}, new.{column}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ):
+        conn.exec_driver_sql(stmt)
+
+
+def _indexed(conn) -> bool:
+    return conn.dialect.name == "sqlite" and conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    ).first() is not None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    if not _indexed(conn):
+        return
+    for table, column in TABLES.items():
+        _drop(conn, table)
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN fts_rowid INTEGER")
+        conn.exec_driver_sql(f"UPDATE {table} SET fts_rowid = rowid")
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX ix_{table}_fts_rowid ON {table} (fts_rowid)")
+        _create(conn, table, column, "fts_rowid")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if not _indexed(conn):
+        return
+    for table, column in TABLES.items():
+        _drop(conn, table)
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{table}_fts_rowid")
+        conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN fts_rowid")
+        _create(conn, table, column, "rowid")
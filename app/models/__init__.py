@@ -3,5 +3,8 @@ from .user import User
 from .conversation import Conversation
 from .message import Message
 from .file import File
+from .conversation_context import ConversationContext
+from .conversation_archive import ConversationArchive
+from .blob import Blob
 
-__all__ = ["User", "Conversation", "Message", "File"]
+__all__ = ["User", "Conversation", "Message", "File", "ConversationContext", "ConversationArchive", "Blob"]
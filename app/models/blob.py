@@ -0,0 +1,16 @@
+from sqlalchemy import String, DateTime, func, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from ..db import Base
+
+
+class Blob(Base):
+    """One stored copy of some file content, shared by every ``File`` with that content."""
+
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    path: Mapped[str] = mapped_column(String(1024), nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Number of File rows pointing here; the object is removed when it drops to zero
+    ref_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), nullable=False)
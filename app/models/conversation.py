@@ -2,13 +2,15 @@ import uuid
 from sqlalchemy import String, DateTime, func, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from ..db import Base
-from sqlalchemy import String, DateTime, func, ForeignKey, Boolean
+from sqlalchemy import String, DateTime, func, ForeignKey, Boolean, Integer, Index
 
 def _uuid() -> str:
     return uuid.uuid4().hex
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    # Serves the sidebar: one user's (un)archived conversations, newest first
+    __table_args__ = (Index("ix_conversations_user_archived_created", "user_id", "archived", "created_at"),)
 
     id: Mapped[str] = mapped_column(String(32), primary_key=True, default=_uuid)
     title: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -16,10 +18,24 @@ class Conversation(Base):
     archived: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="0")
     archived_at: Mapped[str | None] = mapped_column(DateTime(timezone=False), nullable=True)
 
+    # Sidebar summary, maintained on message writes (see services/summaries.py)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    last_message_preview: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    last_message_at: Mapped[str | None] = mapped_column(DateTime(timezone=False), nullable=True)
+    # Bumped on every change to the conversation or its messages; served as the ETag
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    # Tip of the branch being shown and continued; the history is its ancestor path.
+    # Not a foreign key, which would make conversations and messages reference each other.
+    active_leaf_id: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    # Highest Message.seq handed out; never decreases, so numbers are not reused
+    last_seq: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
     created_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), nullable=False)
     updated_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     user: Mapped["User"] = relationship("User", back_populates="conversations")
     messages: Mapped[list["Message"]] = relationship(
-        "Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.created_at.asc()"
+        "Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.seq.asc()",
+        # Messages (and their message_files rows) go through ON DELETE CASCADE instead of being loaded
+        passive_deletes=True,
     )
\ No newline at end of file
@@ -0,0 +1,19 @@
+from sqlalchemy import String, DateTime, func, ForeignKey, LargeBinary, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from ..db import Base
+
+
+class ConversationArchive(Base):
+    """An archived conversation's messages, compacted into one compressed blob."""
+
+    __tablename__ = "conversation_archives"
+
+    conversation_id: Mapped[str] = mapped_column(
+        String(32), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    codec: Mapped[str] = mapped_column(String(16), nullable=False)  # gzip or zstd
+    # Compressed JSON: every message of every branch, with its file ids
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    raw_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), nullable=False)
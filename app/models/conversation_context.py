@@ -0,0 +1,20 @@
+from sqlalchemy import String, DateTime, func, ForeignKey, LargeBinary, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from ..db import Base
+
+
+class ConversationContext(Base):
+    """Ollama ``context`` token array left by the last turn of a conversation for one model."""
+
+    __tablename__ = "conversation_contexts"
+
+    conversation_id: Mapped[str] = mapped_column(
+        String(32), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    model: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # Packed little-endian uint32 token ids
+    context: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    token_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Assistant message that ended the turn; anything newer is what the next turn must send
+    last_message_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    updated_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -7,6 +7,7 @@ from sqlalchemy import (
     Integer,
     Table,
     Column,
+    Index,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -22,22 +23,28 @@ message_files = Table(
     Base.metadata,
     Column("message_id", String(32), ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True),
     Column("file_id", String(32), ForeignKey("files.id", ondelete="CASCADE"), primary_key=True),
+    # The primary key only covers lookups by message_id
+    Index("ix_message_files_file_id", "file_id"),
 )
 
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (Index("ix_files_owner", "owner"),)
 
     id: Mapped[str] = mapped_column(String(32), primary_key=True, default=_uuid)
     mime_type: Mapped[str] = mapped_column(String(255), nullable=False)
     size: Mapped[int] = mapped_column(Integer, nullable=False)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
+    # The shared blob's path (blobs/ab/abcd…), or a per-file path for files not yet deduplicated
     path: Mapped[str] = mapped_column(String(1024), nullable=False)
     owner: Mapped[str] = mapped_column(String(32), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Hex SHA-256 of the content, computed while uploading
+    sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
     upload_date: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), nullable=False)
 
     messages: Mapped[list["Message"]] = relationship(
-        "Message", secondary=message_files, back_populates="files"
+        "Message", secondary=message_files, back_populates="files", passive_deletes=True
     )
 
     @property
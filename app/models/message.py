@@ -1,22 +1,76 @@
 import uuid
-from sqlalchemy import String, Text, DateTime, func, ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import String, Text, DateTime, func, ForeignKey, Integer, Index, event, inspect, update
+from sqlalchemy.orm import Mapped, Session, mapped_column, relationship, validates
 from ..db import Base
 from .file import message_files
+from ..tokens import estimate_tokens
 
 def _uuid() -> str:
     return uuid.uuid4().hex
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_seq", "conversation_id", "seq", unique=True),
+        Index("ix_messages_parent_id", "parent_id"),
+    )
 
     id: Mapped[str] = mapped_column(String(32), primary_key=True, default=_uuid)
     conversation_id: Mapped[str] = mapped_column(String(32), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    # Messages form a tree; edits add a sibling instead of rewriting history. Left
+    # unset, it is filled in on flush with the conversation's active leaf (see below);
+    # pass parent_id explicitly (None for a root) to branch.
+    parent_id: Mapped[str | None] = mapped_column(String(32), ForeignKey("messages.id"), nullable=True)
     role: Mapped[str] = mapped_column(String(16), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
-    created_at: Mapped[str] = mapped_column(DateTime(timezone=False), server_default=func.now(), nullable=False)
+    # Estimated prompt tokens, kept in sync with content so history assembly never re-tokenizes
+    token_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    # Position in the conversation, assigned on flush from conversations.last_seq (see below)
+    seq: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=False), default=datetime.utcnow, server_default=func.now(), nullable=False)
 
     conversation: Mapped["Conversation"] = relationship("Conversation", back_populates="messages")
     files: Mapped[list["File"]] = relationship(
-        "File", secondary=message_files, back_populates="messages"
+        "File", secondary=message_files, back_populates="messages", passive_deletes=True
     )
+
+    @validates("content")
+    def _count_tokens(self, _key: str, content: str) -> str:
+        self.token_count = estimate_tokens(content or "")
+        return content
+
+
+@event.listens_for(Session, "before_flush")
+def _assign_seq(session: Session, _ctx, _instances) -> None:
+    # Reserve a block of numbers per conversation with one UPDATE ... RETURNING;
+    # the row lock it takes serializes concurrent writers to the same conversation.
+    # The same statement returns the active leaf that appended messages hang off;
+    # the summary hook moves the leaf to the newest message after the insert.
+    pending = defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, Message) and not obj.seq:
+            pending[obj.conversation_id].append(obj)
+    if not pending:
+        return
+    conversations = Base.metadata.tables["conversations"]
+    conn = session.connection()
+    for conversation_id, msgs in pending.items():
+        row = conn.execute(
+            update(conversations)
+            .where(conversations.c.id == conversation_id)
+            .values(last_seq=conversations.c.last_seq + len(msgs))
+            .returning(conversations.c.last_seq, conversations.c.active_leaf_id)
+        ).first()
+        last, leaf = row if row is not None else (len(msgs), None)
+        first = last - len(msgs) + 1
+        # Session.add order, which is also the order the unit of work inserts in
+        msgs.sort(key=lambda m: inspect(m).insert_order)
+        for offset, msg in enumerate(msgs):
+            msg.seq = first + offset
+            if msg.id is None:
+                msg.id = _uuid()
+            if not inspect(msg).attrs.parent_id.history.added:
+                msg.parent_id = leaf
+            leaf = msg.id
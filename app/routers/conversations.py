@@ -1,26 +1,38 @@
 from datetime import datetime
-import json
 from typing import Any, AsyncGenerator, Dict, List
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Security
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException, Query, Request, Response, Security
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
-import httpx
-from sqlalchemy import or_
-from sqlalchemy.orm import Session, joinedload
+from starlette.background import BackgroundTask
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
-from ..db import get_db
+from ..db import get_async_db, get_db
 from ..models import Conversation, Message, File
+from ..services import (
+    admit, backend_pool, cold_storage, context_store, conversation_purger, file_service, message_writer,
+    ollama_client, refresh_summary, sse, stream_stats, StreamWatcher,
+)
+from ..services.branches import active_path, branch_tip, leaves, leaves_of, path_of
+from ..services.history import context_budget, load_history
+from ..services.summaries import PREVIEW_CHARS
+from ..services.search import archived_matches, message_match, search as search_index, title_match
 from ..schemas import (
+    BranchOut,
     ConversationCreate,
     ConversationOut,
+    ConversationSummary,
     ConversationUpdate,
     ConversationWithMessages,
+    SearchHit,
     MessageCreate,
     MessageOut,
     MessageUpdate,
+    PurgeJobOut,
 )
-from ..settings import DEFAULT_MODEL, OLLAMA_HOST
+from ..settings import DEFAULT_MODEL, STREAM_PARTIAL_POLICY
 
 
 bearer_scheme = HTTPBearer()
@@ -39,6 +51,64 @@ def _require_user(request: Request) -> str:
     return uid
 
 
+def _all_cold(db: Session, convo: Conversation) -> List[Any] | None:
+    """Every message of an archived conversation from cold storage, or ``None`` while it's hot."""
+    return cold_storage.messages(db, convo.id) if convo.archived else None
+
+
+def _active_messages(db: Session, convo: Conversation) -> List[Any]:
+    cold = _all_cold(db, convo)
+    if cold is not None:
+        return path_of(cold, convo.active_leaf_id)
+    # Files by message id in a second query; joining them into the path
+    # query makes SQLite materialize all of message_files
+    return db.scalars(active_path(convo.id).options(selectinload(Message.files))).all()
+
+
+def _thaw(db: Session, convo: Conversation) -> None:
+    # Writes need the rows back in the hot table
+    if convo.archived and cold_storage.thaw(db, convo.id):
+        db.flush()
+
+
+def _with_urls(messages: List[Any]) -> List[Any]:
+    # Resolve every attachment's public_url in one batch; serialization then reads the cache
+    file_service.public_urls(f.path for m in messages for f in m.files)
+    return messages
+
+
+def _with_messages(db: Session, convo: Conversation) -> Dict[str, Any]:
+    return {
+        "id": convo.id,
+        "title": convo.title,
+        "archived": convo.archived,
+        "active_leaf_id": convo.active_leaf_id,
+        "messages": _with_urls(_active_messages(db, convo)),
+    }
+
+
+def _conditional(
+    db: Session, request: Request, response: Response, conversation_id: str, user_id: str
+) -> Response | None:
+    """Answer a poll from the conversation's version alone.
+
+    Sets the ``ETag`` and returns a 304 response when ``If-None-Match``
+    already carries it; raises 404 for conversations the user can't see.
+    """
+    version = db.scalar(
+        select(Conversation.version).where(Conversation.id == conversation_id, Conversation.user_id == user_id)
+    )
+    if version is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    headers = {"ETag": f'"{conversation_id}.{version}"', "Cache-Control": "private, no-cache"}
+    sent = request.headers.get("if-none-match")
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    if sent and (sent.strip() == "*" or headers["ETag"] in {t.strip().removeprefix("W/") for t in sent.split(",")}):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 @router.post("", response_model=ConversationOut, summary="Create conversation")
 def create_conversation(
     payload: ConversationCreate,
@@ -53,14 +123,31 @@ def create_conversation(
     return convo
 
 
+# Columns the sidebar needs; selecting them directly avoids hydrating ORM objects
+_SUMMARY_COLUMNS = (
+    Conversation.id,
+    Conversation.title,
+    Conversation.archived,
+    Conversation.created_at,
+    Conversation.updated_at,
+    Conversation.message_count,
+    Conversation.last_message_preview,
+    Conversation.last_message_at,
+)
+
+
 @router.get(
     "",
-    response_model=List[ConversationOut],
+    response_model=List[ConversationSummary],
     summary="List conversations",
-    description="Optional `search` matches title or any message content.",
+    description=(
+        "Newest first. Optional `search` matches title or any message content. "
+        "With `limit`, pass the `X-Next-Cursor` response header back as `cursor` for the next page."
+    ),
 )
 def list_conversations(
     request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     search: str | None = Query(
         default=None, description="Search in conversation title and messages"
@@ -68,41 +155,132 @@ def list_conversations(
     include_archived: bool = Query(
         default=False, description="Include archived conversations"
     ),
+    limit: int | None = Query(default=None, ge=1, le=200, description="Page size"),
+    cursor: str | None = Query(default=None, description="Id of the last conversation of the previous page"),
 ):
     user_id = _require_user(request)
     q = (
-        db.query(Conversation)
+        db.query(*_SUMMARY_COLUMNS)
         .filter(Conversation.user_id == user_id)
-        .options(joinedload(Conversation.messages).joinedload(Message.files))
-        .order_by(Conversation.created_at.desc())
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
     )
-    if not include_archived:
-        q = q.filter(Conversation.archived == False)  # noqa: E712
-    if search:
-        like = f"%{search}%"
+    if cursor:
+        # Keyset on (created_at, id); comparing against the stored row avoids
+        # round-tripping timestamps through the cursor
+        after = (
+            select(Conversation.created_at)
+            .where(Conversation.id == cursor, Conversation.user_id == user_id)
+            .scalar_subquery()
+        )
         q = q.filter(
             or_(
-                Conversation.title.ilike(like),
-                Conversation.messages.any(Message.content.ilike(like)),
+                Conversation.created_at < after,
+                and_(Conversation.created_at == after, Conversation.id < cursor),
             )
         )
-    return q.all()
+    if not include_archived:
+        q = q.filter(Conversation.archived == False)  # noqa: E712
+    if search:
+        matches = [title_match(db, search), Conversation.messages.any(message_match(db, search))]
+        if include_archived:
+            # Compacted conversations' messages are only in cold storage
+            cold = archived_matches(db, user_id, search)
+            if cold:
+                matches.append(Conversation.id.in_(cold))
+        q = q.filter(or_(*matches))
+    if limit is None:
+        return q.all()
+    rows = q.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = rows[-1].id
+    return rows
+
+
+@router.get(
+    "/search",
+    response_model=List[SearchHit],
+    summary="Search conversations and messages",
+    description=(
+        "Ranked matches on conversation titles and message content, with highlighted snippets. "
+        "Every word must match (as a prefix). Pass the `X-Next-Cursor` response header back as `cursor` for the next page."
+    ),
+)
+def search_conversations(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, description="Search text"),
+    db: Session = Depends(get_db),
+    include_archived: bool = Query(default=False, description="Include archived conversations"),
+    limit: int = Query(default=20, ge=1, le=100, description="Page size"),
+    cursor: str | None = Query(default=None, description="Opaque cursor from the previous page"),
+):
+    user_id = _require_user(request)
+    offset = int(cursor) if cursor and cursor.isdigit() else 0
+    hits = search_index(db, user_id, q, limit + 1, offset, include_archived)
+    if len(hits) > limit:
+        hits = hits[:limit]
+        response.headers["X-Next-Cursor"] = str(offset + limit)
+    return hits
+
+
+@router.delete(
+    "",
+    response_model=PurgeJobOut,
+    summary="Delete conversations in bulk",
+    description=(
+        "Deletes the conversations matching every given filter: `ids`, `archived_before` "
+        "(archived before that time) and/or `created_before`. Small purges finish before the "
+        "response (200); large ones run in the background (202), pollable at `Location`."
+    ),
+)
+def purge_conversations(
+    request: Request,
+    response: Response,
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+    ids: List[str] | None = Query(default=None, description="Conversation ids"),
+    archived_before: datetime | None = Query(default=None, description="Archived before this time"),
+    created_before: datetime | None = Query(default=None, description="Created before this time"),
+):
+    user_id = _require_user(request)
+    if not ids and archived_before is None and created_before is None:
+        raise HTTPException(status_code=400, detail="Pass ids, archived_before or created_before")
+    job = conversation_purger.submit(conversation_purger.plan(db, user_id, ids, archived_before, created_before))
+    db.close()
+    if conversation_purger.inline(job):
+        return conversation_purger.run(job).to_dict()
+    background.add_task(conversation_purger.run, job)
+    response.status_code = 202
+    response.headers["Location"] = str(request.url_for("get_purge_job", job_id=job.id))
+    return job.to_dict()
+
+
+@router.get("/purges/{job_id}", response_model=PurgeJobOut, summary="Bulk deletion status")
+def get_purge_job(job_id: str, request: Request):
+    user_id = _require_user(request)
+    job = conversation_purger.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return job.to_dict()
 
 
-@router.get("/{conversation_id}", response_model=ConversationWithMessages)
+@router.get(
+    "/{conversation_id}",
+    response_model=ConversationWithMessages,
+    description="Sends an `ETag`; a matching `If-None-Match` gets an empty 304.",
+)
 def get_conversation(
-    conversation_id: str, request: Request, db: Session = Depends(get_db)
+    conversation_id: str, request: Request, response: Response, db: Session = Depends(get_db)
 ):
     user_id = _require_user(request)
-    convo = (
-        db.query(Conversation)
-        .options(joinedload(Conversation.messages).joinedload(Message.files))
-        .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
-        .first()
-    )
-    if not convo:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    return convo
+    # Replies may still be in the write-behind queue; let them land first
+    message_writer.wait_for_sync(conversation_id)
+    not_modified = _conditional(db, request, response, conversation_id, user_id)
+    if not_modified:
+        return not_modified
+    convo = db.get(Conversation, conversation_id)
+    return _with_messages(db, convo)
 
 
 @router.delete("/{conversation_id}", status_code=204)
@@ -131,6 +309,7 @@ def update_conversation(
     conversation_id: str,
     payload: ConversationUpdate,
     request: Request,
+    background: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     user_id = _require_user(request)
@@ -144,7 +323,12 @@ def update_conversation(
 
     if payload.title is not None:
         convo.title = payload.title
-    if payload.archived is not None:
+    if payload.archived is not None and bool(payload.archived) != convo.archived:
+        if payload.archived:
+            # Messages move to cold storage once the response is sent
+            background.add_task(cold_storage.compact_later, conversation_id)
+        else:
+            cold_storage.thaw(db, conversation_id)
         convo.archived = bool(payload.archived)
         convo.archived_at = datetime.utcnow() if convo.archived else None
 
@@ -157,36 +341,40 @@ def update_conversation(
     "/{conversation_id}/messages",
     response_model=List[MessageOut],
     summary="List messages in a conversation",
-    description="Optional `search` matches message content.",
+    description=(
+        "Optional `search` matches message content. "
+        "Sends an `ETag`; a matching `If-None-Match` gets an empty 304."
+    ),
 )
 def list_messages(
     conversation_id: str,
     request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     search: str | None = Query(default=None, description="Search in message content"),
 ):
     user_id = _require_user(request)
-    convo = (
-        db.query(Conversation)
-        .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
-        .first()
-    )
-    if not convo:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-
-    q = (
+    # Replies may still be in the write-behind queue; let them land first
+    message_writer.wait_for_sync(conversation_id)
+    not_modified = _conditional(db, request, response, conversation_id, user_id)
+    if not_modified:
+        return not_modified
+
+    convo = db.get(Conversation, conversation_id)
+    if not search:
+        return _with_urls(_active_messages(db, convo))
+    # Search covers every branch
+    cold = _all_cold(db, convo)
+    if cold is not None:
+        return _with_urls([m for m in cold if search.casefold() in m.content.casefold()])
+    return _with_urls(
         db.query(Message)
-        .filter(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at.asc())
-        .options(joinedload(Message.files))
+        .filter(Message.conversation_id == conversation_id, message_match(db, search))
+        .order_by(Message.seq.asc())
+        .options(selectinload(Message.files))
+        .all()
     )
 
-    if search:
-        like = f"%{search}%"
-        q = q.filter(Message.content.ilike(like))
-
-    return q.all()
-
 
 @router.post(
     "/{conversation_id}/messages",
@@ -200,6 +388,8 @@ def add_message(
     db: Session = Depends(get_db),
 ):
     user_id = _require_user(request)
+    # Replies may still be in the write-behind queue; let them land first
+    message_writer.wait_for_sync(conversation_id)
     convo = (
         db.query(Conversation)
         .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
@@ -207,6 +397,7 @@ def add_message(
     )
     if not convo:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    _thaw(db, convo)
     msg = Message(conversation_id=conversation_id, role=body.role, content=body.content)
     if body.file_ids:
         files = (
@@ -225,7 +416,10 @@ def add_message(
     "/{conversation_id}/messages/{message_id}",
     response_model=MessageOut,
     summary="Edit a message",
-    description="If content or file attachments change, subsequent messages are removed.",
+    description=(
+        "If content or file attachments change, the edit is stored as a new sibling of the message "
+        "and becomes the active branch; the original branch is kept (see `/branches`)."
+    ),
 )
 def edit_message(
     conversation_id: str,
@@ -235,6 +429,8 @@ def edit_message(
     db: Session = Depends(get_db),
 ):
     user_id = _require_user(request)
+    # Replies may still be in the write-behind queue; let them land first
+    message_writer.wait_for_sync(conversation_id)
     convo = (
         db.query(Conversation)
         .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
@@ -242,48 +438,106 @@ def edit_message(
     )
     if not convo:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    _thaw(db, convo)
 
     msg = (
         db.query(Message)
-        .options(joinedload(Message.files))
+        .options(selectinload(Message.files))
         .filter(Message.id == message_id, Message.conversation_id == conversation_id)
         .first()
     )
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    old_content = msg.content
-    old_file_ids = {f.id for f in msg.files}
-
-    if body.content is not None:
-        msg.content = body.content
+    content_changed = body.content is not None and body.content != msg.content
+    files_changed = (
+        body.file_ids is not None and set(body.file_ids) != {f.id for f in msg.files}
+    )
+    if not (content_changed or files_changed):
+        db.commit()
+        return msg
+
+    # Branch off the same parent; the ancestors are shared, not copied
+    edited = Message(
+        conversation_id=conversation_id,
+        parent_id=msg.parent_id,
+        role=msg.role,
+        content=body.content if body.content is not None else msg.content,
+    )
     if body.file_ids is not None:
-        files = (
+        edited.files = (
             db.query(File)
             .filter(File.id.in_(body.file_ids), File.owner == user_id)
             .all()
         )
-        msg.files = files
+    else:
+        edited.files = list(msg.files)
+    db.add(edited)
+    db.commit()
+    db.refresh(edited)
+    return edited
 
-    content_changed = body.content is not None and body.content != old_content
-    files_changed = (
-        body.file_ids is not None and set(body.file_ids) != old_file_ids
-    )
 
-    if content_changed or files_changed:
-        (
-            db.query(Message)
-            .filter(
-                Message.conversation_id == conversation_id,
-                Message.created_at >= msg.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                Message.id != msg.id,
-            )
-            .delete(synchronize_session=False)
+@router.get(
+    "/{conversation_id}/branches",
+    response_model=List[BranchOut],
+    summary="List branches",
+    description="One entry per branch tip, oldest first.",
+)
+def list_branches(conversation_id: str, request: Request, db: Session = Depends(get_db)):
+    user_id = _require_user(request)
+    message_writer.wait_for_sync(conversation_id)
+    convo = (
+        db.query(Conversation)
+        .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
+        .first()
+    )
+    if not convo:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    cold = _all_cold(db, convo)
+    return [
+        BranchOut(
+            leaf_id=leaf.id,
+            parent_id=leaf.parent_id,
+            role=leaf.role,
+            preview=leaf.content[:PREVIEW_CHARS],
+            created_at=leaf.created_at,
+            active=leaf.id == convo.active_leaf_id,
         )
+        for leaf in (leaves(db, conversation_id) if cold is None else leaves_of(cold))
+    ]
+
 
+@router.post(
+    "/{conversation_id}/branches/{message_id}",
+    response_model=ConversationWithMessages,
+    summary="Switch branch",
+    description=(
+        "Makes the branch through `message_id` active, at its newest tip. "
+        "Later messages and replies continue from there."
+    ),
+)
+def switch_branch(conversation_id: str, message_id: str, request: Request, db: Session = Depends(get_db)):
+    user_id = _require_user(request)
+    message_writer.wait_for_sync(conversation_id)
+    convo = (
+        db.query(Conversation)
+        .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
+        .first()
+    )
+    if not convo:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    _thaw(db, convo)
+    tip = branch_tip(db, conversation_id, message_id)
+    if tip is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    if tip != convo.active_leaf_id:
+        convo.active_leaf_id = tip
+        db.flush()
+        refresh_summary(db.connection(), conversation_id)
     db.commit()
-    db.refresh(msg)
-    return msg
+    db.refresh(convo)
+    return _with_messages(db, convo)
 
 
 @router.post(
@@ -294,52 +548,93 @@ async def generate_reply(
     conversation_id: str,
     request: Request,
     body: Dict[str, Any] | None = Body(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Call the model with the full conversation and stream back the reply."""
     user_id = _require_user(request)
-    convo = (
-        db.query(Conversation)
-        .options(joinedload(Conversation.messages))
-        .filter(Conversation.id == conversation_id, Conversation.user_id == user_id)
-        .first()
+    archived = await db.scalar(
+        select(Conversation.archived).where(
+            Conversation.id == conversation_id, Conversation.user_id == user_id
+        )
     )
-    if not convo:
+    if archived is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    if archived and await db.run_sync(cold_storage.thaw, conversation_id):
+        await db.commit()
 
     model = (body or {}).get("model", DEFAULT_MODEL)
-    messages = [{"role": m.role, "content": m.content} for m in convo.messages]
+    await message_writer.wait_for(conversation_id)
+    # The reply hangs off the message the model answers; set it now, since the
+    # writer only fills in the default on flush, after the done event is sent
+    leaf_id = await db.scalar(select(Conversation.active_leaf_id).where(Conversation.id == conversation_id))
+    budget = context_budget(model)
+    cont = await context_store.prepare(db, conversation_id, model, budget)
+    if cont:
+        path, req = "/api/generate", cont.payload(model, stream=True)
+    else:
+        messages = await load_history(db, conversation_id, budget)
+        path, req = "/api/chat", {"model": model, "messages": messages, "stream": True}
+    slot = await admit(request, model)
 
     async def event_stream() -> AsyncGenerator[bytes, None]:
         buffer: List[str] = []
-        async with httpx.AsyncClient(timeout=None) as client:
-            req = {"model": model, "messages": messages, "stream": True}
-            async with client.stream("POST", f"{OLLAMA_HOST}/api/chat", json=req) as resp:
+        enc = sse.DeltaEncoder()
+        frames = sse.FrameBuffer()
+
+        def persist_partial() -> None:
+            if buffer and STREAM_PARTIAL_POLICY == "persist":
+                message_writer.submit_nowait(
+                    Message(
+                        conversation_id=conversation_id,
+                        parent_id=leaf_id,
+                        role="assistant",
+                        content="".join(buffer),
+                        files=[],
+                    )
+                )
+                stream_stats.partials_persisted += 1
+
+        watcher = StreamWatcher(request, model, on_abandon=persist_partial)
+        async with watcher, slot, backend_pool.acquire(model, affinity=conversation_id) as backend:
+            async with ollama_client.stream("POST", f"{backend.url}{path}", json=req) as resp:
                 resp.raise_for_status()
-                async for line in resp.aiter_lines():
+                async for line, due in frames.paced(resp.aiter_lines()):
+                    if due:
+                        yield due
                     if not line:
                         continue
-                    chunk = json.loads(line)
+                    if await watcher.disconnected():
+                        return
+                    chunk = sse.loads(line)
                     if chunk.get("done"):
+                        watcher.complete(chunk)
                         reply = "".join(buffer)
-                        msg = Message(conversation_id=conversation_id, role="assistant", content=reply)
-                        db.add(msg)
-                        db.commit()
-                        db.refresh(msg)
+                        msg = Message(
+                            conversation_id=conversation_id, parent_id=leaf_id, role="assistant", content=reply, files=[]
+                        )
+                        await message_writer.submit(msg)
+                        if cont:
+                            context_store.save_later(conversation_id, model, chunk.get("context"), msg.id)
                         payload = {
-                            "message": MessageOut.model_validate(msg).model_dump(),
+                            "message": MessageOut.model_validate(msg).model_dump(mode="json"),
                             "done": True,
                         }
-                        yield f"data: {json.dumps(payload)}\n\n".encode()
+                        yield frames.flush() + sse.event(payload)
                         return
                     delta = (
                         chunk.get("message", {}).get("content")
                         or chunk.get("response", "")
                         or ""
                     )
+                    watcher.token()
                     if delta:
                         buffer.append(delta)
-                        yield f"data: {json.dumps({'delta': delta})}\n\n".encode()
+                        if out := frames.push(enc.delta(delta)):
+                            yield out
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(slot.release),
+    )
 
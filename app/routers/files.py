@@ -1,19 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File as FastAPIFile, Security, Response
+import re
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, UploadFile, File as FastAPIFile, Security, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
 
 from ..db import get_db
-from ..schemas import FileOut
-from ..settings import FILE_ALLOWED_MIME_TYPES, FILE_MAX_SIZE
-from ..services import file_service
+from ..models import File
+from ..schemas import FileClaim, FileOut, FileUrlOut
+from ..settings import FILE_ALLOWED_MIME_TYPES, FILE_URL_TTL
+from ..services import derivative_store, file_service
+from ..services.files import UploadRejected, blob_path
 
 bearer_scheme = HTTPBearer()
+# Content links may be signed instead of carrying a token
+optional_bearer_scheme = HTTPBearer(auto_error=False)
 
-router = APIRouter(
-    prefix="/files",
-    tags=["files"],
-    dependencies=[Security(bearer_scheme)],
-)
+router = APIRouter(prefix="/files", tags=["files"])
 
 
 def _require_user(request: Request) -> str:
@@ -23,9 +29,10 @@ def _require_user(request: Request) -> str:
     return uid
 
 
-@router.post("/upload", response_model=FileOut, summary="Upload a file")
+@router.post("/upload", response_model=FileOut, summary="Upload a file", dependencies=[Security(bearer_scheme)])
 async def upload_file(
     request: Request,
+    background: BackgroundTasks,
     upload: UploadFile = FastAPIFile(...),
     db: Session = Depends(get_db),
 ):
@@ -33,13 +40,135 @@ async def upload_file(
     if FILE_ALLOWED_MIME_TYPES and upload.content_type not in FILE_ALLOWED_MIME_TYPES:
         raise HTTPException(status_code=400, detail="File type not allowed")
 
-    data = await upload.read()
-    if len(data) > FILE_MAX_SIZE:
-        raise HTTPException(status_code=400, detail="File too large")
-    return file_service.upload(upload, data, user_id, db)
+    try:
+        file_obj = await file_service.upload(upload, user_id, db)
+    except UploadRejected as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
+    # Precompute what the model will be sent, so turns don't re-decode the file
+    background.add_task(derivative_store.build_later, file_obj.path, file_obj.mime_type)
+    return file_obj
+
+
+@router.post(
+    "/by-hash",
+    response_model=FileOut,
+    summary="Add a file from content already uploaded",
+    dependencies=[Security(bearer_scheme)],
+)
+def claim_file(
+    payload: FileClaim,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    user_id = _require_user(request)
+    file_obj = file_service.claim(db, user_id, payload.sha256, payload.name)
+    if file_obj is None:
+        raise HTTPException(status_code=404, detail="Content not found; upload it")
+    return file_obj
+
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _validators(file_obj: File) -> Tuple[str, str]:
+    """ETag and Cache-Control; content-addressed files never change, so they cache for good."""
+    if file_obj.sha256 and file_obj.path == blob_path(file_obj.sha256):
+        return f'"{file_obj.sha256}"', "private, max-age=31536000, immutable"
+    return f'"{file_obj.id}-{file_obj.size}"', "private, no-cache"
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """The single ``bytes=`` range asked for, as (start, end inclusive); ``None`` for the whole file."""
+    match = _RANGE.fullmatch(header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == "":
+        return None  # absent, multi-range or unparsable: send everything
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@router.get(
+    "/{file_id}/content", summary="Download a file's content", dependencies=[Security(optional_bearer_scheme)]
+)
+def file_content(
+    file_id: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    if signature is not None:
+        # Signed links skip the API key (see auth_middleware) and are checked here instead
+        if expires is None or not file_service.verify(file_id, expires, signature):
+            raise HTTPException(status_code=403, detail="Invalid or expired signature")
+        file_obj = db.get(File, file_id)
+    else:
+        file_obj = file_service.get(db, file_id, _require_user(request))
+    if not file_obj:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag, cache_control = _validators(file_obj)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Content-Disposition": f"inline; filename*=utf-8''{quote(file_obj.name)}",
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    size = file_service.size(file_obj)
+    if size is None:
+        raise HTTPException(status_code=404, detail="File content missing")
+    local = file_service.local_path(file_obj)
+    if local is not None:
+        # Starlette answers Range itself and uses the server's pathsend (zero-copy) extension when offered
+        return FileResponse(local, media_type=file_obj.mime_type, headers=headers)
+
+    if_range = request.headers.get("if-range")
+    span = _byte_range(request.headers.get("range"), size) if if_range in (None, etag) else None
+    start, end = span or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if span:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        file_service.read_range(file_obj, start, end - start + 1),
+        status_code=206 if span else 200,
+        media_type=file_obj.mime_type,
+        headers=headers,
+    )
+
+
+@router.post(
+    "/{file_id}/url",
+    response_model=FileUrlOut,
+    summary="Get a time-limited link to a file",
+    dependencies=[Security(bearer_scheme)],
+)
+def file_url(
+    file_id: str,
+    request: Request,
+    ttl: int = FILE_URL_TTL,
+    db: Session = Depends(get_db),
+):
+    user_id = _require_user(request)
+    file_obj = file_service.get(db, file_id, user_id)
+    if not file_obj:
+        raise HTTPException(status_code=404, detail="File not found")
+    ttl = max(1, min(ttl, FILE_URL_TTL))
+    url = file_service.signed_url(file_obj, str(request.url_for("file_content", file_id=file_id)), ttl)
+    if url is None:
+        raise HTTPException(status_code=501, detail="Signed URLs are not configured")
+    return FileUrlOut(url=url, expires_at=datetime.utcnow() + timedelta(seconds=ttl))
 
 
-@router.delete("/{file_id}", status_code=204, summary="Delete a file")
+@router.delete("/{file_id}", status_code=204, summary="Delete a file", dependencies=[Security(bearer_scheme)])
 def delete_file(
     file_id: str,
     request: Request,
@@ -1,14 +1,23 @@
-import json, time, uuid
+import time, uuid
 from typing import Any, Dict, List, AsyncGenerator
-import httpx
 from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Security
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db import get_db
+from ..db import get_async_db
 from ..models import Conversation, Message
-from ..settings import ALLOWED_MODELS, DEFAULT_MODEL, OLLAMA_HOST
+from ..services import sse
+from ..services import (
+    admission, admit, api_key_cache, backend_pool, cold_storage, context_store, conversation_purger,
+    derivative_store, embedding_batcher, message_writer, ollama_client, response_cache, stream_stats, StreamWatcher,
+)
+from ..services.embeddings import to_base64
+from ..services.history import context_budget, load_history, messages_tokens
+from ..services.response_cache import cache_key, is_deterministic
+from ..settings import ALLOWED_MODELS, DEFAULT_MODEL, OLLAMA_HEALTH_INTERVAL, STREAM_PARTIAL_POLICY
 
 
 bearer_scheme = HTTPBearer()
@@ -35,65 +44,115 @@ def map_options(body: Dict[str, Any]) -> Dict[str, Any]:
     if (s := body.get("stop")) is not None: opts["stop"] = s if isinstance(s, list) else [s]
     if (rp := body.get("presence_penalty")) is not None: opts["presence_penalty"] = rp
     if (fp := body.get("frequency_penalty")) is not None: opts["frequency_penalty"] = fp
+    if (sd := body.get("seed")) is not None: opts["seed"] = sd
     return opts
 
 @router.get("/v1/models")
 async def list_models():
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(f"{OLLAMA_HOST}/api/tags")
-        r.raise_for_status()
-        data = r.json()
-    installed = {m["name"] for m in data.get("models", [])}
+    # The health loop keeps the pool's view current; probe only when it's behind
+    await backend_pool.refresh_if_stale(OLLAMA_HEALTH_INTERVAL)
+    installed = backend_pool.installed_models()
+    if not installed and not any(b.healthy for b in backend_pool.backends):
+        raise HTTPException(status_code=502, detail="No Ollama backend available")
     visible = installed & ALLOWED_MODELS
     models = [{"id": name, "object": "model", "owned_by": "ollama", "created": now_ts()} for name in sorted(visible)]
     return {"object": "list", "data": models}
 
+def cache_key_for(request: Request, body: Dict[str, Any], kind: str, model: str, payload: Any, options: Dict[str, Any]) -> str | None:
+    if not response_cache.enabled or not is_deterministic(body): return None
+    if "no-cache" in request.headers.get("cache-control", ""): return None
+    return cache_key(kind, model, payload, options)
+
+async def replay_completion(model: str, data: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+    enc = sse.completion_encoder(make_id("cmpl"), now_ts(), model)
+    yield enc.delta(data.get("response", ""))
+    yield enc.final(choices=[{"index": 0, "text": "", "finish_reason": data.get("done_reason") or "stop", "logprobs": None}],
+                    usage=to_openai_usage(data))
+    yield sse.DONE
+
+async def replay_chat(model: str, data: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+    enc = sse.chat_encoder(make_id("chatcmpl"), now_ts(), model)
+    yield enc.delta((data.get("message") or {}).get("content", ""))
+    yield enc.final(choices=[{"index": 0, "delta": {}, "finish_reason": data.get("done_reason") or "stop"}],
+                    usage=to_openai_usage(data))
+    yield sse.DONE
+
 @router.post("/v1/completions")
-async def completions(body: Dict[str, Any] = Body(...)):
+async def completions(request: Request, body: Dict[str, Any] = Body(...)):
     model = body.get("model", DEFAULT_MODEL)
     prompt = body.get("prompt", "")
     stream = bool(body.get("stream", False))
     options = map_options(body)
+    key = cache_key_for(request, body, "completion", model, prompt, options)
 
     if stream:
+        cached = await response_cache.get(key) if key else None
+        if cached is not None:
+            return StreamingResponse(replay_completion(model, cached), media_type="text/event-stream")
+        slot = await admit(request, model)
+
         async def event_stream() -> AsyncGenerator[bytes, None]:
-            created = now_ts()
-            cid = make_id("cmpl")
-            async with httpx.AsyncClient(timeout=None) as client:
-                req = {"model": model, "prompt": prompt, "stream": True, "options": options}
-                async with client.stream("POST", f"{OLLAMA_HOST}/api/generate", json=req) as resp:
+            enc = sse.completion_encoder(make_id("cmpl"), now_ts(), model)
+            frames = sse.FrameBuffer()
+            buffer = []
+            req = {"model": model, "prompt": prompt, "stream": True, "options": options}
+            watcher = StreamWatcher(request, model, options.get("num_predict"))
+            async with watcher, slot, backend_pool.acquire(model) as backend:
+                async with ollama_client.stream("POST", f"{backend.url}/api/generate", json=req) as resp:
                     resp.raise_for_status()
-                    async for line in resp.aiter_lines():
+                    async for line, due in frames.paced(resp.aiter_lines()):
+                        if due: yield due
                         if not line: continue
-                        chunk = json.loads(line)
+                        if await watcher.disconnected(): return
+                        chunk = sse.loads(line)
                         if chunk.get("done"):
-                            usage = to_openai_usage(chunk)
-                            final = {"id": cid, "object": "text_completion", "created": created, "model": model,
-                                     "choices": [{"index": 0, "text": "", "finish_reason": chunk.get("done_reason") or "stop", "logprobs": None}],
-                                     "usage": usage}
-                            yield f"data: {json.dumps(final)}\n\n".encode()
-                            yield b"data: [DONE]\n\n"; return
+                            watcher.complete(chunk)
+                            if key: await response_cache.set(key, {**chunk, "response": "".join(buffer)})
+                            final = enc.final(choices=[{"index": 0, "text": "", "finish_reason": chunk.get("done_reason") or "stop", "logprobs": None}],
+                                              usage=to_openai_usage(chunk))
+                            yield frames.flush() + final + sse.DONE; return
                         delta = chunk.get("response", "")
-                        sse = {"id": cid, "object": "text_completion", "created": created, "model": model,
-                               "choices": [{"index": 0, "text": delta, "finish_reason": None, "logprobs": None}]}
-                        yield f"data: {json.dumps(sse)}\n\n".encode()
-        return StreamingResponse(event_stream(), media_type="text/event-stream")
-
-    async with httpx.AsyncClient(timeout=None) as client:
-        req = {"model": model, "prompt": prompt, "stream": False, "options": options}
-        r = await client.post(f"{OLLAMA_HOST}/api/generate", json=req); r.raise_for_status(); data = r.json()
+                        watcher.token()
+                        if key: buffer.append(delta)
+                        if out := frames.push(enc.delta(delta)): yield out
+        # The background task frees the slot if the generator never starts
+        return StreamingResponse(event_stream(), media_type="text/event-stream", background=BackgroundTask(slot.release))
+
+    req = {"model": model, "prompt": prompt, "stream": False, "options": options}
+
+    async def fetch() -> Dict[str, Any]:
+        slot = await admit(request, model)
+        async with slot, backend_pool.acquire(model) as backend:
+            r = await ollama_client.post(f"{backend.url}/api/generate", json=req); r.raise_for_status(); return r.json()
+
+    data = await response_cache.get_or_fetch(key, fetch) if key else await fetch()
     usage = to_openai_usage(data); text = data.get("response", "")
     return {"id": make_id("cmpl"), "object": "text_completion", "created": now_ts(), "model": model,
             "choices": [{"index": 0, "text": text, "finish_reason": data.get("done_reason") or "stop", "logprobs": None}],
             "usage": usage}
 
+def turn_messages(conversation_id: str, user_messages: List[Dict[str, Any]], reply: str, parent_id: str | None) -> List[Message]:
+    """A turn's rows chained under ``parent_id``, the leaf its history was read from.
+
+    Parents are set here rather than on flush: the turn is written behind the
+    response, and by then the conversation's active leaf may have moved.
+    """
+    rows = [Message(conversation_id=conversation_id, role=m.get("role","user"), content=m.get("content",""), files=[]) for m in user_messages]
+    rows.append(Message(conversation_id=conversation_id, role="assistant", content=reply, files=[]))
+    for row in rows:
+        row.id, row.parent_id = uuid.uuid4().hex, parent_id
+        parent_id = row.id
+    return rows
+
 @router.post("/v1/chat/completions")
 async def chat_completions(
     request: Request,
     body: Dict[str, Any] = Body(...),
-    x_conversation_id: str | None = Header(default=None, convert_underscores=False),
-    db: Session = Depends(get_db),
+    x_conversation_id: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_async_db),
 ):
+    # Older clients send the header with underscores, which Header() won't match
+    x_conversation_id = x_conversation_id or request.headers.get("x_conversation_id")
     model = body.get("model", DEFAULT_MODEL)
     user_messages: List[Dict[str, Any]] = body.get("messages", [])
     stream = bool(body.get("stream", False))
@@ -101,55 +160,83 @@ async def chat_completions(
 
     # Optional server-side history if X-Conversation-Id is provided
     history: List[Dict[str, str]] = []
+    convo = cont = leaf_id = None
     user_id = getattr(request.state, "user_id", None)
     if x_conversation_id:
-        q = db.query(Conversation).filter(Conversation.id == x_conversation_id)
-        if user_id: q = q.filter(Conversation.user_id == user_id)
-        convo = q.first()
+        q = select(Conversation).where(Conversation.id == x_conversation_id)
+        if user_id: q = q.where(Conversation.user_id == user_id)
+        convo = await db.scalar(q)
         if not convo:
             raise HTTPException(status_code=404, detail="Conversation not found")
-        if convo:
-            for m in convo.messages:
-                history.append({"role": m.role, "content": m.content})
+        # Archived conversations may be in cold storage; the turn appends to them
+        if convo.archived and await db.run_sync(cold_storage.thaw, convo.id):
+            await db.commit()
+        await message_writer.wait_for(convo.id)
+        leaf_id = await db.scalar(select(Conversation.active_leaf_id).where(Conversation.id == convo.id))
+        budget = context_budget(model, options)
+        # Continue from the previous turn's Ollama context when possible, else resend the trimmed history
+        cont = await context_store.prepare(db, convo.id, model, budget, user_messages)
+        if cont is None:
+            history = await load_history(db, convo.id, budget - messages_tokens(user_messages))
 
     merged_messages = history + user_messages
-    req = {"model": model, "messages": merged_messages, "stream": stream, "options": options}
+    if cont:
+        path, req = "/api/generate", cont.payload(model, stream, options)
+    else:
+        path, req = "/api/chat", {"model": model, "messages": merged_messages, "stream": stream, "options": options}
+    # Conversation-bound requests persist messages, so they always go upstream
+    key = None if convo else cache_key_for(request, body, "chat", model, merged_messages, options)
 
     if stream:
+        cached = await response_cache.get(key) if key else None
+        if cached is not None:
+            return StreamingResponse(replay_chat(model, cached), media_type="text/event-stream")
+        slot = await admit(request, model)
+
         async def event_stream() -> AsyncGenerator[bytes, None]:
-            created = now_ts()
-            cid = make_id("chatcmpl")
+            enc = sse.chat_encoder(make_id("chatcmpl"), now_ts(), model)
+            frames = sse.FrameBuffer()
             buffer = []
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", f"{OLLAMA_HOST}/api/chat", json=req) as resp:
+
+            def persist_partial() -> None:
+                if convo and user_messages and buffer and STREAM_PARTIAL_POLICY == "persist":
+                    message_writer.submit_nowait(*turn_messages(convo.id, user_messages, "".join(buffer), leaf_id))
+                    stream_stats.partials_persisted += 1
+
+            watcher = StreamWatcher(request, model, options.get("num_predict"), on_abandon=persist_partial)
+            async with watcher, slot, backend_pool.acquire(model, affinity=x_conversation_id) as backend:
+                async with ollama_client.stream("POST", f"{backend.url}{path}", json=req) as resp:
                     resp.raise_for_status()
-                    async for line in resp.aiter_lines():
+                    async for line, due in frames.paced(resp.aiter_lines()):
+                        if due: yield due
                         if not line: continue
-                        chunk = json.loads(line)
+                        if await watcher.disconnected(): return
+                        chunk = sse.loads(line)
                         if chunk.get("done"):
-                            usage = to_openai_usage(chunk)
+                            watcher.complete(chunk)
+                            if key: await response_cache.set(key, {**chunk, "message": {"role": "assistant", "content": "".join(buffer)}})
                             # persist last user msg + assistant reply if convo exists
                             if convo and user_messages:
-                                for msg in user_messages:
-                                    db.add(Message(conversation_id=convo.id, role=msg.get("role","user"), content=msg.get("content","")))
-                                db.add(Message(conversation_id=convo.id, role="assistant", content="".join(buffer)))
-                                db.commit()
-                            final = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
-                                     "choices": [{"index": 0, "delta": {}, "finish_reason": chunk.get("done_reason") or "stop"}],
-                                     "usage": usage}
-                            yield f"data: {json.dumps(final)}\n\n".encode()
-                            yield b"data: [DONE]\n\n"; return
+                                rows = turn_messages(convo.id, user_messages, "".join(buffer), leaf_id)
+                                await message_writer.submit(*rows)
+                                if cont: context_store.save_later(convo.id, model, chunk.get("context"), rows[-1].id)
+                            final = enc.final(choices=[{"index": 0, "delta": {}, "finish_reason": chunk.get("done_reason") or "stop"}],
+                                              usage=to_openai_usage(chunk))
+                            yield frames.flush() + final + sse.DONE; return
 
                         msg = chunk.get("message")
                         content_delta = (msg.get("content", "") if isinstance(msg, dict) else chunk.get("response", "")) or ""
+                        watcher.token()
                         buffer.append(content_delta)
-                        sse = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
-                               "choices": [{"index": 0, "delta": {"role": "assistant", "content": content_delta}, "finish_reason": None}]}
-                        yield f"data: {json.dumps(sse)}\n\n".encode()
-        return StreamingResponse(event_stream(), media_type="text/event-stream")
+                        if out := frames.push(enc.delta(content_delta)): yield out
+        return StreamingResponse(event_stream(), media_type="text/event-stream", background=BackgroundTask(slot.release))
 
-    async with httpx.AsyncClient(timeout=None) as client:
-        r = await client.post(f"{OLLAMA_HOST}/api/chat", json=req); r.raise_for_status(); data = r.json()
+    async def fetch() -> Dict[str, Any]:
+        slot = await admit(request, model)
+        async with slot, backend_pool.acquire(model, affinity=x_conversation_id) as backend:
+            r = await ollama_client.post(f"{backend.url}{path}", json=req); r.raise_for_status(); return r.json()
+
+    data = await response_cache.get_or_fetch(key, fetch) if key else await fetch()
 
     usage = to_openai_usage(data)
     content = data.get("message", {}).get("content") if isinstance(data.get("message"), dict) else data.get("response", "")
@@ -157,15 +244,33 @@ async def chat_completions(
 
     # persist if convo exists
     if convo and user_messages:
-        for msg in user_messages:
-            db.add(Message(conversation_id=convo.id, role=msg.get("role","user"), content=msg.get("content","")))
-        db.add(Message(conversation_id=convo.id, role="assistant", content=content))
-        db.commit()
+        rows = turn_messages(convo.id, user_messages, content, leaf_id)
+        await message_writer.submit(*rows)
+        if cont: context_store.save_later(convo.id, model, data.get("context"), rows[-1].id)
 
     return {"id": make_id("chatcmpl"), "object": "chat.completion", "created": now_ts(), "model": model,
             "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": data.get("done_reason") or "stop"}],
             "usage": usage}
 
+@router.post("/v1/embeddings")
+async def embeddings(body: Dict[str, Any] = Body(...)):
+    model = body.get("model", DEFAULT_MODEL)
+    raw = body.get("input")
+    inputs = [raw] if isinstance(raw, str) else raw
+    if not isinstance(inputs, list) or not inputs or not all(isinstance(t, str) for t in inputs):
+        raise HTTPException(status_code=400, detail="input must be a string or a non-empty list of strings")
+    encoding_format = body.get("encoding_format", "float")
+    if encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+
+    vectors, tokens = await embedding_batcher.embed(model, inputs)
+    encode = to_base64 if encoding_format == "base64" else (lambda v: v)
+    payload = {"object": "list", "model": model,
+               "data": [{"object": "embedding", "index": i, "embedding": encode(v)} for i, v in enumerate(vectors)],
+               "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+    # Vectors are plain floats/strings; skip jsonable_encoder's per-element walk
+    return Response(content=sse.dumps(payload), media_type="application/json")
+
 @router.get("/", include_in_schema=False, dependencies=[])
 def root():
     return JSONResponse(
@@ -176,3 +281,21 @@ def root():
 @router.get("/health", dependencies=[])
 def health():
     return {"ok": True}
+
+
+@router.get("/metrics", summary="Runtime metrics")
+def metrics():
+    return {
+        "auth_cache": api_key_cache.stats(),
+        "ollama_pool": ollama_client.stats(),
+        "backends": backend_pool.stats(),
+        "admission": admission.stats(),
+        "response_cache": response_cache.stats(),
+        "streams": stream_stats.stats(),
+        "embeddings": embedding_batcher.stats(),
+        "persistence": message_writer.stats(),
+        "continuation": context_store.stats(),
+        "purge": conversation_purger.stats(),
+        "archive": cold_storage.stats(),
+        "derivatives": derivative_store.stats(),
+    }
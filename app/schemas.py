@@ -36,6 +36,54 @@ class ConversationOut(BaseModel):
         from_attributes = True
 
 
+class ConversationSummary(ConversationOut):
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+
+
+class SearchHit(BaseModel):
+    conversation_id: str
+    title: Optional[str] = None
+    message_id: Optional[str] = None  # None for a title match
+    role: Optional[str] = None
+    snippet: str
+    score: float
+
+
+class BranchOut(BaseModel):
+    leaf_id: str
+    parent_id: Optional[str] = None
+    role: str
+    preview: str
+    created_at: datetime
+    active: bool
+
+
+class PurgeJobOut(BaseModel):
+    id: str
+    status: str  # pending, running, done or failed
+    conversations: int
+    messages: int
+    conversations_deleted: int
+    messages_deleted: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class FileClaim(BaseModel):
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$")
+    name: str = Field(..., max_length=255)
+
+
+class FileUrlOut(BaseModel):
+    url: str
+    expires_at: datetime
+
+
 class FileOut(BaseModel):
     id: str
     mime_type: str
@@ -43,6 +91,7 @@ class FileOut(BaseModel):
     name: str
     path: str
     owner: str
+    sha256: Optional[str] = None
     upload_date: datetime
     public_url: str
 
@@ -63,6 +112,7 @@ class MessageUpdate(BaseModel):
 
 class MessageOut(BaseModel):
     id: str
+    parent_id: Optional[str] = None
     role: str
     content: str
     files: List[FileOut] = []
@@ -75,7 +125,8 @@ class ConversationWithMessages(BaseModel):
     id: str
     title: Optional[str] = None
     archived: bool = False
-    messages: List[MessageOut]
+    active_leaf_id: Optional[str] = None
+    messages: List[MessageOut]  # the active branch, oldest first
 
     class Config:
         from_attributes = True
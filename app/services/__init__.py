@@ -1,3 +1,47 @@
 from .files import file_service, FileService
+from .auth_cache import api_key_cache, ApiKeyCache
+from .ollama import ollama_client, OllamaClient
+from .backends import backend_pool, BackendPool
+from .scheduler import admission, admit, AdmissionController
+from .response_cache import response_cache, ResponseCache
+from .streaming import stream_stats, StreamWatcher
+from . import sse
+from .embeddings import embedding_batcher, EmbeddingBatcher
+from .persistence import message_writer, MessageWriter
+from .continuation import context_store, ContextStore
+from .summaries import refresh_summary
+from .purge import conversation_purger, ConversationPurger
+from .archive import cold_storage, ColdStorage
+from .derivatives import derivative_store, DerivativeStore
 
-__all__ = ["file_service", "FileService"]
+__all__ = [
+    "file_service",
+    "FileService",
+    "api_key_cache",
+    "ApiKeyCache",
+    "ollama_client",
+    "OllamaClient",
+    "backend_pool",
+    "BackendPool",
+    "admission",
+    "admit",
+    "AdmissionController",
+    "response_cache",
+    "ResponseCache",
+    "stream_stats",
+    "StreamWatcher",
+    "sse",
+    "embedding_batcher",
+    "EmbeddingBatcher",
+    "message_writer",
+    "MessageWriter",
+    "context_store",
+    "ContextStore",
+    "refresh_summary",
+    "conversation_purger",
+    "ConversationPurger",
+    "cold_storage",
+    "ColdStorage",
+    "derivative_store",
+    "DerivativeStore",
+]
@@ -0,0 +1,255 @@
+import gzip
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.orm import Session, defer
+
+from ..db import SessionLocal
+from ..models import Conversation, ConversationArchive, File, Message
+from ..models.file import message_files
+from ..settings import ARCHIVE_BATCH_SIZE, ARCHIVE_CODEC
+from . import sse
+from .persistence import message_writer
+
+try:  # optional, better ratio and speed than gzip
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_Codec = Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]
+CODECS: Dict[str, _Codec] = {"gzip": (gzip.compress, gzip.decompress)}
+if zstandard is not None:
+    CODECS["zstd"] = (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+
+# Decoded archives kept for repeated reads
+CACHE_SIZE = 32
+
+_messages = Message.__table__
+_COLUMNS = ("id", "parent_id", "seq", "role", "content", "token_count", "created_at")
+
+
+class ColdStorage:
+    """Moves archived conversations' messages out of the hot ``messages`` table.
+
+    ``compact`` packs every message of a conversation (all branches, with
+    their file links) into one compressed row of ``conversation_archives``
+    and deletes the originals; the conversation row and its summary stay.
+    Reads decode the blob (``messages``) without touching the hot table;
+    ``thaw`` puts the rows back, for un-archiving and before any write.
+    """
+
+    def __init__(self, codec: str) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"Unknown or unavailable ARCHIVE_CODEC {codec!r}; have {sorted(CODECS)}")
+        self.codec = codec
+        self._cache: "OrderedDict[Tuple[str, Any], List[Dict[str, Any]]]" = OrderedDict()
+        self.compacted = 0
+        self.thawed = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def compact(self, db: Session, conversation_id: str) -> bool:
+        """Replace a conversation's message rows with an archive blob; the caller commits."""
+        if db.get(ConversationArchive, conversation_id) is not None:
+            return False
+        rows = db.execute(
+            select(*(_messages.c[name] for name in _COLUMNS))
+            .where(_messages.c.conversation_id == conversation_id)
+            .order_by(_messages.c.seq.asc())
+        ).all()
+        if not rows:
+            return False
+        files: Dict[str, List[str]] = {}
+        links = db.execute(
+            select(message_files.c.message_id, message_files.c.file_id).where(
+                message_files.c.message_id.in_(
+                    select(_messages.c.id).where(_messages.c.conversation_id == conversation_id)
+                )
+            )
+        )
+        for message_id, file_id in links:
+            files.setdefault(message_id, []).append(file_id)
+        payload = [
+            {**row._mapping, "created_at": row.created_at.isoformat(), "file_ids": files.get(row.id, [])}
+            for row in rows
+        ]
+        raw = sse.dumps(payload)
+        data = CODECS[self.codec][0](raw)
+        db.add(
+            ConversationArchive(
+                conversation_id=conversation_id,
+                codec=self.codec,
+                data=data,
+                message_count=len(rows),
+                raw_size=len(raw),
+            )
+        )
+        db.execute(
+            delete(Message).where(Message.conversation_id == conversation_id),
+            execution_options={"synchronize_session": False},
+        )
+        self.compacted += 1
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(data)
+        return True
+
+    def thaw(self, db: Session, conversation_id: str) -> bool:
+        """Restore an archived conversation's message rows; the caller commits."""
+        archive = db.get(ConversationArchive, conversation_id)
+        if archive is None:
+            return False
+        payload = self._decode(archive)
+        db.execute(
+            insert(_messages),
+            [
+                {**{name: m[name] for name in _COLUMNS},
+                 "conversation_id": conversation_id,
+                 "created_at": datetime.fromisoformat(m["created_at"])}
+                for m in payload
+            ],
+        )
+        wanted = {file_id for m in payload for file_id in m["file_ids"]}
+        # Files deleted while the conversation was archived are dropped from their messages
+        kept = set(db.scalars(select(File.id).where(File.id.in_(wanted)))) if wanted else set()
+        links = [
+            {"message_id": m["id"], "file_id": file_id}
+            for m in payload
+            for file_id in m["file_ids"]
+            if file_id in kept
+        ]
+        if links:
+            db.execute(insert(message_files), links)
+        self._cache.pop((archive.conversation_id, archive.created_at), None)
+        db.delete(archive)
+        self.thawed += 1
+        return True
+
+    def messages(self, db: Session, conversation_id: str) -> Optional[List[SimpleNamespace]]:
+        """Messages of an archived conversation, oldest first, or ``None`` if it isn't compacted."""
+        archive = db.get(ConversationArchive, conversation_id)
+        if archive is None:
+            return None
+        payload = self._decode(archive)
+        wanted = {file_id for m in payload for file_id in m["file_ids"]}
+        files = {f.id: f for f in db.query(File).filter(File.id.in_(wanted))} if wanted else {}
+        return [
+            SimpleNamespace(
+                id=m["id"],
+                parent_id=m["parent_id"],
+                role=m["role"],
+                content=m["content"],
+                created_at=datetime.fromisoformat(m["created_at"]),
+                files=[files[file_id] for file_id in m["file_ids"] if file_id in files],
+            )
+            for m in payload
+        ]
+
+    def search(
+        self, db: Session, user_id: str, matches: Callable[[str], bool]
+    ) -> Iterator[Tuple[str, Optional[str], Dict[str, Any]]]:
+        """(conversation id, title, message) for every archived message of the user that ``matches``.
+
+        The hot full-text index lost these rows at compaction, so this
+        decodes the user's archives (through the cache), newest first; its
+        cost grows with the user's archived history.
+        """
+        rows = db.execute(
+            select(ConversationArchive, Conversation.title)
+            .select_from(Conversation)
+            .join(ConversationArchive, ConversationArchive.conversation_id == Conversation.id)
+            .where(Conversation.user_id == user_id, Conversation.archived == True)  # noqa: E712
+            .order_by(Conversation.created_at.desc())
+            # Only loaded on a cache miss in _decode
+            .options(defer(ConversationArchive.data))
+        )
+        for archive, title in rows:
+            for message in reversed(self._decode(archive)):
+                if matches(message["content"]):
+                    yield archive.conversation_id, title, message
+
+    def compact_pending(self, limit: int, after: str = "") -> Tuple[int, Optional[str]]:
+        """Compact up to ``limit`` archived conversations with hot rows, by id from ``after``.
+
+        Returns how many were compacted and the last id tried, to pass as
+        ``after`` for the next batch; ``None`` once there are no candidates
+        left. A conversation that fails is logged and not retried.
+        """
+        with SessionLocal() as db:
+            ids = db.scalars(
+                select(Conversation.id)
+                .where(
+                    Conversation.archived == True,  # noqa: E712
+                    Conversation.id > after,
+                    exists().where(Message.conversation_id == Conversation.id),
+                    ~exists().where(ConversationArchive.conversation_id == Conversation.id),
+                )
+                .order_by(Conversation.id)
+                .limit(limit)
+            ).all()
+        done = 0
+        for conversation_id in ids:
+            with SessionLocal() as db:
+                try:
+                    done += self.compact(db, conversation_id)
+                    db.commit()
+                except Exception:
+                    logger.exception("Could not archive conversation %s", conversation_id)
+        return done, ids[-1] if ids else None
+
+    def compact_later(self, conversation_id: str) -> None:
+        """Compact on a session of its own, e.g. from a background task after archiving (worker thread)."""
+        message_writer.wait_for_sync(conversation_id)
+        with SessionLocal() as db:
+            try:
+                if db.scalar(select(Conversation.archived).where(Conversation.id == conversation_id)):
+                    self.compact(db, conversation_id)
+                    db.commit()
+            except Exception:
+                logger.exception("Could not archive conversation %s", conversation_id)
+
+    def _decode(self, archive: ConversationArchive) -> List[Dict[str, Any]]:
+        key = (archive.conversation_id, archive.created_at)
+        payload = self._cache.get(key)
+        if payload is None:
+            payload = sse.loads(CODECS[archive.codec][1](archive.data))
+            self._cache[key] = payload
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec,
+            "compacted": self.compacted,
+            "thawed": self.thawed,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+        }
+
+
+cold_storage = ColdStorage(ARCHIVE_CODEC)
+
+
+def main() -> None:
+    """Backfill: compact every archived conversation that still has hot rows."""
+    logging.basicConfig(level=logging.INFO)
+    total, after = 0, ""
+    while True:
+        done, after = cold_storage.compact_pending(ARCHIVE_BATCH_SIZE, after)
+        if after is None:
+            break
+        total += done
+        logger.info("Archived %d conversations", total)
+    logger.info("Done, %d conversations archived", total)
+
+
+if __name__ == "__main__":
+    main()
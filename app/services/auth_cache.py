@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import ORMExecuteState, Session, object_session
+
+from ..models import User
+from ..settings import AUTH_CACHE_NEGATIVE_TTL, AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+
+MISSING = object()
+
+
+class ApiKeyCache:
+    """In-process LRU cache mapping API keys to user ids.
+
+    Unknown keys are cached as ``None`` in a separate, smaller LRU with a
+    shorter TTL so a flood of bad keys cannot evict valid ones.
+
+    Every invalidation bumps ``generation``. A caller that looks a key up
+    after a miss reads it first and passes it to ``set``, which drops the
+    result if an invalidation happened meanwhile: the lookup may have read
+    the row as it was before the write.
+
+    ORM writes to ``User`` invalidate automatically (see the hooks below).
+    Writes that bypass the ORM (Core ``update(users)``, raw SQL) must call
+    ``invalidate_user`` or ``invalidate`` for the affected users themselves,
+    after they commit.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._positive: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def get(self, api_key: str):
+        """Return the cached user id, ``None`` for a known-bad key, or ``MISSING``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._positive.get(api_key)
+            if entry is not None:
+                user_id, expires = entry
+                if expires > now:
+                    self._positive.move_to_end(api_key)
+                    self.hits += 1
+                    return user_id
+                self._drop_positive(api_key)
+            expires = self._negative.get(api_key)
+            if expires is not None:
+                if expires > now:
+                    self.negative_hits += 1
+                    return None
+                del self._negative[api_key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, api_key: str, user_id: Optional[str], generation: Optional[int] = None) -> None:
+        """Cache a lookup result; skipped if ``generation`` (read before the lookup) is stale."""
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if user_id is None:
+                if self.negative_ttl <= 0:
+                    return
+                self._negative[api_key] = now + self.negative_ttl
+                self._negative.move_to_end(api_key)
+                while len(self._negative) > max(1, self.maxsize // 10):
+                    self._negative.popitem(last=False)
+                return
+            self._negative.pop(api_key, None)
+            self._drop_positive(api_key)
+            self._positive[api_key] = (user_id, now + self.ttl)
+            self._keys_by_user.setdefault(user_id, set()).add(api_key)
+            while len(self._positive) > self.maxsize:
+                old_key, _ = next(iter(self._positive.items()))
+                self._drop_positive(old_key)
+                self.evictions += 1
+
+    def invalidate(self, api_key: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._drop_positive(api_key)
+            self._negative.pop(api_key, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            self.generation += 1
+            for api_key in list(self._keys_by_user.get(user_id, ())):
+                self._drop_positive(api_key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._positive.clear()
+            self._negative.clear()
+            self._keys_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._positive),
+                "negative_size": len(self._negative),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _drop_positive(self, api_key: str) -> None:
+        entry = self._positive.pop(api_key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[0])
+        if keys is not None:
+            keys.discard(api_key)
+            if not keys:
+                del self._keys_by_user[entry[0]]
+
+
+api_key_cache = ApiKeyCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL)
+
+
+# Keep the cache coherent with ORM writes on users: a freshly issued key must
+# not stay negatively cached, and rotated keys / deleted users must stop
+# authenticating immediately rather than after the TTL.
+_PENDING = "api_key_cache_pending"
+
+
+def _invalidate(session: Optional[Session], action: Callable[[], None]) -> None:
+    # Now, and again once committed: until then other sessions still read the
+    # old row, and a lookup in between would cache it past the first pass
+    action()
+    if session is not None:
+        session.info.setdefault(_PENDING, []).append(action)
+
+
+@event.listens_for(Session, "after_commit")
+def _committed(session: Session) -> None:
+    for action in session.info.pop(_PENDING, ()):
+        action()
+
+
+@event.listens_for(Session, "after_rollback")
+def _rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING, None)
+
+
+@event.listens_for(User, "after_insert")
+def _user_inserted(_mapper, _connection, target: User) -> None:
+    api_key = target.api_key
+    _invalidate(object_session(target), lambda: api_key_cache.invalidate(api_key))
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(_mapper, _connection, target: User) -> None:
+    history = inspect(target).attrs.api_key.history
+    if not history.deleted and not history.added:
+        return
+    user_id, old_keys, new_keys = target.id, list(history.deleted or ()), list(history.added or ())
+
+    def action() -> None:
+        for old_key in old_keys:
+            api_key_cache.invalidate(old_key)
+        if new_keys:
+            api_key_cache.invalidate_user(user_id)
+            for new_key in new_keys:
+                api_key_cache.invalidate(new_key)
+
+    _invalidate(object_session(target), action)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(_mapper, _connection, target: User) -> None:
+    user_id, api_key = target.id, target.api_key
+
+    def action() -> None:
+        api_key_cache.invalidate_user(user_id)
+        api_key_cache.invalidate(api_key)
+
+    _invalidate(object_session(target), action)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_user_write(state: ORMExecuteState) -> None:
+    # ORM bulk UPDATE/DELETE skip the mapper hooks and don't say which users
+    # they touched, so drop everything; Core and raw SQL writes aren't seen here
+    if (state.is_update or state.is_delete) and any(m.class_ is User for m in state.all_mappers):
+        _invalidate(state.session, api_key_cache.clear)
@@ -0,0 +1,167 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import httpx
+
+from ..settings import (
+    OLLAMA_AFFINITY_SIZE,
+    OLLAMA_HEALTH_INTERVAL,
+    OLLAMA_HOSTS,
+    OLLAMA_MAX_FAILS,
+)
+from .ollama import ollama_client
+
+
+def _model_key(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+
+class Backend:
+    """One Ollama instance and what we currently know about it."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.healthy = True
+        self.failures = 0
+        self.installed: Set[str] = set()
+        self.loaded: Set[str] = set()
+        self.requests = 0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.healthy = True
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= OLLAMA_MAX_FAILS:
+            self.healthy = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "installed": sorted(self.installed),
+            "loaded": sorted(self.loaded),
+        }
+
+
+class BackendPool:
+    """Routes requests across several Ollama backends.
+
+    Picks the least-loaded healthy backend, preferring ones that already have
+    the model resident (``/api/ps``), then installed (``/api/tags``). Requests
+    sharing an affinity key (conversation id) stick to the same backend so
+    its KV cache stays warm. Backends are ejected after ``OLLAMA_MAX_FAILS``
+    consecutive errors and re-added once a health probe succeeds.
+    """
+
+    def __init__(self, urls: List[str]) -> None:
+        self.backends = [Backend(u) for u in urls]
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self.refreshed_at: Optional[float] = None
+
+    def pick(self, model: str, affinity: Optional[str] = None) -> Backend:
+        key = _model_key(model)
+        candidates = [b for b in self.backends if b.healthy] or self.backends
+        if affinity:
+            sticky = self._affinity.get(affinity)
+            if sticky is not None and sticky in candidates and (not sticky.installed or key in sticky.installed):
+                self._affinity.move_to_end(affinity)
+                return sticky
+        loaded = [b for b in candidates if key in b.loaded]
+        installed = [b for b in candidates if key in b.installed]
+        pool = loaded or installed or candidates
+        least = min(b.in_flight for b in pool)
+        backend = random.choice([b for b in pool if b.in_flight == least])
+        if affinity:
+            self._affinity[affinity] = backend
+            self._affinity.move_to_end(affinity)
+            while len(self._affinity) > OLLAMA_AFFINITY_SIZE:
+                self._affinity.popitem(last=False)
+        return backend
+
+    @asynccontextmanager
+    async def acquire(self, model: str, affinity: Optional[str] = None) -> AsyncIterator[Backend]:
+        backend = self.pick(model, affinity)
+        backend.in_flight += 1
+        backend.requests += 1
+        try:
+            yield backend
+        except httpx.TransportError:
+            backend.record_failure()
+            raise
+        else:
+            backend.record_success()
+            # The model is resident on this backend now
+            backend.loaded.add(_model_key(model))
+        finally:
+            backend.in_flight -= 1
+
+    async def _probe(self, backend: Backend) -> None:
+        try:
+            tags, ps = await asyncio.gather(
+                ollama_client.get(f"{backend.url}/api/tags", timeout=5),
+                ollama_client.get(f"{backend.url}/api/ps", timeout=5),
+            )
+            tags.raise_for_status()
+            ps.raise_for_status()
+        except httpx.HTTPError:
+            backend.record_failure()
+            return
+        backend.installed = {m["name"] for m in tags.json().get("models", [])}
+        backend.loaded = {m["name"] for m in ps.json().get("models", [])}
+        backend.record_success()
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(self._probe(b) for b in self.backends))
+        self.refreshed_at = time.monotonic()
+
+    async def refresh_if_stale(self, max_age: float) -> None:
+        """``refresh`` unless the last one is under ``max_age`` seconds old; concurrent callers share one."""
+        if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < max_age:
+            return
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self.refresh())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        await asyncio.shield(self._refreshing)
+
+    def installed_models(self) -> Set[str]:
+        names: Set[str] = set()
+        for b in self.backends:
+            if b.healthy:
+                names |= b.installed
+        return names
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None and OLLAMA_HEALTH_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [b.stats() for b in self.backends]
+
+
+backend_pool = BackendPool(OLLAMA_HOSTS)
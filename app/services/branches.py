@@ -0,0 +1,81 @@
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import CTE, Select, exists, select
+from sqlalchemy.orm import Session, aliased
+
+from ..models import Conversation, Message
+
+_messages = Message.__table__
+
+
+def path_cte(conversation_id: str, leaf_id: Optional[str] = None) -> CTE:
+    """Ids of the messages from ``leaf_id`` (default: the active leaf) up to the root.
+
+    One recursive CTE; each step is a primary-key lookup of the parent.
+    """
+    if leaf_id is None:
+        start = _messages.c.id == (
+            select(Conversation.active_leaf_id).where(Conversation.id == conversation_id).scalar_subquery()
+        )
+    else:
+        start = _messages.c.id == leaf_id
+    path = (
+        select(_messages.c.id, _messages.c.parent_id)
+        .where(start, _messages.c.conversation_id == conversation_id)
+        .cte("path", recursive=True)
+    )
+    parent = _messages.alias("parent")
+    return path.union_all(
+        select(parent.c.id, parent.c.parent_id).join(path, parent.c.id == path.c.parent_id)
+    )
+
+
+def active_path(conversation_id: str, *columns) -> Select:
+    """Select the active branch's messages (or ``columns`` of them), oldest first."""
+    path = path_cte(conversation_id)
+    return select(*(columns or (Message,))).join(path, Message.id == path.c.id).order_by(Message.seq.asc())
+
+
+def leaves(db: Session, conversation_id: str) -> List[Message]:
+    """Tips of every branch, oldest first."""
+    child = aliased(Message)
+    return (
+        db.query(Message)
+        .filter(
+            Message.conversation_id == conversation_id,
+            ~exists().where(child.parent_id == Message.id),
+        )
+        .order_by(Message.seq.asc())
+        .all()
+    )
+
+
+def branch_tip(db: Session, conversation_id: str, message_id: str) -> Optional[str]:
+    """Newest leaf at or below ``message_id``, the message to make active when switching to it."""
+    below = (
+        select(_messages.c.id)
+        .where(_messages.c.id == message_id, _messages.c.conversation_id == conversation_id)
+        .cte("below", recursive=True)
+    )
+    child = _messages.alias("child")
+    below = below.union_all(select(child.c.id).join(below, child.c.parent_id == below.c.id))
+    return db.scalar(
+        select(Message.id).join(below, Message.id == below.c.id).order_by(Message.seq.desc()).limit(1)
+    )
+
+
+def path_of(messages: Sequence[Any], leaf_id: Optional[str]) -> List[Any]:
+    """In-memory :func:`active_path` over already loaded messages (e.g. an archive)."""
+    by_id = {m.id: m for m in messages}
+    path = []
+    node = by_id.get(leaf_id)
+    while node is not None:
+        path.append(node)
+        node = by_id.get(node.parent_id)
+    return path[::-1]
+
+
+def leaves_of(messages: Sequence[Any]) -> List[Any]:
+    """In-memory :func:`leaves`; ``messages`` oldest first."""
+    parents = {m.parent_id for m in messages}
+    return [m for m in messages if m.id not in parents]
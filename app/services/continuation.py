@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import AsyncSessionLocal
+from ..models import ConversationContext, Message
+from ..models.file import message_files
+from ..settings import CONVERSATION_CONTEXT_REUSE
+from ..tokens import estimate_tokens
+from .branches import active_path
+from .persistence import message_writer
+
+logger = logging.getLogger(__name__)
+
+
+def pack_context(tokens: List[int]) -> bytes:
+    """Pack Ollama token ids as little-endian uint32."""
+    packed = array("I", tokens)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_context(blob: bytes) -> List[int]:
+    packed = array("I")
+    packed.frombytes(blob)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+class Continuation:
+    """How to run the next turn through ``/api/generate`` instead of ``/api/chat``."""
+
+    __slots__ = ("context", "prompt", "system")
+
+    def __init__(self, context: List[int], prompt: str, system: Optional[str] = None) -> None:
+        self.context = context
+        self.prompt = prompt
+        self.system = system
+
+    def payload(self, model: str, stream: bool, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        req: Dict[str, Any] = {"model": model, "prompt": self.prompt, "stream": stream}
+        if self.context:
+            req["context"] = self.context
+        if self.system:
+            req["system"] = self.system
+        if options:
+            req["options"] = options
+        return req
+
+
+class ContextStore:
+    """Per (conversation, model) Ollama context, so a turn only sends its new messages.
+
+    The context returned by the final ``/api/generate`` chunk is stored with
+    the id of the assistant message that ended the turn. The next turn is
+    continued from it when that message is on the active branch and
+    everything after it is user input; otherwise (an edit or branch switch,
+    a turn served by ``/api/chat``, a context that no longer fits the
+    budget) the state is dropped and the caller falls back to sending the
+    transcript. New conversations start in this mode; older ones keep using
+    ``/api/chat``, since their history can't be re-tokenized through
+    Ollama's prompt template.
+    """
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self._saving: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.bootstraps = 0
+        self.fallbacks = 0
+        self.invalidations = 0
+        self.prefill_tokens_skipped = 0
+
+    async def prepare(
+        self,
+        db: AsyncSession,
+        conversation_id: str,
+        model: str,
+        budget: int,
+        extra: Iterable[Dict[str, Any]] = (),
+    ) -> Optional[Continuation]:
+        """Return a continuation for the next turn, or ``None`` to send the transcript.
+
+        ``extra`` are messages from the request body that are not stored yet.
+        Edits and branch switches need no separate invalidation: a stored
+        context whose turn is no longer on the active path is dropped here.
+        """
+        if not self.enabled:
+            return None
+        pending = self._saving.get((conversation_id, model))
+        if pending is not None:
+            await asyncio.shield(pending)
+
+        state = await db.get(ConversationContext, (conversation_id, model))
+        path = (await db.execute(active_path(conversation_id, Message.id, Message.seq, Message.role))).all()
+        system = None
+        if state is not None:
+            # The stored context only applies while its turn is on the active branch
+            anchor_seq = next((row.seq for row in path if row.id == state.last_message_id), None)
+            if anchor_seq is None:
+                return await self._fallback(db, state)
+            ids = [row.id for row in path if row.seq > anchor_seq]
+            rows = await self._contents(db, ids)
+            context = unpack_context(state.context)
+        else:
+            if any(row.role == "assistant" for row in path):
+                self.fallbacks += 1
+                return None
+            ids = [row.id for row in path]
+            rows = await self._contents(db, ids)
+            system = "\n\n".join(content for role, content in rows if role == "system") or None
+            rows = [row for row in rows if row.role != "system"]
+            context = []
+
+        if ids and await db.scalar(select(exists().where(message_files.c.message_id.in_(ids)))):
+            # Attachments go out through /api/chat's per-message images and text
+            return await self._fallback(db, state)
+        new = [(role, content) for role, content in rows]
+        new += [(m.get("role", "user"), m.get("content", "")) for m in extra]
+        if not new or any(role != "user" or not isinstance(content, str) for role, content in new):
+            return await self._fallback(db, state)
+        prompt = "\n\n".join(content for _, content in new)
+        if len(context) + estimate_tokens(prompt) > budget:
+            return await self._fallback(db, state)
+
+        if context:
+            self.hits += 1
+            self.prefill_tokens_skipped += len(context)
+        else:
+            self.bootstraps += 1
+        return Continuation(context, prompt, system)
+
+    def save_later(self, conversation_id: str, model: str, context: Optional[List[int]], last_message_id: str) -> None:
+        """Store the context of a finished turn once its assistant message is committed."""
+        if not context:
+            return
+        key = (conversation_id, model)
+        task = asyncio.get_running_loop().create_task(self._save(conversation_id, model, context, last_message_id))
+        self._saving[key] = task
+        task.add_done_callback(lambda t: self._saving.pop(key, None) if self._saving.get(key) is t else None)
+
+    @staticmethod
+    async def _contents(db: AsyncSession, ids: List[str]) -> List[Any]:
+        if not ids:
+            return []
+        return (
+            await db.execute(
+                select(Message.role, Message.content).where(Message.id.in_(ids)).order_by(Message.seq.asc())
+            )
+        ).all()
+
+    async def _fallback(self, db: AsyncSession, state: Optional[ConversationContext]) -> None:
+        self.fallbacks += 1
+        if state is not None:
+            await db.delete(state)
+            await db.commit()
+            self.invalidations += 1
+        return None
+
+    async def _save(self, conversation_id: str, model: str, context: List[int], last_message_id: str) -> None:
+        try:
+            await message_writer.wait_for(conversation_id)
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    delete(ConversationContext).where(
+                        ConversationContext.conversation_id == conversation_id,
+                        ConversationContext.model == model,
+                    )
+                )
+                db.add(
+                    ConversationContext(
+                        conversation_id=conversation_id,
+                        model=model,
+                        context=pack_context(context),
+                        token_count=len(context),
+                        last_message_id=last_message_id,
+                    )
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Could not store context for conversation %s", conversation_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "bootstraps": self.bootstraps,
+            "fallbacks": self.fallbacks,
+            "invalidations": self.invalidations,
+            "prefill_tokens_skipped": self.prefill_tokens_skipped,
+        }
+
+
+context_store = ContextStore(CONVERSATION_CONTEXT_REUSE)
@@ -0,0 +1,210 @@
+import base64
+import io
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from ..settings import (
+    DERIVATIVE_CACHE_BYTES,
+    DERIVATIVE_IMAGE_MAX_EDGE,
+    DERIVATIVE_IMAGE_TOKENS,
+    DERIVATIVE_TEXT_MAX_CHARS,
+    DERIVATIVE_WORKERS,
+)
+from ..tokens import MESSAGE_OVERHEAD, estimate_tokens
+from .files import file_service
+
+try:  # optional, to downscale images; without it they are sent as uploaded
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+try:  # optional, to extract PDF text; without it PDFs are not sent
+    import pypdf
+except ImportError:  # pragma: no cover - depends on the environment
+    pypdf = None
+
+logger = logging.getLogger(__name__)
+
+
+def _downscale(data: bytes, max_edge: int) -> bytes:
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_edge and img.format in ("JPEG", "PNG"):
+            return data
+        img.thumbnail((max_edge, max_edge))
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA", "P"):
+            img.save(out, format="PNG", optimize=True)
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=85)
+        return out.getvalue()
+
+
+def _pdf_text(data: bytes) -> str:
+    if pypdf is None:
+        return ""
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def derive(mime_type: str, data: bytes, max_edge: int, max_chars: int) -> bytes:
+    """Model-ready form of a file's content; runs in a worker process.
+
+    Images become base64 of a copy no larger than ``max_edge`` pixels a
+    side; PDFs and text become UTF-8 text cut at ``max_chars``. Anything
+    else (or a PDF without ``pypdf``) gives ``b""``: nothing to send.
+    """
+    if mime_type.startswith("image/"):
+        return base64.b64encode(_downscale(data, max_edge))
+    if mime_type == "application/pdf":
+        text = _pdf_text(data)
+    elif mime_type.startswith("text/"):
+        text = data.decode("utf-8", errors="replace")
+    else:
+        return b""
+    return text[:max_chars].encode()
+
+
+class DerivativeStore:
+    """Precomputed model inputs for attached files, stored next to the original.
+
+    ``build`` runs after an upload: decoding, resizing, re-encoding and
+    text extraction happen once, in a process pool of ``workers``
+    processes, and the result is written to ``<path>.<suffix>``. Turns
+    read it back through ``attach`` (an in-process LRU of ``cache_bytes``
+    in front of storage); a missing derivative is built on first use.
+    """
+
+    def __init__(
+        self, workers: int, image_max_edge: int, text_max_chars: int, image_tokens: int, cache_bytes: int
+    ) -> None:
+        self.workers = workers
+        self.image_max_edge = image_max_edge
+        self.text_max_chars = text_max_chars
+        self.image_tokens = image_tokens
+        self.cache_bytes = cache_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self.built = 0
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, path: str, mime_type: str) -> str:
+        # The edge is part of the name, so changing it doesn't serve stale images
+        suffix = f"{self.image_max_edge}.b64" if mime_type.startswith("image/") else "txt"
+        return f"{path}.{suffix}"
+
+    def build(self, path: str, mime_type: str) -> bytes:
+        """Compute and store the derivative of a stored file unless it exists; blocking."""
+        dest = file_service._full_path(self.path(path, mime_type))
+        if file_service.fs.exists(dest):
+            return self._remember(dest, file_service.fs.cat_file(dest))
+        data = file_service.fs.cat_file(file_service._full_path(path))
+        args = (mime_type, data, self.image_max_edge, self.text_max_chars)
+        pool = self._pool()
+        result = pool.submit(derive, *args).result() if pool is not None else derive(*args)
+        # Written aside and moved into place, so a concurrent turn never reads a partial file
+        partial = f"{dest}.{uuid.uuid4().hex}.part"
+        with file_service.fs.open(partial, "wb") as f:
+            f.write(result)
+        file_service.fs.mv(partial, dest)
+        self.built += 1
+        return self._remember(dest, result)
+
+    def build_later(self, path: str, mime_type: str) -> None:
+        """``build`` for a background task after an upload; failures are only logged."""
+        try:
+            self.build(path, mime_type)
+        except Exception:
+            logger.exception("Could not build derivative of %s", path)
+
+    def get(self, path: str, mime_type: str) -> bytes:
+        dest = file_service._full_path(self.path(path, mime_type))
+        with self._lock:
+            data = self._cache.get(dest)
+            if data is not None:
+                self._cache.move_to_end(dest)
+                self.hits += 1
+                return data
+        self.misses += 1
+        return self.build(path, mime_type)
+
+    def attach(self, messages: List[Dict[str, Any]], files: Dict[int, List[Any]], budget: int) -> None:
+        """Add ``images`` and extracted text to ``messages`` (by index) in place; blocking.
+
+        ``files`` rows need ``path``, ``mime_type`` and ``name``. Attachments
+        spend at most ``budget`` tokens, newest messages first: each image
+        costs ``image_tokens`` and is dropped when that no longer fits, text
+        is cut to what is left. A file whose original is gone is skipped.
+        """
+        for index in sorted(files, reverse=True):
+            message = messages[index]
+            for row in files[index]:
+                try:
+                    data = self.get(row.path, row.mime_type)
+                except FileNotFoundError:
+                    continue
+                if not data:
+                    continue
+                if row.mime_type.startswith("image/"):
+                    if self.image_tokens > budget:
+                        continue
+                    budget -= self.image_tokens
+                    message.setdefault("images", []).append(data.decode("ascii"))
+                    continue
+                block = f"\n\n[{row.name}]\n"
+                # About four bytes per token, as estimate_tokens counts
+                room = budget * 4 - len(block.encode())
+                if room <= 0:
+                    continue
+                text = data[:room].decode(errors="ignore")
+                budget -= estimate_tokens(block + text) - MESSAGE_OVERHEAD
+                message["content"] = f"{message['content']}{block}{text}"
+
+    def _remember(self, key: str, data: bytes) -> bytes:
+        with self._lock:
+            if key not in self._cache and len(data) <= self.cache_bytes:
+                self._cache[key] = data
+                self._cached_bytes += len(data)
+                while self._cached_bytes > self.cache_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(old)
+        return data
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "built": self.built,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cached_bytes": self._cached_bytes,
+        }
+
+
+derivative_store = DerivativeStore(
+    DERIVATIVE_WORKERS,
+    DERIVATIVE_IMAGE_MAX_EDGE,
+    DERIVATIVE_TEXT_MAX_CHARS,
+    DERIVATIVE_IMAGE_TOKENS,
+    DERIVATIVE_CACHE_BYTES,
+)
@@ -0,0 +1,109 @@
+import asyncio
+import base64
+import sys
+from array import array
+from typing import Any, Dict, List, Set, Tuple
+
+from ..settings import EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS
+from .backends import backend_pool
+from .ollama import ollama_client
+
+
+def to_base64(vector: List[float]) -> str:
+    """Pack a vector as little-endian float32, as OpenAI's base64 format expects."""
+    packed = array("f", vector)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode()
+
+
+class _Pending:
+    __slots__ = ("inputs", "future")
+
+    def __init__(self, inputs: List[str], future: asyncio.Future) -> None:
+        self.inputs = inputs
+        self.future = future
+
+
+class EmbeddingBatcher:
+    """Merges concurrent embedding requests for the same model.
+
+    Requests are held for at most ``EMBED_MAX_WAIT_MS`` or until
+    ``EMBED_MAX_BATCH`` inputs are pending, then sent to ``/api/embed`` as
+    one batch and the vectors are split back to each caller.
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float) -> None:
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: Dict[str, List[_Pending]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.batches = 0
+        self.inputs = 0
+
+    async def embed(self, model: str, inputs: List[str]) -> Tuple[List[List[float]], int]:
+        """Return the vectors for ``inputs`` and this caller's share of prompt tokens."""
+        self.requests += 1
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        queue = self._pending.setdefault(model, [])
+        queue.append(_Pending(inputs, fut))
+        if sum(len(p.inputs) for p in queue) >= self.max_batch or self.max_wait <= 0:
+            self._flush(model)
+        elif model not in self._timers:
+            self._timers[model] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, model)
+        return await fut
+
+    def _flush(self, model: str) -> None:
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        queue = self._pending.pop(model, [])
+        while queue:
+            batch, size = [], 0
+            while queue and (not batch or size + len(queue[0].inputs) <= self.max_batch):
+                item = queue.pop(0)
+                batch.append(item)
+                size += len(item.inputs)
+            task = asyncio.create_task(self._run(model, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model: str, batch: List[_Pending]) -> None:
+        flat = [text for item in batch for text in item.inputs]
+        self.batches += 1
+        self.inputs += len(flat)
+        try:
+            async with backend_pool.acquire(model) as backend:
+                r = await ollama_client.post(f"{backend.url}/api/embed", json={"model": model, "input": flat})
+                r.raise_for_status()
+                data = r.json()
+        except Exception as exc:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+        vectors = data.get("embeddings", [])
+        total_tokens = int(data.get("prompt_eval_count") or 0)
+        total_chars = sum(len(t) for t in flat) or 1
+        offset = 0
+        for item in batch:
+            n = len(item.inputs)
+            # Ollama reports tokens for the whole batch; apportion by input length
+            share = round(total_tokens * sum(len(t) for t in item.inputs) / total_chars)
+            if not item.future.done():
+                item.future.set_result((vectors[offset:offset + n], share))
+            offset += n
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "avg_batch_inputs": round(self.inputs / self.batches, 2) if self.batches else 0.0,
+            "pending": sum(len(q) for q in self._pending.values()),
+        }
+
+
+embedding_batcher = EmbeddingBatcher(EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS)
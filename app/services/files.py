@@ -1,75 +1,334 @@
+import asyncio
+import hashlib
+import hmac
 import os
+import threading
+import time
 import uuid
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import fsspec
 import s3fs
+from fsspec.asyn import sync
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ..models import File
+from ..models import Blob, Conversation, File, Message
+from ..models.file import message_files
 from ..settings import (
+    FILE_MAX_SIZE,
     FILE_STORAGE_BACKEND,
     FILE_STORAGE_LOCAL_PATH,
     FILE_STORAGE_S3_BUCKET,
     FILE_PUBLIC_BASE_URL,
+    FILE_UPLOAD_CHUNK_SIZE,
+    FILE_URL_SIGNING_KEY,
+    FILE_URL_TTL,
 )
 
+# Leading bytes a declared type must start with; types not listed aren't sniffed
+SIGNATURES = {
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/gif": (b"GIF87a", b"GIF89a"),
+    "application/pdf": (b"%PDF-",),
+}
+# S3 multipart part size; the minimum S3 accepts, so at most this much is buffered
+S3_BLOCK_SIZE = 5 * 1024 * 1024
+# Content-addressed objects live under BLOB_PREFIX; uploads are staged under STAGING_PREFIX
+BLOB_PREFIX = "blobs"
+STAGING_PREFIX = "incoming"
+# Presigned public URLs kept per path, reused until less than this share of FILE_URL_TTL is left
+URL_CACHE_SIZE = 10000
+URL_REFRESH_FRACTION = 0.25
+
+
+class UploadRejected(Exception):
+    """The upload was refused part-way; nothing was stored."""
+
+    def __init__(self, detail: str) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+def sniff(content_type: str, head: bytes) -> bool:
+    """Whether the first bytes of a file are plausible for its declared type."""
+    if content_type.startswith("text/"):
+        return b"\x00" not in head
+    prefixes = SIGNATURES.get(content_type)
+    return prefixes is None or head.startswith(prefixes)
+
+
+def blob_path(sha256: str) -> str:
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256}"
+
 
 class FileService:
-    """Service handling file storage and URL generation."""
+    """Service handling file storage and URL generation.
+
+    Content is stored once per SHA-256 as a ``Blob``; every ``File`` row
+    with that content points at the blob's path, and the blob's
+    ``ref_count`` tracks how many do. Files uploaded before deduplication
+    keep their own path until migration ``0014_file_blobs`` moves them over.
+    """
 
     def __init__(self) -> None:
         if FILE_STORAGE_BACKEND == "s3":
             self.fs = s3fs.S3FileSystem()
             self.base = FILE_STORAGE_S3_BUCKET
         else:
-            self.fs = fsspec.filesystem("file")
+            # Creates the staging and blob prefix directories on first write
+            self.fs = fsspec.filesystem("file", auto_mkdir=True)
             self.base = FILE_STORAGE_LOCAL_PATH
             self.fs.makedirs(self.base, exist_ok=True)
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._urls_lock = threading.Lock()
 
     def _full_path(self, path: str) -> str:
         if FILE_STORAGE_BACKEND == "s3":
             return f"{self.base}/{path}"
         return os.path.join(self.base, path)
 
-    def upload(self, upload: UploadFile, data: bytes, owner: str, db: Session) -> File:
-        ext = os.path.splitext(upload.filename)[1]
+    async def upload(self, upload: UploadFile, owner: str, db: Session) -> File:
+        """Copy ``upload`` to storage chunk by chunk and record it.
+
+        The size limit and the content sniff are checked as data arrives;
+        a rejected upload raises :class:`UploadRejected` and leaves nothing
+        behind. The SHA-256 is computed on the way through. Storage and
+        database calls run in the threadpool.
+        """
         file_id = uuid.uuid4().hex
-        path = f"{file_id}{ext}"
-        dest = self._full_path(path)
-        with self.fs.open(dest, "wb") as f:
-            f.write(data)
+        staged = self._full_path(f"{STAGING_PREFIX}/{file_id}")
+        options = {"block_size": S3_BLOCK_SIZE} if FILE_STORAGE_BACKEND == "s3" else {}
+        digest = hashlib.sha256()
+        size = 0
+        out = await run_in_threadpool(self.fs.open, staged, "wb", **options)
+        try:
+            while chunk := await upload.read(FILE_UPLOAD_CHUNK_SIZE):
+                if size == 0 and not sniff(upload.content_type, chunk):
+                    raise UploadRejected("File content does not match its type")
+                size += len(chunk)
+                if size > FILE_MAX_SIZE:
+                    raise UploadRejected("File too large")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+            await run_in_threadpool(out.close)
+        except BaseException:
+            await run_in_threadpool(self._discard, out, staged)
+            raise
         file_obj = File(
             id=file_id,
             mime_type=upload.content_type,
-            size=len(data),
+            size=size,
             name=upload.filename,
-            path=path,
+            path=blob_path(digest.hexdigest()),
             owner=owner,
+            sha256=digest.hexdigest(),
+        )
+        return await run_in_threadpool(self._record, db, staged, file_obj)
+
+    def claim(self, db: Session, owner: str, sha256: str, name: str) -> Optional[File]:
+        """Add a file from content the owner already uploaded, without sending it again.
+
+        Only the owner's own blobs can be claimed, so a hash alone never
+        reveals or grants access to someone else's upload.
+        """
+        source = db.scalar(
+            select(File).where(File.owner == owner, File.sha256 == sha256, File.path == blob_path(sha256)).limit(1)
         )
+        if source is None or not self._acquire(db, sha256):
+            return None
+        file_obj = File(
+            mime_type=source.mime_type, size=source.size, name=name, path=source.path, owner=owner, sha256=sha256
+        )
+        db.add(file_obj)
+        db.commit()
+        db.refresh(file_obj)
+        return file_obj
+
+    def _discard(self, out, dest: str) -> None:
+        # s3fs aborts the multipart upload on discard; local files are closed and removed
+        if FILE_STORAGE_BACKEND == "s3":
+            out.discard()
+        else:
+            out.close()
+        if self.fs.exists(dest):
+            self.fs.rm(dest)
+
+    def _record(self, db: Session, staged: str, file_obj: File) -> File:
+        self._store(db, staged, file_obj.sha256, file_obj.size)
         db.add(file_obj)
         db.commit()
         db.refresh(file_obj)
         return file_obj
 
+    def _store(self, db: Session, source: str, sha256: str, size: int) -> None:
+        """Take a reference on the blob for ``sha256``, creating it from ``source`` if new.
+
+        ``source`` is consumed either way. The caller commits.
+        """
+        if self._acquire(db, sha256):
+            self.fs.rm(source)
+            return
+        path = blob_path(sha256)
+        dest = self._full_path(path)
+        if FILE_STORAGE_BACKEND != "s3":
+            self.fs.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Identical content, so overwriting a racing upload's copy is harmless
+        self.fs.mv(source, dest)
+        try:
+            with db.begin_nested():
+                db.add(Blob(sha256=sha256, path=path, size=size, ref_count=1))
+        except IntegrityError:
+            self._acquire(db, sha256)
+
+    @staticmethod
+    def _acquire(db: Session, sha256: str) -> bool:
+        return db.execute(
+            update(Blob).where(Blob.sha256 == sha256).values(ref_count=Blob.ref_count + 1),
+            execution_options={"synchronize_session": False},
+        ).rowcount == 1
+
+    def _release(self, db: Session, file_obj: File) -> Optional[str]:
+        """Drop the file's reference; the last one frees the object.
+
+        Returns the path to pass to :meth:`_remove` once the caller has
+        committed, so a failed commit leaves it in place. ``None`` if other
+        files still share it.
+        """
+        if not file_obj.sha256 or file_obj.path != blob_path(file_obj.sha256):
+            return file_obj.path
+        db.execute(
+            update(Blob).where(Blob.sha256 == file_obj.sha256).values(ref_count=Blob.ref_count - 1),
+            execution_options={"synchronize_session": False},
+        )
+        gone = db.execute(
+            delete(Blob).where(Blob.sha256 == file_obj.sha256, Blob.ref_count <= 0),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        return file_obj.path if gone else None
+
+    def _remove(self, db: Session, path: str) -> None:
+        """Remove an object :meth:`_release` freed, with its derivatives; after the commit."""
+        sha256 = path.rsplit("/", 1)[-1]
+        # An upload of the same content may have re-created the blob since
+        if path == blob_path(sha256) and db.get(Blob, sha256) is not None:
+            return
+        dest = self._full_path(path)
+        if self.fs.exists(dest):
+            self.fs.rm(dest)
+        self._rm_derivatives(dest)
+
+    def _rm_derivatives(self, dest: str) -> None:
+        # DerivativeStore (see services.derivatives) sit next to the original as <path>.<suffix>
+        for derived in self.fs.glob(f"{dest}.*"):
+            self.fs.rm(derived)
+
     def get(self, db: Session, file_id: str, owner: str) -> Optional[File]:
         return db.query(File).filter(File.id == file_id, File.owner == owner).first()
 
     def delete(self, db: Session, file_obj: File) -> None:
-        dest = self._full_path(file_obj.path)
-        if self.fs.exists(dest):
-            self.fs.rm(dest)
+        freed = self._release(db, file_obj)
+        # Messages that listed the file change; so do their conversations' ETags
+        linked = (
+            select(Message.conversation_id)
+            .join(message_files, message_files.c.message_id == Message.id)
+            .where(message_files.c.file_id == file_obj.id)
+        )
+        db.execute(
+            update(Conversation).where(Conversation.id.in_(linked)).values(version=Conversation.version + 1),
+            execution_options={"synchronize_session": False},
+        )
         db.delete(file_obj)
         db.commit()
+        if freed is not None:
+            self._remove(db, freed)
 
-    def public_url(self, path: str) -> str:
+    def local_path(self, file_obj: File) -> Optional[str]:
+        """Filesystem path to serve directly, or ``None`` when the backend is remote."""
+        return None if FILE_STORAGE_BACKEND == "s3" else self._full_path(file_obj.path)
+
+    def size(self, file_obj: File) -> Optional[int]:
+        """Stored size of the file's object, or ``None`` if it is missing."""
+        dest = self._full_path(file_obj.path)
+        return self.fs.size(dest) if self.fs.exists(dest) else None
+
+    def read_range(self, file_obj: File, start: int, length: int) -> Iterator[bytes]:
+        """Yield ``length`` bytes from ``start`` in chunks; blocking, for a threadpool."""
+        with self.fs.open(self._full_path(file_obj.path), "rb", block_size=FILE_UPLOAD_CHUNK_SIZE) as f:
+            f.seek(start)
+            while length > 0:
+                chunk = f.read(min(FILE_UPLOAD_CHUNK_SIZE, length))
+                if not chunk:
+                    return
+                length -= len(chunk)
+                yield chunk
+
+    def signed_url(self, file_obj: File, content_url: str, ttl: int) -> Optional[str]:
+        """A link that fetches the content for ``ttl`` seconds without an API key.
+
+        On S3 it is a presigned URL to the bucket itself; locally it is
+        ``content_url`` with an HMAC over the id and expiry, or ``None``
+        without ``FILE_URL_SIGNING_KEY``.
+        """
         if FILE_STORAGE_BACKEND == "s3":
-            return self.fs.url(f"{self.base}/{path}")
-        base = FILE_PUBLIC_BASE_URL.rstrip("/") if FILE_PUBLIC_BASE_URL else ""
-        if base:
-            return f"{base}/{path}"
-        return path
+            return self.fs.sign(self._full_path(file_obj.path), expiration=ttl)
+        if not FILE_URL_SIGNING_KEY:
+            return None
+        expires = int(time.time()) + ttl
+        return f"{content_url}?expires={expires}&signature={self._signature(file_obj.id, expires)}"
+
+    def verify(self, file_id: str, expires: int, signature: str) -> bool:
+        if not FILE_URL_SIGNING_KEY or expires < time.time():
+            return False
+        return hmac.compare_digest(signature, self._signature(file_id, expires))
+
+    @staticmethod
+    def _signature(file_id: str, expires: int) -> str:
+        return hmac.new(FILE_URL_SIGNING_KEY.encode(), f"{file_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+    def public_url(self, path: str) -> str:
+        return self.public_urls([path])[path]
+
+    def public_urls(self, paths: Iterable[str]) -> Dict[str, str]:
+        """Public URLs for ``paths``, e.g. every attachment of a response.
+
+        With ``FILE_PUBLIC_BASE_URL`` or local storage they are plain string
+        joins. On S3 they are presigned URLs, cached per path until close to
+        expiry; the uncached ones are signed together in one call.
+        """
+        base = FILE_PUBLIC_BASE_URL.rstrip("/")
+        if base or FILE_STORAGE_BACKEND != "s3":
+            return {path: f"{base}/{path}" if base else path for path in paths}
+        now = time.time()
+        fresh_until = now + FILE_URL_TTL * URL_REFRESH_FRACTION
+        urls: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._urls_lock:
+            for path in dict.fromkeys(paths):
+                cached = self._urls.get(path)
+                if cached is not None and cached[1] > fresh_until:
+                    self._urls.move_to_end(path)
+                    urls[path] = cached[0]
+                else:
+                    missing.append(path)
+        if missing:
+            signed = sync(self.fs.loop, self._sign, missing)
+            with self._urls_lock:
+                for path, url in zip(missing, signed):
+                    self._urls[path] = (url, now + FILE_URL_TTL)
+                    self._urls.move_to_end(path)
+                while len(self._urls) > URL_CACHE_SIZE:
+                    self._urls.popitem(last=False)
+            urls.update(zip(missing, signed))
+        return urls
+
+    async def _sign(self, paths: List[str]) -> List[str]:
+        return await asyncio.gather(*(self.fs._url(self._full_path(path), expires=FILE_URL_TTL) for path in paths))
 
 
 file_service = FileService()
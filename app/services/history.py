@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Select, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Conversation, File, Message
+from ..models.file import message_files
+from .branches import path_cte
+from .derivatives import derivative_store
+from ..settings import HISTORY_RESERVE_TOKENS, MODEL_CONTEXT, MODEL_CONTEXT_OVERRIDES
+from ..tokens import estimate_tokens
+
+# Messages whose content is fetched per round trip
+PAGE_SIZE = 64
+
+
+def context_budget(model: str, options: Optional[Dict[str, Any]] = None) -> int:
+    """Prompt tokens available for history: the model window minus room for the reply."""
+    options = options or {}
+    window = options.get("num_ctx") or MODEL_CONTEXT_OVERRIDES.get(model) or MODEL_CONTEXT
+    num_predict = options.get("num_predict")
+    reserve = num_predict if num_predict and num_predict > 0 else HISTORY_RESERVE_TOKENS
+    return max(0, window - reserve)
+
+
+def messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(m.get("content") or "") for m in messages)
+
+
+def recent_path(conversation_id: str, budget: int) -> Select:
+    """The active branch from its leaf up, newest first, until ``budget`` tokens are passed.
+
+    One recursive CTE carrying the running ``token_count`` total; the walk
+    stops after the first message that takes it over ``budget``.
+    """
+    messages = Message.__table__
+    leaf = select(Conversation.active_leaf_id).where(Conversation.id == conversation_id).scalar_subquery()
+    walk = (
+        select(
+            messages.c.id, messages.c.parent_id, messages.c.seq, messages.c.role, messages.c.token_count,
+            messages.c.token_count.label("total"),
+        )
+        .where(messages.c.id == leaf, messages.c.conversation_id == conversation_id)
+        .cte("recent", recursive=True)
+    )
+    parent = messages.alias("parent")
+    walk = walk.union_all(
+        select(
+            parent.c.id, parent.c.parent_id, parent.c.seq, parent.c.role, parent.c.token_count,
+            walk.c.total + parent.c.token_count,
+        )
+        .join(walk, parent.c.id == walk.c.parent_id)
+        .where(walk.c.total <= budget)
+    )
+    return select(walk.c.id, walk.c.parent_id, walk.c.seq, walk.c.role, walk.c.token_count).order_by(walk.c.seq.desc())
+
+
+async def load_history(db: AsyncSession, conversation_id: str, budget: int) -> List[Dict[str, Any]]:
+    """Return the active branch's prompt history trimmed to ``budget`` tokens.
+
+    System messages are always kept; after them come the newest messages
+    that fit, oldest first. The branch is walked from the leaf for roles
+    and stored ``token_count`` values only, and only as far as the budget
+    reaches (:func:`recent_path`); the rest of it is walked only when
+    system messages sit above that point. Content is then read for the
+    messages kept. The newest message is kept even if it alone exceeds the
+    budget.
+    Attached files are added from their precomputed derivatives: images
+    as ``images``, PDF and text content appended to ``content``, within
+    the budget the messages left.
+    """
+    path = (await db.execute(recent_path(conversation_id, budget))).all()[::-1]
+    if path and path[0].parent_id is not None:
+        cut = path[0]
+        earlier = exists().where(
+            Message.conversation_id == conversation_id, Message.seq < cut.seq, Message.role == "system"
+        )
+        if await db.scalar(select(earlier)):
+            above = path_cte(conversation_id, cut.parent_id)
+            path = (
+                await db.execute(
+                    select(Message.id, Message.role, Message.token_count)
+                    .join(above, Message.id == above.c.id)
+                    .where(Message.role == "system")
+                    .order_by(Message.seq.asc())
+                )
+            ).all() + path
+    system = [row for row in path if row.role == "system"]
+    remaining = budget - sum(row.token_count for row in system)
+
+    tail: List[Any] = []
+    for row in reversed([row for row in path if row.role != "system"]):
+        if tail and row.token_count > remaining:
+            break
+        tail.append(row)
+        remaining -= row.token_count
+
+    keep = [row.id for row in [*system, *reversed(tail)]]
+    content: Dict[str, Any] = {}
+    attached: Dict[str, List[Any]] = {}
+    for start in range(0, len(keep), PAGE_SIZE):
+        page = keep[start:start + PAGE_SIZE]
+        rows = await db.execute(select(Message.id, Message.role, Message.content).where(Message.id.in_(page)))
+        content.update((row.id, row) for row in rows)
+        rows = await db.execute(
+            select(message_files.c.message_id, File.path, File.mime_type, File.name)
+            .join(File, File.id == message_files.c.file_id)
+            .where(message_files.c.message_id.in_(page))
+        )
+        for row in rows:
+            attached.setdefault(row.message_id, []).append(row)
+    messages = [{"role": content[mid].role, "content": content[mid].content} for mid in keep]
+    if attached:
+        files = {i: attached[mid] for i, mid in enumerate(keep) if mid in attached}
+        await run_in_threadpool(derivative_store.attach, messages, files, max(0, remaining))
+    return messages
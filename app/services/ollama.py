@@ -0,0 +1,109 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from ..settings import (
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_KEEPALIVE_EXPIRY,
+    OLLAMA_MAX_CONNECTIONS,
+    OLLAMA_MAX_KEEPALIVE,
+    OLLAMA_POOL_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+)
+
+
+class OllamaClient:
+    """Process-wide pooled HTTP client used for every call to Ollama.
+
+    The underlying ``httpx.AsyncClient`` is opened and closed by the app
+    lifespan; it is created lazily so apps without a lifespan still work.
+    """
+
+    def __init__(self) -> None:
+        self._client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.pool_waits = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                    keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    connect=OLLAMA_CONNECT_TIMEOUT,
+                    read=OLLAMA_READ_TIMEOUT,
+                    write=OLLAMA_CONNECT_TIMEOUT,
+                    pool=OLLAMA_POOL_TIMEOUT,
+                ),
+            )
+        return self._client
+
+    async def start(self) -> None:
+        _ = self.client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _enter(self) -> None:
+        self.requests += 1
+        if self.in_flight >= OLLAMA_MAX_CONNECTIONS:
+            self.pool_waits += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self) -> None:
+        self.in_flight -= 1
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        self._enter()
+        try:
+            return await self.client.get(url, **kwargs)
+        finally:
+            self._exit()
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        self._enter()
+        try:
+            return await self.client.post(url, **kwargs)
+        finally:
+            self._exit()
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        self._enter()
+        try:
+            async with self.client.stream(method, url, **kwargs) as resp:
+                yield resp
+        finally:
+            self._exit()
+
+    def stats(self) -> Dict[str, Any]:
+        open_conns = idle_conns = None
+        # httpx does not expose its pool publicly; peek at httpcore if present
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is not None and hasattr(pool, "connections"):
+            conns = list(pool.connections)
+            open_conns = len(conns)
+            idle_conns = sum(1 for c in conns if c.is_idle())
+        return {
+            "max_connections": OLLAMA_MAX_CONNECTIONS,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "saturation": round(self.in_flight / OLLAMA_MAX_CONNECTIONS, 3) if OLLAMA_MAX_CONNECTIONS else None,
+            "requests": self.requests,
+            "pool_waits": self.pool_waits,
+            "open_connections": open_conns,
+            "idle_connections": idle_conns,
+        }
+
+
+ollama_client = OllamaClient()
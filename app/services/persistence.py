@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import anyio
+
+from ..db import AsyncSessionLocal
+from ..models import Message
+from ..settings import PERSIST_BATCH_SIZE, PERSIST_FLUSH_MS, PERSIST_MAX_QUEUE
+
+logger = logging.getLogger(__name__)
+
+_background: Set[asyncio.Task] = set()
+
+
+async def save_messages(*messages: Message) -> None:
+    """Insert ``messages`` in one transaction on a session of their own.
+
+    Streaming generators outlive the request's session, so they must not
+    reuse it.
+    """
+    async with AsyncSessionLocal() as db:
+        db.add_all(messages)
+        await db.commit()
+
+
+def save_messages_later(*messages: Message) -> None:
+    """Schedule :func:`save_messages` from code that can't await, e.g. a cancelled stream."""
+    task = asyncio.get_running_loop().create_task(save_messages(*messages))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+_Job = Tuple[Sequence[Message], asyncio.Future]
+
+
+class MessageWriter:
+    """Write-behind queue for messages produced by the streaming endpoints.
+
+    Each submitted turn gets its ids immediately; a background worker
+    group-commits queued turns once ``PERSIST_BATCH_SIZE`` messages are
+    pending or the oldest has waited ``PERSIST_FLUSH_MS``. The queue is
+    drained on shutdown. When the worker isn't running or the queue holds
+    ``PERSIST_MAX_QUEUE`` turns, the write happens inline instead.
+    """
+
+    def __init__(self, max_batch: int, flush_ms: float, max_queue: int) -> None:
+        self.max_batch = max(1, max_batch)
+        self.flush_delay = flush_ms / 1000.0
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Newest queued turn per conversation, so readers can wait for their own writes
+        self._last: Dict[str, asyncio.Future] = {}
+        self.queued = 0
+        self.sync_writes = 0
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self) -> None:
+        """Flush everything queued so far and stop the worker."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def submit(self, *messages: Message) -> None:
+        if not self._enqueue(messages):
+            self.sync_writes += 1
+            await save_messages(*messages)
+
+    def submit_nowait(self, *messages: Message) -> None:
+        if not self._enqueue(messages):
+            self.sync_writes += 1
+            save_messages_later(*messages)
+
+    async def wait_for(self, conversation_id: str) -> None:
+        """Wait until turns already queued for ``conversation_id`` are committed."""
+        fut = self._last.get(conversation_id)
+        if fut is not None:
+            await asyncio.shield(fut)
+
+    def wait_for_sync(self, conversation_id: str) -> None:
+        """:meth:`wait_for` for sync routes, which FastAPI runs in worker threads."""
+        if conversation_id in self._last:
+            anyio.from_thread.run(self.wait_for, conversation_id)
+
+    def _enqueue(self, messages: Sequence[Message]) -> bool:
+        # Ids are assigned here so callers can report them before the commit lands
+        for msg in messages:
+            if msg.id is None:
+                msg.id = uuid.uuid4().hex
+        if self._task is None or self._queue.full():
+            return False
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((messages, fut))
+        self.queued += 1
+        cid = messages[0].conversation_id
+        self._last[cid] = fut
+        fut.add_done_callback(lambda f: self._last.pop(cid, None) if self._last.get(cid) is f else None)
+        return True
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            batch: List[_Job] = [job]
+            size = len(job[0])
+            deadline = loop.time() + self.flush_delay
+            stopping = False
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+                size += len(job[0])
+            await self._commit(batch)
+            if stopping:
+                return
+
+    async def _commit(self, batch: List[_Job]) -> None:
+        rows = [msg for messages, _ in batch for msg in messages]
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add_all(rows)
+                await db.commit()
+        except Exception:
+            if len(batch) > 1:
+                # One bad turn (e.g. its conversation was deleted meanwhile) mustn't sink the rest
+                for job in batch:
+                    await self._commit([job])
+                return
+            self.errors += 1
+            logger.exception("Dropped %d message(s) for conversation %s", len(rows), rows[0].conversation_id)
+        else:
+            self.batches += 1
+            self.rows += len(rows)
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queued": self.queued,
+            "sync_writes": self.sync_writes,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_rows": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "errors": self.errors,
+        }
+
+
+message_writer = MessageWriter(PERSIST_BATCH_SIZE, PERSIST_FLUSH_MS, PERSIST_MAX_QUEUE)
@@ -0,0 +1,158 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from ..db import SessionLocal
+from ..models import Conversation, Message
+from ..settings import PURGE_BATCH_SIZE, PURGE_INLINE_MAX_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for the status endpoint
+MAX_JOBS = 100
+
+
+class PurgeJob:
+    __slots__ = (
+        "id", "user_id", "status", "conversations", "messages",
+        "conversations_deleted", "messages_deleted", "error", "created_at", "finished_at",
+    )
+
+    def __init__(self, user_id: str, conversations: List[str], messages: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "pending"
+        self.conversations = conversations
+        self.messages = messages
+        self.conversations_deleted = 0
+        self.messages_deleted = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "conversations": len(self.conversations),
+            "messages": self.messages,
+            "conversations_deleted": self.conversations_deleted,
+            "messages_deleted": self.messages_deleted,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ConversationPurger:
+    """Set-based deletion of many conversations, in bounded transactions.
+
+    Messages go first, ``batch_size`` rows per commit, so no transaction
+    holds locks on (or journals) an unbounded number of rows; the database
+    cascades each batch to ``message_files``. The emptied conversations are
+    then deleted ``batch_size`` at a time, cascading to their stored
+    contexts. Targets holding more than ``inline_max_messages`` messages are
+    purged by a background job whose progress the caller can poll; job
+    state lives in this process only.
+    """
+
+    def __init__(self, batch_size: int, inline_max_messages: int) -> None:
+        self.batch_size = max(1, batch_size)
+        self.inline_max_messages = inline_max_messages
+        self._jobs: "OrderedDict[str, PurgeJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def plan(
+        self,
+        db: Session,
+        user_id: str,
+        ids: Optional[List[str]] = None,
+        archived_before: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> PurgeJob:
+        """Resolve the filters to the user's matching conversations (not yet deleted).
+
+        Messages are counted as stored rows, every branch included; the
+        conversation's ``message_count`` covers the active branch only.
+        """
+        q = select(Conversation.id).where(Conversation.user_id == user_id)
+        if ids:
+            q = q.where(Conversation.id.in_(ids))
+        if archived_before is not None:
+            q = q.where(Conversation.archived == True, Conversation.archived_at < archived_before)  # noqa: E712
+        if created_before is not None:
+            q = q.where(Conversation.created_at < created_before)
+        ids = list(db.scalars(q))
+        messages = db.scalar(select(func.count()).where(Message.conversation_id.in_(q))) if ids else 0
+        return PurgeJob(user_id, ids, messages)
+
+    def inline(self, job: PurgeJob) -> bool:
+        return job.messages <= self.inline_max_messages
+
+    def submit(self, job: PurgeJob) -> PurgeJob:
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("pending", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[PurgeJob]:
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.user_id == user_id else None
+
+    def run(self, job: PurgeJob) -> PurgeJob:
+        """Delete the job's conversations on sessions of its own; blocking."""
+        job.status = "running"
+        try:
+            for start in range(0, len(job.conversations), self.batch_size):
+                chunk = job.conversations[start:start + self.batch_size]
+                with SessionLocal() as db:
+                    while True:
+                        batch = (
+                            select(Message.id)
+                            .where(Message.conversation_id.in_(chunk))
+                            # Replies before the messages they answer (parent_id)
+                            .order_by(Message.seq.desc())
+                            .limit(self.batch_size)
+                            .scalar_subquery()
+                        )
+                        deleted = db.execute(
+                            delete(Message).where(Message.id.in_(batch)),
+                            execution_options={"synchronize_session": False},
+                        ).rowcount
+                        db.commit()
+                        job.messages_deleted += deleted
+                        if deleted < self.batch_size:
+                            break
+                    job.conversations_deleted += db.execute(
+                        delete(Conversation).where(Conversation.id.in_(chunk), Conversation.user_id == job.user_id),
+                        execution_options={"synchronize_session": False},
+                    ).rowcount
+                    db.commit()
+            job.status = "done"
+        except Exception as exc:
+            logger.exception("Purge job %s failed", job.id)
+            job.status = "failed"
+            job.error = str(exc)
+        job.finished_at = datetime.utcnow()
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "jobs": len(statuses),
+            "running": statuses.count("running") + statuses.count("pending"),
+            "failed": statuses.count("failed"),
+        }
+
+
+conversation_purger = ConversationPurger(PURGE_BATCH_SIZE, PURGE_INLINE_MAX_MESSAGES)
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ..settings import (
+    RESPONSE_CACHE_DISK_MAX_BYTES,
+    RESPONSE_CACHE_DISK_PATH,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+)
+
+# Fields of an Ollama result worth keeping; "context" alone can be megabytes
+_KEEP_FIELDS = ("message", "response", "done_reason", "prompt_eval_count", "eval_count")
+
+
+def is_deterministic(body: Dict[str, Any]) -> bool:
+    """Only greedy or explicitly seeded requests are safe to replay."""
+    return body.get("temperature") == 0 or body.get("seed") is not None
+
+
+def cache_key(kind: str, model: str, payload: Any, options: Dict[str, Any]) -> str:
+    canonical = json.dumps(
+        {"kind": kind, "model": model, "payload": payload, "options": options},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _DiskTier:
+    """SQLite-backed second tier, accessed from worker threads."""
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_accessed ON response_cache (accessed)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            if total > self.max_bytes:
+                self._conn.execute("DELETE FROM response_cache WHERE expires <= ?", (now,))
+                # Drop least recently used rows until we are back under budget
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS running"
+                    " FROM response_cache) WHERE running > ?)",
+                    (self.max_bytes,),
+                )
+
+
+class ResponseCache:
+    """Exact-match cache of upstream results for deterministic requests.
+
+    Memory LRU tier bounded by ``RESPONSE_CACHE_MAX_BYTES``, optional SQLite
+    tier at ``RESPONSE_CACHE_DISK_PATH``. Identical in-flight misses are
+    coalesced into a single upstream call.
+    """
+
+    def __init__(self, enabled: bool, max_bytes: int, ttl: float, disk_path: str, disk_max_bytes: int) -> None:
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._disk = _DiskTier(disk_path, disk_max_bytes) if enabled and disk_path else None
+        self._mem: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._mem.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return json.loads(entry[0])
+            self._drop(key)
+        if self._disk is not None:
+            raw = await asyncio.to_thread(self._disk.get, key)
+            if raw is not None:
+                self.disk_hits += 1
+                self._remember(key, raw)
+                return json.loads(raw)
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        raw = json.dumps({k: result[k] for k in _KEEP_FIELDS if k in result}).encode()
+        self._remember(key, raw)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, raw, self.ttl)
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The leader went away (client disconnect); take over unless we were cancelled too
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.get_or_fetch(key, fetch)
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fetch()
+            await self.set(key, result)
+            fut.set_result(result)
+            return result
+        except Exception as exc:
+            fut.set_exception(exc)
+            # Mark retrieved so a miss with no followers doesn't log a warning
+            fut.exception()
+            raise
+        except BaseException:
+            fut.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _remember(self, key: str, raw: bytes) -> None:
+        if len(raw) > self.max_bytes:
+            return
+        self._drop(key)
+        self._mem[key] = (raw, time.monotonic() + self.ttl)
+        self._bytes += len(raw)
+        while self._bytes > self.max_bytes:
+            old_key = next(iter(self._mem))
+            self._drop(old_key)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        entry = self._mem.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._mem),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "in_flight": len(self._inflight),
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_DISK_PATH,
+    RESPONSE_CACHE_DISK_MAX_BYTES,
+)
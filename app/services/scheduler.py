@@ -0,0 +1,206 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException, Request
+
+from ..settings import (
+    ADMISSION_DEFAULT_TIMEOUT,
+    ADMISSION_MAX_QUEUE,
+    MODEL_CONCURRENCY,
+    MODEL_CONCURRENCY_OVERRIDES,
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted in time."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Slot:
+    """A granted unit of model concurrency; ``release`` is idempotent.
+
+    Usable as ``async with slot:`` so it can share a line with other async
+    context managers wrapping the upstream call.
+    """
+
+    def __init__(self, queue: "ModelQueue") -> None:
+        self._queue = queue
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._queue.finish(time.monotonic() - self._started)
+
+    async def __aenter__(self) -> "Slot":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class ModelQueue:
+    """Concurrency limit plus a per-user round-robin wait queue for one model."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiting = 0
+        self._by_user: Dict[str, Deque[asyncio.Future]] = {}
+        self._turns: Deque[str] = deque()
+        self.service_time: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def estimated_wait(self, position: int) -> Optional[float]:
+        if self.service_time is None:
+            return None
+        return position / self.limit * self.service_time
+
+    def enqueue(self, user: str) -> asyncio.Future:
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        waiters = self._by_user.setdefault(user, deque())
+        if not waiters:
+            self._turns.append(user)
+        waiters.append(fut)
+        self.waiting += 1
+        return fut
+
+    def discard(self, user: str, fut: asyncio.Future) -> None:
+        waiters = self._by_user.get(user)
+        if waiters is None or fut not in waiters:
+            return
+        waiters.remove(fut)
+        self.waiting -= 1
+        if not waiters:
+            del self._by_user[user]
+            self._turns.remove(user)
+
+    def grant(self) -> Slot:
+        self.active += 1
+        self.admitted += 1
+        return Slot(self)
+
+    def finish(self, elapsed: float) -> None:
+        self.active -= 1
+        self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.limit and self._turns:
+            user = self._turns.popleft()
+            waiters = self._by_user[user]
+            fut = waiters.popleft()
+            self.waiting -= 1
+            if waiters:
+                self._turns.append(user)
+            else:
+                del self._by_user[user]
+            if not fut.done():
+                fut.set_result(self.grant())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "waiting_users": len(self._turns),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": round(self.wait_total / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait": round(self.wait_max, 4),
+            "service_time": round(self.service_time, 4) if self.service_time is not None else None,
+        }
+
+
+class AdmissionController:
+    """Per-model admission control with fair queueing across users.
+
+    Each model gets ``MODEL_CONCURRENCY`` concurrent upstream requests (see
+    ``MODEL_CONCURRENCY_OVERRIDES``). Extra requests wait in a bounded queue
+    served round-robin per user, and are rejected up front when the queue is
+    full or the estimated wait exceeds the caller's timeout.
+    """
+
+    def __init__(self) -> None:
+        self._queues: Dict[str, ModelQueue] = {}
+
+    def _queue(self, model: str) -> ModelQueue:
+        q = self._queues.get(model)
+        if q is None:
+            q = self._queues[model] = ModelQueue(MODEL_CONCURRENCY_OVERRIDES.get(model, MODEL_CONCURRENCY))
+        return q
+
+    async def acquire(self, model: str, user: Optional[str], timeout: Optional[float]) -> Slot:
+        q = self._queue(model)
+        user = user or ""
+        if q.active < q.limit and not q.waiting:
+            return q.grant()
+
+        estimate = q.estimated_wait(q.waiting + 1)
+        if q.waiting >= ADMISSION_MAX_QUEUE:
+            q.rejected += 1
+            raise AdmissionRejected("Queue full", estimate or 1)
+        if timeout is not None and estimate is not None and estimate > timeout:
+            q.rejected += 1
+            raise AdmissionRejected("Estimated wait exceeds request timeout", estimate)
+
+        fut = q.enqueue(user)
+        started = time.monotonic()
+        try:
+            slot = await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            q.discard(user, fut)
+            if fut.done() and not fut.cancelled():
+                fut.result().release()
+            q.rejected += 1
+            raise AdmissionRejected("Timed out waiting for capacity", q.estimated_wait(q.waiting + 1) or timeout)
+        except asyncio.CancelledError:
+            q.discard(user, fut)
+            if fut.done() and not fut.cancelled():
+                fut.result().release()
+            raise
+        waited = time.monotonic() - started
+        q.wait_total += waited
+        q.wait_max = max(q.wait_max, waited)
+        return slot
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model: q.stats() for model, q in self._queues.items()}
+
+
+admission = AdmissionController()
+
+
+async def admit(request: Request, model: str) -> Slot:
+    """Acquire a slot for ``model`` or raise 429 with ``Retry-After``.
+
+    The caller's deadline comes from the ``X-Request-Timeout`` header
+    (seconds), falling back to ``ADMISSION_DEFAULT_TIMEOUT``.
+    """
+    timeout: Optional[float] = ADMISSION_DEFAULT_TIMEOUT or None
+    raw = request.headers.get("x-request-timeout")
+    if raw:
+        try:
+            timeout = max(0.0, float(raw))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid X-Request-Timeout header")
+    try:
+        return await admission.acquire(model, getattr(request.state, "user_id", None), timeout)
+    except AdmissionRejected as exc:
+        raise HTTPException(
+            status_code=429,
+            detail=exc.reason,
+            headers={"Retry-After": str(exc.retry_after)},
+        )
@@ -0,0 +1,229 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ClauseElement
+
+from ..models import Conversation, Message
+from .archive import cold_storage
+
+HIGHLIGHT = ("<mark>", "</mark>")
+SNIPPET_WORDS = 12
+# Postgres text search configuration; 'simple' doesn't stem, so it works for any language
+TS_CONFIG = "simple"
+
+# The index itself comes from migrations 0007 and 0015: on SQLite, external
+# content FTS5 tables kept in sync by triggers and keyed on a fts_rowid column
+# (VACUUM may renumber the implicit rowid); on Postgres, generated tsvector
+# columns with GIN indexes. Whether it exists is checked once per database URL.
+_available: Dict[str, bool] = {}
+
+
+def search_backend(db: Session) -> Optional[str]:
+    """Dialect name when the full-text index exists, else ``None`` (``ilike`` fallback)."""
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _available:
+        dialect = bind.dialect.name
+        if dialect == "sqlite":
+            found = db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            ).first()
+        elif dialect == "postgresql":
+            found = db.execute(
+                text(
+                    "SELECT 1 FROM information_schema.columns"
+                    " WHERE table_name = 'messages' AND column_name = 'content_tsv'"
+                )
+            ).first()
+        else:
+            found = None
+        _available[key] = found is not None
+    return bind.dialect.name if _available[key] else None
+
+
+def _terms(query: str) -> List[str]:
+    return re.findall(r"\w+", query)
+
+
+def match_query(backend: str, query: str) -> Optional[str]:
+    """Turn free text into an index query: every word must match, as a prefix."""
+    terms = _terms(query)
+    if not terms:
+        return None
+    if backend == "sqlite":
+        return " ".join(f'"{t}"*' for t in terms)
+    return " & ".join(f"{t}:*" for t in terms)
+
+
+def text_matcher(backend: Optional[str], query: str) -> Callable[[str], bool]:
+    """``message_match`` in Python, for content outside the ``messages`` table (cold storage)."""
+    terms = _terms(query) if backend else []
+    if terms:
+        patterns = [re.compile(r"\b" + re.escape(term), re.IGNORECASE) for term in terms]
+        return lambda content: all(p.search(content) for p in patterns)
+    needle = query.casefold()
+    return lambda content: needle in content.casefold()
+
+
+def archived_matches(db: Session, user_id: str, query: str) -> Set[str]:
+    """Ids of the user's compacted conversations with a message matching ``query``."""
+    matches = text_matcher(search_backend(db), query)
+    return {cid for cid, _, _ in cold_storage.search(db, user_id, matches)}
+
+
+def message_match(db: Session, query: str) -> ClauseElement:
+    """Condition on ``messages`` matching ``query``, through the index when there is one.
+
+    Compacted archived conversations have no rows here; see ``archived_matches``.
+    """
+    backend = search_backend(db)
+    q = match_query(backend, query) if backend else None
+    if backend == "sqlite" and q:
+        return text(
+            "messages.fts_rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH :fts_message)"
+        ).bindparams(fts_message=q)
+    if backend == "postgresql" and q:
+        return text(f"messages.content_tsv @@ to_tsquery('{TS_CONFIG}', :fts_message)").bindparams(fts_message=q)
+    return Message.content.ilike(f"%{query}%")
+
+
+def title_match(db: Session, query: str) -> ClauseElement:
+    backend = search_backend(db)
+    q = match_query(backend, query) if backend else None
+    if backend == "sqlite" and q:
+        return text(
+            "conversations.fts_rowid IN (SELECT rowid FROM conversations_fts WHERE conversations_fts MATCH :fts_title)"
+        ).bindparams(fts_title=q)
+    if backend == "postgresql" and q:
+        return text(f"conversations.title_tsv @@ to_tsquery('{TS_CONFIG}', :fts_title)").bindparams(fts_title=q)
+    return Conversation.title.ilike(f"%{query}%")
+
+
+_SQLITE_SEARCH = """
+SELECT * FROM (
+    SELECT c.id AS conversation_id, c.title AS title, NULL AS message_id, NULL AS role,
+           snippet(conversations_fts, 0, :open, :close, '…', :words) AS snippet,
+           -bm25(conversations_fts) AS score
+    FROM conversations_fts JOIN conversations c ON c.fts_rowid = conversations_fts.rowid
+    WHERE conversations_fts MATCH :q AND c.user_id = :user_id {archived}
+    UNION ALL
+    SELECT c.id, c.title, m.id, m.role,
+           snippet(messages_fts, 0, :open, :close, '…', :words),
+           -bm25(messages_fts)
+    FROM messages_fts
+    JOIN messages m ON m.fts_rowid = messages_fts.rowid
+    JOIN conversations c ON c.id = m.conversation_id
+    WHERE messages_fts MATCH :q AND c.user_id = :user_id {archived}
+) AS hits
+ORDER BY score DESC
+LIMIT :limit OFFSET :offset
+"""
+
+_POSTGRES_SEARCH = f"""
+SELECT * FROM (
+    SELECT c.id AS conversation_id, c.title AS title, NULL AS message_id, NULL AS role,
+           ts_headline('{TS_CONFIG}', coalesce(c.title, ''), q, :options) AS snippet,
+           ts_rank(c.title_tsv, q) AS score
+    FROM conversations c, to_tsquery('{TS_CONFIG}', :q) AS q
+    WHERE c.title_tsv @@ q AND c.user_id = :user_id {{archived}}
+    UNION ALL
+    SELECT c.id, c.title, m.id, m.role,
+           ts_headline('{TS_CONFIG}', m.content, q, :options),
+           ts_rank(m.content_tsv, q)
+    FROM messages m JOIN conversations c ON c.id = m.conversation_id, to_tsquery('{TS_CONFIG}', :q) AS q
+    WHERE m.content_tsv @@ q AND c.user_id = :user_id {{archived}}
+) AS hits
+ORDER BY score DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+def _snippet(content: str, query: str) -> str:
+    """Fallback snippet: a window of words around the first case-insensitive hit."""
+    pos = content.lower().find(query.lower())
+    if pos < 0:
+        return content[:120]
+    start = max(0, pos - 60)
+    end = min(len(content), pos + len(query) + 60)
+    hit = HIGHLIGHT[0] + content[pos:pos + len(query)] + HIGHLIGHT[1]
+    return ("…" if start else "") + content[start:pos] + hit + content[pos + len(query):end] + ("…" if end < len(content) else "")
+
+
+def search(
+    db: Session, user_id: str, query: str, limit: int, offset: int = 0, include_archived: bool = False
+) -> List[Dict[str, Any]]:
+    """Ranked title and message hits with highlighted snippets, best first.
+
+    With ``include_archived``, messages in cold storage are matched after
+    decoding and rank after the indexed hits.
+    """
+    backend = search_backend(db)
+    q = match_query(backend, query) if backend else None
+    if not include_archived:
+        return _search_hot(db, backend, q, user_id, query, limit, offset, include_archived)
+    # Cold hits follow every indexed one, so page over both from the start
+    hits = _search_hot(db, backend, q, user_id, query, offset + limit, 0, include_archived)
+    if len(hits) < offset + limit:
+        first = _terms(query)[0] if q else query
+        for cid, title, message in cold_storage.search(db, user_id, text_matcher(backend, query)):
+            hits.append({"conversation_id": cid, "title": title, "message_id": message["id"],
+                         "role": message["role"], "snippet": _snippet(message["content"], first), "score": 0.0})
+            if len(hits) >= offset + limit:
+                break
+    return hits[offset:offset + limit]
+
+
+def _search_hot(
+    db: Session,
+    backend: Optional[str],
+    q: Optional[str],
+    user_id: str,
+    query: str,
+    limit: int,
+    offset: int,
+    include_archived: bool,
+) -> List[Dict[str, Any]]:
+    if q:
+        archived = "" if include_archived else "AND NOT c.archived"
+        params: Dict[str, Any] = {"q": q, "user_id": user_id, "limit": limit, "offset": offset}
+        if backend == "sqlite":
+            sql = _SQLITE_SEARCH.format(archived=archived)
+            params.update(open=HIGHLIGHT[0], close=HIGHLIGHT[1], words=SNIPPET_WORDS)
+        else:
+            sql = _POSTGRES_SEARCH.format(archived=archived)
+            params["options"] = f"StartSel={HIGHLIGHT[0]},StopSel={HIGHLIGHT[1]},MaxWords={SNIPPET_WORDS * 2},MinWords={SNIPPET_WORDS // 2}"
+        return [dict(row._mapping) for row in db.execute(text(sql), params)]
+
+    # No index: unranked scan, titles first, newest first
+    convo_filter = [Conversation.user_id == user_id]
+    if not include_archived:
+        convo_filter.append(Conversation.archived == False)  # noqa: E712
+    titles = (
+        db.query(Conversation.id, Conversation.title)
+        .filter(*convo_filter, Conversation.title.ilike(f"%{query}%"))
+        .order_by(Conversation.created_at.desc())
+        .limit(offset + limit)
+        .all()
+    )
+    hits = [
+        {"conversation_id": cid, "title": title, "message_id": None, "role": None,
+         "snippet": _snippet(title or "", query), "score": 0.0}
+        for cid, title in titles
+    ]
+    if len(hits) < offset + limit:
+        rows = (
+            db.query(Conversation.id, Conversation.title, Message.id, Message.role, Message.content)
+            .join(Message, Message.conversation_id == Conversation.id)
+            .filter(*convo_filter, Message.content.ilike(f"%{query}%"))
+            .order_by(Message.created_at.desc())
+            .limit(offset + limit - len(hits))
+            .all()
+        )
+        hits += [
+            {"conversation_id": cid, "title": title, "message_id": mid, "role": role,
+             "snippet": _snippet(content, query), "score": 0.0}
+            for cid, title, mid, role, content in rows
+        ]
+    return hits[offset:offset + limit]
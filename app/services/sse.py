@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+from ..settings import SSE_COALESCE_MS, SSE_COALESCE_TOKENS
+
+try:  # optional fast path
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    loads = json.loads
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def dumps(obj: Any) -> bytes:
+        return _encode(obj).encode()
+
+
+DONE = b"data: [DONE]\n\n"
+
+
+def event(obj: Any) -> bytes:
+    """Encode one complete SSE ``data:`` frame."""
+    return b"data: " + dumps(obj) + b"\n\n"
+
+
+class StreamEncoder:
+    """SSE encoder for one OpenAI-style stream.
+
+    The envelope (``id``, ``object``, ``created``, ``model`` and the choice
+    scaffolding) is rendered once; each token only pays for escaping the
+    delta string and two byte concatenations.
+    """
+
+    __slots__ = ("envelope", "_prefix", "_suffix")
+
+    def __init__(self, envelope: Dict[str, Any], delta_prefix: bytes, delta_suffix: bytes) -> None:
+        self.envelope = envelope
+        # Drop the closing brace so the choices can be spliced in after it
+        head = dumps(envelope)[:-1]
+        self._prefix = b"data: " + head + delta_prefix
+        self._suffix = delta_suffix
+
+    def delta(self, text: str) -> bytes:
+        return self._prefix + dumps(text) + self._suffix
+
+    def final(self, **fields: Any) -> bytes:
+        return event({**self.envelope, **fields})
+
+
+def chat_encoder(cid: str, created: int, model: str) -> StreamEncoder:
+    return StreamEncoder(
+        {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model},
+        b',"choices":[{"index":0,"delta":{"role":"assistant","content":',
+        b'},"finish_reason":null}]}\n\n',
+    )
+
+
+def completion_encoder(cid: str, created: int, model: str) -> StreamEncoder:
+    return StreamEncoder(
+        {"id": cid, "object": "text_completion", "created": created, "model": model},
+        b',"choices":[{"index":0,"text":',
+        b',"finish_reason":null,"logprobs":null}]}\n\n',
+    )
+
+
+class DeltaEncoder:
+    """Encoder for the ``{"delta": ...}`` frames of conversation replies."""
+
+    __slots__ = ()
+
+    def delta(self, text: str) -> bytes:
+        return b'data: {"delta":' + dumps(text) + b"}\n\n"
+
+
+class FrameBuffer:
+    """Coalesces SSE frames so several tokens go out in one write.
+
+    Frames are released once ``max_frames`` are pending or the oldest pending
+    frame is ``max_delay_ms`` old: by ``push`` when the next token arrives,
+    or by ``paced`` when upstream is slower than that. With
+    ``max_frames <= 1`` every frame is passed straight through.
+    """
+
+    __slots__ = ("max_frames", "max_delay", "_frames", "_since")
+
+    def __init__(self, max_frames: int = SSE_COALESCE_TOKENS, max_delay_ms: float = SSE_COALESCE_MS) -> None:
+        self.max_frames = max_frames
+        self.max_delay = max_delay_ms / 1000.0
+        self._frames: List[bytes] = []
+        self._since = 0.0
+
+    def push(self, frame: bytes) -> Optional[bytes]:
+        if self.max_frames <= 1:
+            return frame
+        frames = self._frames
+        if not frames:
+            self._since = time.monotonic()
+        frames.append(frame)
+        if len(frames) >= self.max_frames or time.monotonic() - self._since >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self) -> bytes:
+        out = b"".join(self._frames)
+        self._frames.clear()
+        return out
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the pending frames are due, or ``None`` when none are pending."""
+        if not self._frames:
+            return None
+        return max(0.0, self._since + self.max_delay - time.monotonic())
+
+    async def paced(self, lines: AsyncIterable[str]) -> AsyncIterator[Tuple[Optional[str], bytes]]:
+        """``(line, b"")`` for each upstream line, or ``(None, frames)`` when pending frames fall due.
+
+        While frames are pending the next line is awaited with a timeout, so a
+        stalled upstream doesn't hold back tokens already received. The read
+        itself is shielded: a timeout must not cancel it mid-line.
+        """
+        it = lines.__aiter__()
+        while True:
+            remaining = self.remaining()
+            if remaining is None:
+                try:
+                    line = await it.__anext__()
+                except StopAsyncIteration:
+                    return
+                yield line, b""
+                continue
+            pending = asyncio.ensure_future(it.__anext__())
+            try:
+                try:
+                    line = await asyncio.wait_for(asyncio.shield(pending), remaining)
+                except asyncio.TimeoutError:
+                    yield None, self.flush()
+                    line = await pending
+            except StopAsyncIteration:
+                return
+            finally:
+                pending.cancel()
+            yield line, b""
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request
+
+from ..settings import STREAM_DISCONNECT_CHECK_INTERVAL
+
+
+class StreamStats:
+    """Process-wide counters for streamed generations."""
+
+    def __init__(self) -> None:
+        self.completed = 0
+        self.abandoned = 0
+        self.tokens_streamed_to_abandoned = 0
+        self.tokens_saved = 0
+        self.gpu_seconds_saved = 0.0
+        self.partials_persisted = 0
+        # EWMA of completion length per model, used when num_predict is unset
+        self._typical_tokens: Dict[str, float] = {}
+
+    def record_completed(self, model: str, tokens: int) -> None:
+        self.completed += 1
+        prev = self._typical_tokens.get(model)
+        self._typical_tokens[model] = tokens if prev is None else 0.8 * prev + 0.2 * tokens
+
+    def expected_tokens(self, model: str, num_predict: Optional[int]) -> Optional[float]:
+        typical = self._typical_tokens.get(model)
+        if num_predict is not None and num_predict > 0:
+            return min(num_predict, typical) if typical is not None else num_predict
+        return typical
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "completed": self.completed,
+            "abandoned": self.abandoned,
+            "tokens_streamed_to_abandoned": self.tokens_streamed_to_abandoned,
+            "tokens_saved": self.tokens_saved,
+            "gpu_seconds_saved": round(self.gpu_seconds_saved, 3),
+            "partials_persisted": self.partials_persisted,
+        }
+
+
+stream_stats = StreamStats()
+
+
+class StreamWatcher:
+    """Watches one streamed generation for a client that went away.
+
+    Use as ``async with watcher, slot, backend_pool.acquire(...)`` and call
+    ``await watcher.disconnected()`` per upstream line; returning out of the
+    loop closes the upstream response, which makes Ollama stop generating.
+    On exit, a stream that did not reach ``done`` (disconnect, cancellation
+    or generator close) is counted as abandoned and ``on_abandon`` runs.
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        model: str,
+        num_predict: Optional[int] = None,
+        on_abandon: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.request = request
+        self.model = model
+        self.num_predict = num_predict
+        self.on_abandon = on_abandon
+        self.tokens = 0
+        self.completed = False
+        self.gone = False
+        self._first_token_at: Optional[float] = None
+        self._next_check = 0.0
+
+    def token(self) -> None:
+        if self._first_token_at is None:
+            self._first_token_at = time.monotonic()
+        self.tokens += 1
+
+    def complete(self, chunk: Dict[str, Any]) -> None:
+        self.completed = True
+        stream_stats.record_completed(self.model, int(chunk.get("eval_count") or self.tokens))
+
+    async def disconnected(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + STREAM_DISCONNECT_CHECK_INTERVAL
+        self.gone = await self.request.is_disconnected()
+        return self.gone
+
+    async def __aenter__(self) -> "StreamWatcher":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self.completed:
+            return
+        cancelled = exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit))
+        if not (self.gone or cancelled):
+            return
+        stream_stats.abandoned += 1
+        stream_stats.tokens_streamed_to_abandoned += self.tokens
+        expected = stream_stats.expected_tokens(self.model, self.num_predict)
+        if expected is not None and expected > self.tokens:
+            saved = int(expected - self.tokens)
+            stream_stats.tokens_saved += saved
+            if self._first_token_at is not None and self.tokens > 1:
+                per_token = (time.monotonic() - self._first_token_at) / (self.tokens - 1)
+                stream_stats.gpu_seconds_saved += saved * per_token
+        if self.on_abandon is not None:
+            self.on_abandon()
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, attributes
+
+from ..models import Conversation, Message
+from .branches import path_cte
+
+PREVIEW_CHARS = 120
+
+_conversations = Conversation.__table__
+_messages = Message.__table__
+
+
+def refresh_summary(conn: Connection, conversation_id: str) -> None:
+    """Recompute a conversation's summary columns from its active branch and bump its version.
+
+    Used after branch switches and deletes, and by the flush hook below for
+    inserts off the active branch; appends, the hot path, are applied
+    incrementally.
+    """
+    in_convo = _messages.c.conversation_id == conversation_id
+    count = conn.scalar(select(func.count()).select_from(path_cte(conversation_id)))
+    leaf = select(_messages.c.content).where(_messages.c.id == _conversations.c.active_leaf_id)
+    conn.execute(
+        update(_conversations)
+        .where(_conversations.c.id == conversation_id)
+        .values(
+            message_count=count,
+            last_message_preview=func.substr(leaf.scalar_subquery(), 1, PREVIEW_CHARS),
+            last_message_at=select(func.max(_messages.c.created_at)).where(in_convo).scalar_subquery(),
+            version=_conversations.c.version + 1,
+        )
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_message_writes(session: Session, _ctx) -> None:
+    # Runs for sync sessions and for the sync half of AsyncSession alike
+    added: Dict[str, List[Message]] = defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, Message):
+            added[obj.conversation_id].append(obj)
+    stale = {obj.conversation_id for obj in session.deleted if isinstance(obj, Message)}
+    stale.update(
+        obj.conversation_id
+        for obj in session.dirty
+        if isinstance(obj, Message) and attributes.get_history(obj, "content").has_changes()
+    )
+    # Title / archive changes: the summaries stay, the version moves
+    renamed = {
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, Conversation) and session.is_modified(obj, include_collections=False)
+    }
+    renamed -= added.keys() | stale
+    if not added and not stale and not renamed:
+        return
+    conn = session.connection()
+    if renamed:
+        conn.execute(
+            update(_conversations)
+            .where(_conversations.c.id.in_(renamed))
+            .values(version=_conversations.c.version + 1)
+        )
+    for conversation_id, msgs in added.items():
+        # The newest message becomes the active leaf. Messages appended to the
+        # active branch (the oldest hangs off the current leaf, the rest chain
+        # on from it) are counted incrementally; anything else, like an edit's
+        # sibling or a turn written after the leaf moved, is recounted.
+        msgs.sort(key=lambda m: m.seq)
+        newest = msgs[-1]
+        chained = all(m.parent_id == prev.id for prev, m in zip(msgs, msgs[1:]))
+        if conversation_id not in stale and chained:
+            parent = msgs[0].parent_id
+            at_leaf = (
+                _conversations.c.active_leaf_id == parent
+                if parent is not None
+                else _conversations.c.active_leaf_id.is_(None)
+            )
+            appended = conn.execute(
+                update(_conversations)
+                .where(_conversations.c.id == conversation_id, at_leaf)
+                .values(
+                    active_leaf_id=newest.id,
+                    message_count=_conversations.c.message_count + len(msgs),
+                    last_message_preview=(newest.content or "")[:PREVIEW_CHARS],
+                    last_message_at=newest.created_at,
+                    version=_conversations.c.version + 1,
+                )
+            ).rowcount
+            if appended:
+                continue
+        conn.execute(
+            update(_conversations)
+            .where(_conversations.c.id == conversation_id)
+            .values(active_leaf_id=newest.id)
+        )
+        stale.add(conversation_id)
+    for conversation_id in stale:
+        refresh_summary(conn, conversation_id)
@@ -2,14 +2,84 @@ import os
 
 # Auth
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))  # seconds
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "30"))  # seconds
 
 # Ollama
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Comma-separated pool of backends; defaults to the single OLLAMA_HOST
+OLLAMA_HOSTS = [
+    h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if h.strip()
+] or [OLLAMA_HOST]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))  # seconds, 0 disables probing
+OLLAMA_MAX_FAILS = int(os.getenv("OLLAMA_MAX_FAILS", "3"))
+OLLAMA_AFFINITY_SIZE = int(os.getenv("OLLAMA_AFFINITY_SIZE", "10000"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "100"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "20"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))  # seconds
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))  # seconds
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))  # seconds between bytes
+OLLAMA_POOL_TIMEOUT = float(os.getenv("OLLAMA_POOL_TIMEOUT", "30"))  # seconds waiting for a connection
 DEFAULT_MODEL = os.getenv("MODEL", "llama3.1")
 ALLOWED_MODELS = {
     m.strip() for m in os.getenv("MODELS", os.getenv("MODEL", DEFAULT_MODEL)).split(",") if m.strip()
 }
 
+# Admission control: concurrent upstream requests per model, e.g. MODEL_CONCURRENCY_OVERRIDES="llama3.1=8,mistral:7b-instruct=2"
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "4"))
+MODEL_CONCURRENCY_OVERRIDES = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=") for item in os.getenv("MODEL_CONCURRENCY_OVERRIDES", "").split(",") if "=" in item
+    )
+}
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))  # waiting requests per model
+ADMISSION_DEFAULT_TIMEOUT = float(os.getenv("ADMISSION_DEFAULT_TIMEOUT", "60"))  # seconds, 0 waits forever
+
+# Exact-match cache for deterministic (temperature=0 or seeded) completions
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+RESPONSE_CACHE_DISK_PATH = os.getenv("RESPONSE_CACHE_DISK_PATH", "")  # SQLite file, empty disables
+RESPONSE_CACHE_DISK_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Streaming: how often to poll for a vanished client, and what to do with a half-written reply
+STREAM_DISCONNECT_CHECK_INTERVAL = float(os.getenv("STREAM_DISCONNECT_CHECK_INTERVAL", "0.25"))  # seconds
+STREAM_PARTIAL_POLICY = os.getenv("STREAM_PARTIAL_POLICY", "discard")  # 'discard' or 'persist'
+# SSE frame coalescing: flush after this many tokens or once the oldest pending token is this old
+SSE_COALESCE_TOKENS = int(os.getenv("SSE_COALESCE_TOKENS", "1"))  # 1 disables coalescing
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "20"))
+
+# Embeddings micro-batching
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))  # inputs per upstream call
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+# History assembly: prompt window per model, e.g. MODEL_CONTEXT_OVERRIDES="llama3.1=131072"
+MODEL_CONTEXT = int(os.getenv("MODEL_CONTEXT", "4096"))  # tokens, Ollama's default num_ctx
+MODEL_CONTEXT_OVERRIDES = {
+    name.strip(): int(size)
+    for name, _, size in (
+        item.partition("=") for item in os.getenv("MODEL_CONTEXT_OVERRIDES", "").split(",") if "=" in item
+    )
+}
+HISTORY_RESERVE_TOKENS = int(os.getenv("HISTORY_RESERVE_TOKENS", "1024"))  # left free for the reply
+# Continue server-side conversations from Ollama's returned context instead of resending the transcript
+CONVERSATION_CONTEXT_REUSE = os.getenv("CONVERSATION_CONTEXT_REUSE", "0").lower() in ("1", "true", "yes")
+
+# Write-behind persistence of generated messages: group commit on size or age
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "64"))  # messages per commit
+PERSIST_FLUSH_MS = float(os.getenv("PERSIST_FLUSH_MS", "20"))
+PERSIST_MAX_QUEUE = int(os.getenv("PERSIST_MAX_QUEUE", "1000"))  # pending turns before writing inline
+
+# Cold storage of archived conversations
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "gzip")  # or 'zstd' (needs the zstandard package)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))  # conversations per run of the backfill job
+
+# Bulk conversation deletion
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))  # rows per delete transaction
+PURGE_INLINE_MAX_MESSAGES = int(os.getenv("PURGE_INLINE_MAX_MESSAGES", "10000"))  # larger purges run in the background
+
 FRONTEND_URL = os.getenv("FRONTEND_URL", "")
 ADDITIONAL_CORS = [u.strip() for u in os.getenv("ADDITIONAL_CORS", "").split(",") if u.strip()]
 
@@ -47,3 +117,13 @@ FILE_STORAGE_BACKEND = os.getenv("FILE_STORAGE_BACKEND", "local")  # 'local' or
 FILE_STORAGE_LOCAL_PATH = os.getenv("FILE_STORAGE_LOCAL_PATH", "uploads")
 FILE_STORAGE_S3_BUCKET = os.getenv("FILE_STORAGE_S3_BUCKET", "")
 FILE_PUBLIC_BASE_URL = os.getenv("FILE_PUBLIC_BASE_URL", "")
+FILE_UPLOAD_CHUNK_SIZE = int(os.getenv("FILE_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # bytes read and written at a time
+# Signed /files/{id}/content links for local storage (S3 uses presigned URLs); empty disables them
+FILE_URL_SIGNING_KEY = os.getenv("FILE_URL_SIGNING_KEY", "")
+FILE_URL_TTL = int(os.getenv("FILE_URL_TTL", "3600"))  # seconds a signed link stays valid
+# Model-ready derivatives of attachments, built after upload in a process pool
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))  # 0 builds in the calling thread
+DERIVATIVE_IMAGE_MAX_EDGE = int(os.getenv("DERIVATIVE_IMAGE_MAX_EDGE", "1024"))  # pixels; needs Pillow
+DERIVATIVE_TEXT_MAX_CHARS = int(os.getenv("DERIVATIVE_TEXT_MAX_CHARS", "20000"))  # text kept per file
+DERIVATIVE_IMAGE_TOKENS = int(os.getenv("DERIVATIVE_IMAGE_TOKENS", "768"))  # history budget charged per image
+DERIVATIVE_CACHE_BYTES = int(os.getenv("DERIVATIVE_CACHE_BYTES", str(64 * 1024 * 1024)))  # in-memory LRU
@@ -0,0 +1,13 @@
+import math
+
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap tokenizer-free estimate: about four UTF-8 bytes per token.
+
+    Counting bytes rather than characters keeps CJK and other multi-byte
+    scripts from being badly underestimated.
+    """
+    return math.ceil(len(text.encode("utf-8")) / 4) + MESSAGE_OVERHEAD
@@ -0,0 +1,108 @@
+"""Event-loop lag while handlers hit the database: sync Session vs AsyncSession.
+
+Each simulated request loads a conversation's history and commits one
+message, as ``generate_reply`` does. A probe task sleeps 1 ms in a loop and
+records how late it wakes up; that delay is what every other stream on the
+worker waits for.
+
+Run from the repo root: ``python -m benchmarks.event_loop_lag``
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import select  # noqa: E402
+
+from app.db import AsyncSessionLocal, Base, SessionLocal, async_engine, engine  # noqa: E402
+from app.models import Conversation, Message  # noqa: E402
+
+CONCURRENCY = 32
+REQUESTS = 400
+HISTORY = 50
+
+
+def setup() -> str:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    convo = Conversation(title="bench")
+    db.add(convo)
+    db.flush()
+    db.add_all(Message(conversation_id=convo.id, role="user", content="x" * 200) for _ in range(HISTORY))
+    db.commit()
+    cid = convo.id
+    db.close()
+    return cid
+
+
+async def sync_request(cid: str) -> None:
+    # What the handlers used to do: blocking calls straight from the coroutine
+    db = SessionLocal()
+    try:
+        db.execute(select(Message.role, Message.content).where(Message.conversation_id == cid)).all()
+        db.add(Message(conversation_id=cid, role="assistant", content="reply"))
+        db.commit()
+    finally:
+        db.close()
+    await asyncio.sleep(0)
+
+
+async def async_request(cid: str) -> None:
+    async with AsyncSessionLocal() as db:
+        (await db.execute(select(Message.role, Message.content).where(Message.conversation_id == cid))).all()
+        db.add(Message(conversation_id=cid, role="assistant", content="reply"))
+        await db.commit()
+
+
+async def run(handler, cid: str):
+    lags, stop = [], asyncio.Event()
+
+    async def probe():
+        while not stop.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - t - 0.001) * 1000)
+
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with sem:
+            await handler(cid)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    return elapsed, lags
+
+
+def report(name, elapsed, lags):
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{name:6s} {REQUESTS / elapsed:7.0f} req/s  loop lag p50 {statistics.median(lags):6.2f} ms"
+        f"  p99 {p99:6.2f} ms  max {lags[-1]:6.2f} ms  probe wakeups {len(lags)}"
+    )
+
+
+async def main():
+    cid = setup()
+    # Warm both pools so connection setup isn't measured
+    await async_request(cid)
+    await sync_request(cid)
+    for name, handler in (("sync", sync_request), ("async", async_request)):
+        report(name, *await run(handler, cid))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""Per-token CPU cost of the chat streaming loop: legacy vs StreamEncoder.
+
+Run from the repo root: ``python -m benchmarks.sse_encoder``
+"""
+import json
+import os
+import sys
+import time
+import timeit
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import sse  # noqa: E402
+
+N = 200_000
+LINE = json.dumps({"model": "llama3.1", "created_at": "2025-01-01T00:00:00Z",
+                   "message": {"role": "assistant", "content": " token"}, "done": False})
+CID, CREATED, MODEL = "chatcmpl-0123456789abcdef0123456789abcdef", int(time.time()), "llama3.1"
+
+
+def legacy():
+    chunk = json.loads(LINE)
+    msg = chunk.get("message")
+    content_delta = (msg.get("content", "") if isinstance(msg, dict) else chunk.get("response", "")) or ""
+    frame = {"id": CID, "object": "chat.completion.chunk", "created": CREATED, "model": MODEL,
+             "choices": [{"index": 0, "delta": {"role": "assistant", "content": content_delta}, "finish_reason": None}]}
+    return f"data: {json.dumps(frame)}\n\n".encode()
+
+
+enc = sse.chat_encoder(CID, CREATED, MODEL)
+
+
+def encoder():
+    chunk = sse.loads(LINE)
+    msg = chunk.get("message")
+    content_delta = (msg.get("content", "") if isinstance(msg, dict) else chunk.get("response", "")) or ""
+    return enc.delta(content_delta)
+
+
+def main():
+    assert json.loads(legacy()[6:]) == json.loads(encoder()[6:])
+    for name, fn in (("legacy", legacy), ("encoder", encoder)):
+        best = min(timeit.repeat(fn, number=N, repeat=5))
+        print(f"{name:8s} {best / N * 1e9:8.0f} ns/token")
+    print(f"json backend: {'orjson' if sse.orjson else 'stdlib'}")
+
+
+if __name__ == "__main__":
+    main()
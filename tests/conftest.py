@@ -0,0 +1,58 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+
+# Importing any app module builds the engine from DATABASE_URL, so make sure
+# it points at the same throwaway SQLite file regardless of collection order.
+os.environ.setdefault("DATABASE_URL", "sqlite:///test.db")
+
+
+@pytest.fixture
+def fresh_db():
+    """Ensure the schema exists in the test database and empty it afterwards."""
+    from app.db import Base, async_engine, engine
+
+    # Other tests delete and recreate the SQLite file; drop pooled handles to the old one
+    engine.dispose()
+    async_engine.sync_engine.dispose(close=False)
+    Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add indexes a stale file predates
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    yield
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+
+def _migration(name):
+    path = Path(__file__).resolve().parents[1] / "app" / "migrations" / "versions" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def search_index(fresh_db):
+    """Add the full-text index the way the shipped migrations do and remove it afterwards."""
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    from app.db import engine
+    from app.services import search
+
+    steps = [_migration("0007_fulltext_search"), _migration("0015_stable_search_rowids")]
+
+    def run(stage):
+        with engine.begin() as conn, Operations.context(MigrationContext.configure(conn)):
+            for step in steps if stage == "upgrade" else reversed(steps):
+                getattr(step, stage)()
+        search._available.clear()
+
+    run("upgrade")
+    yield
+    run("downgrade")
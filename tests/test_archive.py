@@ -0,0 +1,126 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal
+from app.models import Conversation, ConversationArchive, File, Message, User
+from app.routers import conversations
+from app.services import archive, cold_storage
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+
+HEADERS = {"Authorization": "Bearer archive-key"}
+
+
+def _hot_rows(cid):
+    db = SessionLocal()
+    n = db.query(Message).filter_by(conversation_id=cid).count()
+    db.close()
+    return n
+
+
+def test_archived_messages_move_to_cold_storage_and_back():
+    db = SessionLocal()
+    user = User(username="archiver", password_hash="p", api_key="archive-key")
+    db.add(user)
+    db.flush()
+    doc = File(mime_type="text/plain", size=1, name="a.txt", path="a.txt", owner=user.id)
+    db.add(doc)
+    db.commit()
+    doc_id = doc.id
+    db.close()
+
+    with TestClient(app) as client:
+        cid = client.post("/conversations", json={"title": "old"}, headers=HEADERS).json()["id"]
+        url = f"/conversations/{cid}/messages"
+        first = client.post(url, json={"role": "user", "content": "hello", "file_ids": [doc_id]}, headers=HEADERS).json()
+        client.post(url, json={"role": "assistant", "content": "world"}, headers=HEADERS)
+        client.patch(f"{url}/{first['id']}", json={"content": "hi"}, headers=HEADERS)
+        before = client.get(f"/conversations/{cid}", headers=HEADERS).json()
+        branches = client.get(f"/conversations/{cid}/branches", headers=HEADERS).json()
+
+        client.patch(f"/conversations/{cid}", json={"archived": True}, headers=HEADERS)
+        assert _hot_rows(cid) == 0
+        assert client.get(f"/conversations/{cid}", headers=HEADERS).json() == {**before, "archived": True}
+        assert client.get(f"/conversations/{cid}/branches", headers=HEADERS).json() == branches
+        assert [m["content"] for m in client.get(url, params={"search": "WOR"}, headers=HEADERS).json()] == ["world"]
+
+        client.patch(f"/conversations/{cid}", json={"archived": False}, headers=HEADERS)
+        assert _hot_rows(cid) == 3
+        assert client.get(f"/conversations/{cid}", headers=HEADERS).json() == before
+        convo = client.post(f"/conversations/{cid}/branches/{first['id']}", headers=HEADERS).json()
+        assert [m["files"][0]["id"] for m in convo["messages"][:1]] == [doc_id]
+
+        # Archived without compaction (e.g. before this existed): the backfill job picks it up,
+        # and a new message thaws it again
+        db = SessionLocal()
+        db.get(Conversation, cid).archived = True
+        db.commit()
+        db.close()
+        assert cold_storage.compact_pending(10) == (1, cid) and _hot_rows(cid) == 0
+        assert cold_storage.compact_pending(10, cid) == (0, None)
+        client.post(url, json={"role": "user", "content": "more"}, headers=HEADERS)
+        assert [m["content"] for m in client.get(url, headers=HEADERS).json()] == ["hello", "world", "more"]
+        db = SessionLocal()
+        assert db.query(ConversationArchive).count() == 0
+        db.close()
+
+
+def test_backfill_moves_past_conversations_that_fail(monkeypatch):
+    db = SessionLocal()
+    convos = [Conversation(title=f"c{i}", archived=True) for i in range(3)]
+    db.add_all(convos)
+    db.flush()
+    db.add_all(Message(conversation_id=c.id, role="user", content="hi") for c in convos)
+    db.commit()
+    broken, *rest = sorted(c.id for c in convos)
+    db.close()
+
+    compact = cold_storage.compact
+
+    def failing(db, conversation_id):
+        if conversation_id == broken:
+            raise RuntimeError("boom")
+        return compact(db, conversation_id)
+
+    # A first batch made only of failures must not end the backfill
+    monkeypatch.setattr(cold_storage, "compact", failing)
+    monkeypatch.setattr(archive, "ARCHIVE_BATCH_SIZE", 1)
+    archive.main()
+    assert [_hot_rows(cid) for cid in (broken, *rest)] == [1, 0, 0]
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_search_finds_compacted_conversations(indexed, request):
+    db = SessionLocal()
+    db.add(User(username=f"cold-searcher-{indexed}", password_hash="p", api_key=f"cold-search-{indexed}"))
+    db.commit()
+    db.close()
+    headers = {"Authorization": f"Bearer cold-search-{indexed}"}
+    if indexed:
+        request.getfixturevalue("search_index")
+    with TestClient(app) as client:
+        cid = client.post("/conversations", json={"title": "Trip"}, headers=headers).json()["id"]
+        client.post(f"/conversations/{cid}/messages", json={"role": "user", "content": "Book a train to Lisbon"}, headers=headers)
+        client.patch(f"/conversations/{cid}", json={"archived": True}, headers=headers)
+        assert _hot_rows(cid) == 0
+
+        hits = client.get("/conversations/search", params={"q": "lisbon", "include_archived": True}, headers=headers).json()
+        assert [(h["conversation_id"], h["role"]) for h in hits] == [(cid, "user")]
+        assert "<mark>" in hits[0]["snippet"]
+        assert client.get("/conversations/search", params={"q": "lisbon"}, headers=headers).json() == []
+
+        listed = client.get("/conversations", params={"search": "lisbon", "include_archived": True}, headers=headers).json()
+        assert [c["id"] for c in listed] == [cid]
+        assert client.get("/conversations", params={"search": "lisbon"}, headers=headers).json() == []
@@ -0,0 +1,98 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import update
+
+from app.db import SessionLocal
+from app.models import User
+from app.services.auth_cache import ApiKeyCache, MISSING, api_key_cache
+
+
+def test_hit_miss_and_negative_caching():
+    cache = ApiKeyCache(maxsize=10, ttl=60, negative_ttl=60)
+    assert cache.get("k1") is MISSING
+    cache.set("k1", "u1")
+    cache.set("bad", None)
+    assert cache.get("k1") == "u1"
+    assert cache.get("bad") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["negative_hits"] == 1
+
+    # A positive entry replaces a stale negative one
+    cache.set("bad", "u2")
+    assert cache.get("bad") == "u2"
+
+
+def test_lru_eviction_and_ttl():
+    cache = ApiKeyCache(maxsize=2, ttl=0.05, negative_ttl=0.05)
+    cache.set("a", "ua")
+    cache.set("b", "ub")
+    cache.get("a")
+    cache.set("c", "uc")
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == "ua"
+    time.sleep(0.06)
+    assert cache.get("a") is MISSING
+
+
+def test_invalidate_user_drops_all_keys():
+    cache = ApiKeyCache(maxsize=10, ttl=60, negative_ttl=60)
+    cache.set("k1", "u1")
+    cache.set("k2", "u1")
+    cache.set("k3", "u2")
+    cache.invalidate_user("u1")
+    assert cache.get("k1") is MISSING
+    assert cache.get("k2") is MISSING
+    assert cache.get("k3") == "u2"
+
+
+def test_lookup_racing_an_invalidation_is_not_cached():
+    cache = ApiKeyCache(maxsize=10, ttl=60, negative_ttl=60)
+    generation = cache.generation
+    # The key is rotated while the lookup is in flight
+    cache.invalidate_user("u1")
+    cache.set("k1", "u1", generation)
+    assert cache.get("k1") is MISSING
+    cache.set("k1", "u1", cache.generation)
+    assert cache.get("k1") == "u1"
+
+
+def _user(api_key):
+    db = SessionLocal()
+    user = User(username=api_key, password_hash="p", api_key=api_key)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+@pytest.mark.usefixtures("fresh_db")
+def test_key_rotation_invalidates_again_on_commit():
+    user_id = _user("rotate-old")
+    db = SessionLocal()
+    db.get(User, user_id).api_key = "rotate-new"
+    db.flush()
+    # A lookup between the flush and the commit still sees the old key
+    api_key_cache.set("rotate-old", user_id, api_key_cache.generation)
+    db.commit()
+    db.close()
+    assert api_key_cache.get("rotate-old") is MISSING
+
+
+@pytest.mark.usefixtures("fresh_db")
+def test_orm_bulk_update_invalidates():
+    user_id = _user("bulk-old")
+    api_key_cache.set("bulk-old", user_id)
+    db = SessionLocal()
+    db.execute(update(User).where(User.id == user_id).values(api_key="bulk-new"))
+    db.commit()
+    db.close()
+    assert api_key_cache.get("bulk-old") is MISSING
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.backends import BackendPool
+
+
+def test_pick_prefers_resident_model_then_least_loaded():
+    pool = BackendPool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.backends
+    for backend in pool.backends:
+        backend.installed = {"llama3.1:latest"}
+    b.loaded = {"llama3.1:latest"}
+    assert pool.pick("llama3.1") is b
+
+    b.healthy = False
+    a.in_flight = 2
+    assert pool.pick("llama3.1") is c
+
+
+def test_affinity_sticks_until_backend_unhealthy():
+    pool = BackendPool(["http://a", "http://b"])
+    first = pool.pick("m", affinity="convo")
+    first.in_flight = 10
+    assert pool.pick("m", affinity="convo") is first
+    first.healthy = False
+    assert pool.pick("m", affinity="convo") is not first
+
+
+def test_refresh_if_stale_reuses_recent_probes():
+    pool = BackendPool(["http://a"])
+    probes = []
+
+    async def probe(backend):
+        probes.append(backend.url)
+        await asyncio.sleep(0)
+
+    pool._probe = probe
+
+    async def scenario():
+        await asyncio.gather(pool.refresh_if_stale(10), pool.refresh_if_stale(10))
+        await pool.refresh_if_stale(10)
+        assert probes == ["http://a"]
+        await pool.refresh_if_stale(0)
+        assert probes == ["http://a", "http://a"]
+
+    asyncio.run(scenario())
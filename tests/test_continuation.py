@@ -0,0 +1,65 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.db import AsyncSessionLocal, SessionLocal, async_engine
+from app.models import Conversation, Message
+from app.services.continuation import ContextStore, pack_context, unpack_context
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+
+def _add(cid, role, content, **kwargs):
+    db = SessionLocal()
+    msg = Message(conversation_id=cid, role=role, content=content, **kwargs)
+    db.add(msg)
+    db.commit()
+    mid = msg.id
+    db.close()
+    return mid
+
+
+def test_pack_roundtrip():
+    tokens = [0, 1, 128000, 2**32 - 1]
+    assert len(pack_context(tokens)) == 16
+    assert unpack_context(pack_context(tokens)) == tokens
+
+
+def test_turns_continue_from_stored_context_until_history_is_edited():
+    db = SessionLocal()
+    convo = Conversation(title="t")
+    db.add(convo)
+    db.commit()
+    cid = convo.id
+    db.close()
+    _add(cid, "system", "be brief")
+    hi = _add(cid, "user", "hi")
+    store = ContextStore(enabled=True)
+
+    async def prepare(extra=()):
+        async with AsyncSessionLocal() as s:
+            return await store.prepare(s, cid, "m", 4096, extra)
+
+    async def scenario():
+        first = await prepare()
+        reply_id = _add(cid, "assistant", "hello")
+        store.save_later(cid, "m", [5, 6, 7], reply_id)
+        second = await prepare([{"role": "user", "content": "again"}])
+
+        # Regenerating the reply branches off "hi"; the stored turn is no longer on the active path
+        _add(cid, "assistant", "hey", parent_id=hi)
+        third = await prepare([{"role": "user", "content": "again"}])
+        await async_engine.dispose()
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert (first.context, first.prompt, first.system) == ([], "hi", "be brief")
+    assert second.payload("m", stream=True) == {"model": "m", "prompt": "again", "stream": True, "context": [5, 6, 7]}
+    # History with replies but no stored context goes back to /api/chat
+    assert third is None
+    assert store.stats()["prefill_tokens_skipped"] == 3
+    assert store.stats()["invalidations"] == 1
@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal
+from app.models import Conversation, Message, User
+from app.routers import conversations
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+
+HEADERS = {"Authorization": "Bearer list-key"}
+
+
+def _create_user():
+    db = SessionLocal()
+    db.add(User(username="lister", password_hash="p", api_key="list-key"))
+    db.commit()
+    db.close()
+
+
+def test_pages_follow_the_cursor_and_carry_summaries():
+    _create_user()
+    with TestClient(app) as client:
+        ids = [client.post("/conversations", json={"title": f"c{i}"}, headers=HEADERS).json()["id"] for i in range(5)]
+        client.post(f"/conversations/{ids[0]}/messages", json={"role": "user", "content": "hello"}, headers=HEADERS)
+        last = client.post(
+            f"/conversations/{ids[0]}/messages", json={"role": "assistant", "content": "x" * 300}, headers=HEADERS
+        ).json()
+
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            r = client.get("/conversations", params=params, headers=HEADERS)
+            seen.extend(r.json())
+            cursor = r.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert sorted(c["id"] for c in seen) == sorted(ids)
+        assert len({c["id"] for c in seen}) == 5
+
+        first = next(c for c in seen if c["id"] == ids[0])
+        assert first["message_count"] == 2
+        assert first["last_message_preview"] == "x" * 120
+
+        # Editing the first message truncates the reply; the summary follows
+        msgs = client.get(f"/conversations/{ids[0]}/messages", headers=HEADERS).json()
+        client.patch(f"/conversations/{ids[0]}/messages/{msgs[0]['id']}", json={"content": "hi"}, headers=HEADERS)
+        first = next(c for c in client.get("/conversations", headers=HEADERS).json() if c["id"] == ids[0])
+        assert (first["message_count"], first["last_message_preview"]) == (1, "hi")
+        assert last["id"] not in {m["id"] for m in client.get(f"/conversations/{ids[0]}/messages", headers=HEADERS).json()}
+
+
+def test_turn_written_off_the_active_leaf_is_recounted():
+    db = SessionLocal()
+    convo = Conversation(title="t")
+    db.add(convo)
+    db.flush()
+    first = Message(conversation_id=convo.id, role="user", content="a")
+    db.add_all([first, Message(conversation_id=convo.id, role="assistant", content="b")])
+    db.commit()
+    # A turn read from ``first`` and written behind the reply, after the leaf moved on
+    turn = [Message(id="t1", conversation_id=convo.id, role="user", content="c", parent_id=first.id),
+            Message(id="t2", conversation_id=convo.id, role="assistant", content="d", parent_id="t1")]
+    db.add_all(turn)
+    db.commit()
+    db.refresh(convo)
+    assert (convo.active_leaf_id, convo.message_count, convo.last_message_preview) == ("t2", 3, "d")
+    db.close()
@@ -0,0 +1,87 @@
+import asyncio
+import base64
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import AsyncSessionLocal, SessionLocal, async_engine
+from app.models import Conversation, File, Message, User
+from app.routers import files
+from app.services import derivative_store, file_service
+from app.services.derivatives import Image, derive
+from app.services.history import load_history
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(files.router)
+
+HEADERS = {"Authorization": "Bearer derivatives-key"}
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 24
+
+
+def test_derive_text_and_images():
+    assert derive("text/plain", "héllo wörld".encode(), 1024, 5) == "héllo".encode()
+    assert derive("application/zip", b"PK", 1024, 5) == b""
+    if Image is None:
+        # Without Pillow images are sent as uploaded
+        assert derive("image/png", PNG, 1024, 5) == base64.b64encode(PNG)
+
+
+def test_downscales_images():
+    if Image is None:
+        pytest.skip("needs Pillow")
+    buf = io.BytesIO()
+    Image.new("RGB", (3000, 1500), "red").save(buf, format="JPEG")
+    with Image.open(io.BytesIO(base64.b64decode(derive("image/jpeg", buf.getvalue(), 1024, 5)))) as small:
+        assert small.size == (1024, 512)
+
+
+def test_attachments_reach_history_from_precomputed_derivatives(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_service, "base", str(tmp_path))
+    monkeypatch.setattr(derivative_store, "workers", 1)
+    db = SessionLocal()
+    db.add(User(username="deriver", password_hash="p", api_key="derivatives-key"))
+    db.commit()
+    try:
+        with TestClient(app) as client:
+            note = client.post("/files/upload", files={"upload": ("n.txt", b"meeting at noon", "text/plain")}, headers=HEADERS).json()
+            pic = client.post("/files/upload", files={"upload": ("p.png", PNG, "image/png")}, headers=HEADERS).json()
+        # Built by the upload's background task, in the pool
+        assert derivative_store.built == 2
+        assert (tmp_path / f"{note['path']}.txt").read_bytes() == b"meeting at noon"
+        assert not list(tmp_path.rglob("*.part"))
+
+        convo = Conversation(title="t")
+        db.add(convo)
+        db.flush()
+        db.add(Message(conversation_id=convo.id, role="user", content="see attached",
+                       files=[db.get(File, note["id"]), db.get(File, pic["id"])]))
+        db.commit()
+        cid = convo.id
+    finally:
+        derivative_store.shutdown()
+        db.close()
+
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            out = [await load_history(session, cid, budget) for budget in (1000, 12)]
+        await async_engine.dispose()
+        return out
+
+    hits = derivative_store.hits
+    [message], [squeezed] = asyncio.run(scenario())
+    assert message["content"] == "see attached\n\n[n.txt]\nmeeting at noon"
+    assert len(message["images"]) == 1 and message["images"][0]
+    assert derivative_store.hits == hits + 4
+    # 7 tokens of message leave 5: no room for the image, and the text is cut
+    assert squeezed == {"role": "user", "content": "see attached\n\n[n.txt]\nmeeting at"}
@@ -0,0 +1,44 @@
+import asyncio
+import base64
+import json
+import struct
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import ollama_client
+from app.services.embeddings import EmbeddingBatcher, to_base64
+
+
+def test_concurrent_requests_share_one_upstream_batch():
+    calls = []
+
+    def handler(request: httpx.Request):
+        inputs = json.loads(request.content)["input"]
+        calls.append(inputs)
+        return httpx.Response(200, json={"embeddings": [[float(len(t))] for t in inputs], "prompt_eval_count": 6})
+
+    async def scenario():
+        ollama_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            batcher = EmbeddingBatcher(max_batch=16, max_wait_ms=20)
+            return await asyncio.gather(
+                batcher.embed("m", ["a"]),
+                batcher.embed("m", ["bb", "ccc"]),
+            )
+        finally:
+            await ollama_client.aclose()
+
+    (first, t1), (second, t2) = asyncio.run(scenario())
+    assert calls == [["a", "bb", "ccc"]]
+    assert first == [[1.0]]
+    assert second == [[2.0], [3.0]]
+    assert t1 + t2 == 6
+
+
+def test_base64_is_little_endian_float32():
+    packed = base64.b64decode(to_base64([1.0, -2.5]))
+    assert struct.unpack("<2f", packed) == (1.0, -2.5)
@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal
+from app.models import User
+from app.routers import conversations
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+
+HEADERS = {"Authorization": "Bearer etag-key"}
+
+
+def test_polls_get_304_until_the_conversation_changes():
+    db = SessionLocal()
+    db.add(User(username="poller", password_hash="p", api_key="etag-key"))
+    db.commit()
+    db.close()
+    with TestClient(app) as client:
+        cid = client.post("/conversations", json={"title": "t"}, headers=HEADERS).json()["id"]
+        url = f"/conversations/{cid}/messages"
+
+        def poll(etag, path=url):
+            return client.get(path, headers={**HEADERS, "If-None-Match": etag})
+
+        etag = client.get(url, headers=HEADERS).headers["ETag"]
+        r = poll(etag)
+        assert (r.status_code, r.content, r.headers["ETag"]) == (304, b"", etag)
+        assert poll(etag, f"/conversations/{cid}").status_code == 304
+        assert poll(f'W/{etag}, "other"').status_code == 304
+
+        seen = {etag}
+        msg = client.post(url, json={"role": "user", "content": "hi"}, headers=HEADERS).json()
+        changes = [
+            lambda: client.post(url, json={"role": "assistant", "content": "yo"}, headers=HEADERS),
+            lambda: client.patch(f"{url}/{msg['id']}", json={"content": "hello"}, headers=HEADERS),
+            lambda: client.patch(f"/conversations/{cid}", json={"title": "renamed"}, headers=HEADERS),
+        ]
+        for change in [lambda: None, *changes]:
+            change()
+            r = poll(etag)
+            assert r.status_code == 200 and r.headers["ETag"] not in seen
+            etag = r.headers["ETag"]
+            seen.add(etag)
+
+        assert client.get("/conversations/nope/messages", headers={**HEADERS, "If-None-Match": "*"}).status_code == 404
@@ -0,0 +1,224 @@
+import hashlib
+import importlib.util
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from fsspec.asyn import get_loop
+
+from app.auth import auth_middleware
+from app.db import SessionLocal, engine
+from app.models import Blob, File, User
+from app.routers import files
+from app.services import derivative_store, file_service
+from app.services import files as files_module
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+_spec = importlib.util.spec_from_file_location(
+    "blobs_migration", Path(__file__).resolve().parents[1] / "app/migrations/versions/0014_file_blobs.py"
+)
+blobs_migration = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(blobs_migration)
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(files.router)
+
+HEADERS = {"Authorization": "Bearer files-key"}
+
+
+def _stored(root):
+    return sorted(str(p.relative_to(root)) for p in root.rglob("*") if p.is_file())
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    db = SessionLocal()
+    db.add(User(username="uploader", password_hash="p", api_key="files-key"))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(file_service, "base", str(tmp_path))
+    monkeypatch.setattr(files_module, "FILE_UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(files_module, "FILE_MAX_SIZE", 32)
+    # Built inline here; test_derivatives covers the process pool
+    monkeypatch.setattr(derivative_store, "workers", 0)
+    return tmp_path
+
+
+def test_upload_streams_in_chunks_and_hashes(storage):
+    data = b"hello, chunked world"
+    with TestClient(app) as client:
+        resp = client.post("/files/upload", files={"upload": ("a.txt", data, "text/plain")}, headers=HEADERS)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["size"] == len(data)
+    assert body["sha256"] == hashlib.sha256(data).hexdigest()
+    assert (storage / body["path"]).read_bytes() == data
+
+
+def test_rejected_uploads_leave_nothing_behind(storage):
+    with TestClient(app) as client:
+        big = client.post("/files/upload", files={"upload": ("a.txt", b"x" * 33, "text/plain")}, headers=HEADERS)
+        fake = client.post("/files/upload", files={"upload": ("a.png", b"not a png", "image/png")}, headers=HEADERS)
+    assert (big.status_code, big.json()["detail"]) == (400, "File too large")
+    assert (fake.status_code, fake.json()["detail"]) == (400, "File content does not match its type")
+    assert _stored(storage) == []
+    db = SessionLocal()
+    assert db.query(File).count() == 0
+    db.close()
+
+
+def test_same_content_is_stored_once_and_refcounted(storage):
+    data = b"same bytes"
+    digest = hashlib.sha256(data).hexdigest()
+    db = SessionLocal()
+    db.add(User(username="other", password_hash="p", api_key="files-other-key"))
+    db.commit()
+    db.close()
+    other = {"Authorization": "Bearer files-other-key"}
+    with TestClient(app) as client:
+        first = client.post("/files/upload", files={"upload": ("a.txt", data, "text/plain")}, headers=HEADERS).json()
+        second = client.post("/files/upload", files={"upload": ("b.txt", data, "text/plain")}, headers=HEADERS).json()
+        claimed = client.post("/files/by-hash", json={"sha256": digest, "name": "c.txt"}, headers=HEADERS)
+        # A hash alone doesn't reach another user's upload
+        stranger = client.post("/files/by-hash", json={"sha256": digest, "name": "c.txt"}, headers=other)
+        assert (claimed.status_code, stranger.status_code) == (200, 404)
+        assert first["path"] == second["path"] == claimed.json()["path"]
+        assert _stored(storage) == [first["path"], first["path"] + ".txt"]
+
+        db = SessionLocal()
+        assert db.get(Blob, digest).ref_count == 3
+        db.close()
+        client.delete(f"/files/{first['id']}", headers=HEADERS)
+        client.delete(f"/files/{claimed.json()['id']}", headers=HEADERS)
+        assert _stored(storage) == [first["path"], first["path"] + ".txt"]
+        client.delete(f"/files/{second['id']}", headers=HEADERS)
+    assert _stored(storage) == []
+    db = SessionLocal()
+    assert db.get(Blob, digest) is None
+    db.close()
+
+
+def test_failed_delete_keeps_the_object(storage, monkeypatch):
+    with TestClient(app) as client:
+        uploaded = client.post("/files/upload", files={"upload": ("e.txt", b"kept", "text/plain")}, headers=HEADERS).json()
+    db = SessionLocal()
+
+    def fail():
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(db, "commit", fail)
+    with pytest.raises(RuntimeError):
+        file_service.delete(db, db.get(File, uploaded["id"]))
+    db.rollback()
+    assert _stored(storage) == [uploaded["path"], uploaded["path"] + ".txt"]
+    assert db.get(Blob, uploaded["sha256"]).ref_count == 1
+    db.close()
+
+
+def test_dedupe_moves_existing_files_onto_blobs(storage):
+    db = SessionLocal()
+    owner = db.query(User).filter_by(api_key="files-key").one().id
+    for name in ("old1.pdf", "old2.pdf"):
+        (storage / name).write_bytes(b"%PDF-1.4 legacy")
+        db.add(File(mime_type="application/pdf", size=15, name=name, path=name, owner=owner))
+    db.add(File(mime_type="application/pdf", size=1, name="gone.pdf", path="gone.pdf", owner=owner))
+    db.commit()
+
+    db.close()
+
+    def move(conn):
+        return blobs_migration.move_to_blobs(conn, file_service.fs, file_service._full_path, batch_size=1)
+
+    # A rolled-back run leaves every file where its row says it is
+    with engine.connect() as conn:
+        move(conn)
+        conn.rollback()
+    db = SessionLocal()
+    assert {f.name: f.path for f in db.query(File)} == {"old1.pdf": "old1.pdf", "old2.pdf": "old2.pdf", "gone.pdf": "gone.pdf"}
+    db.close()
+    assert {"old1.pdf", "old2.pdf"} <= set(_stored(storage))
+
+    with engine.begin() as conn:
+        replaced = move(conn)
+    assert sorted(replaced) == [str(storage / "old1.pdf"), str(storage / "old2.pdf")]
+    for path in replaced:
+        file_service.fs.rm(path)
+    db = SessionLocal()
+    digest = hashlib.sha256(b"%PDF-1.4 legacy").hexdigest()
+    paths = {f.name: f.path for f in db.query(File)}
+    assert paths == {"old1.pdf": paths["old2.pdf"], "old2.pdf": f"blobs/{digest[:2]}/{digest}", "gone.pdf": "gone.pdf"}
+    assert db.get(Blob, digest).ref_count == 2
+    assert _stored(storage) == [paths["old1.pdf"]]
+    db.close()
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+def test_content_download_ranges_etags_and_signed_links(storage, monkeypatch, zero_copy):
+    if not zero_copy:
+        # Serve through the chunked stream used for remote backends
+        monkeypatch.setattr(file_service, "local_path", lambda file_obj: None)
+    monkeypatch.setattr(files_module, "FILE_URL_SIGNING_KEY", "test-secret")
+    data = b"0123456789abcdef"
+    with TestClient(app) as client:
+        uploaded = client.post("/files/upload", files={"upload": ("d.txt", data, "text/plain")}, headers=HEADERS).json()
+        url = f"/files/{uploaded['id']}/content"
+
+        full = client.get(url, headers=HEADERS)
+        assert (full.status_code, full.content) == (200, data)
+        assert full.headers["etag"] == f'"{uploaded["sha256"]}"'
+        assert "immutable" in full.headers["cache-control"]
+
+        part = client.get(url, headers={**HEADERS, "Range": "bytes=4-7"})
+        assert (part.status_code, part.content, part.headers["content-range"]) == (206, b"4567", "bytes 4-7/16")
+        assert client.get(url, headers={**HEADERS, "Range": "bytes=-3"}).content == b"def"
+        assert client.get(url, headers={**HEADERS, "Range": "bytes=99-"}).status_code == 416
+        assert client.get(url, headers={**HEADERS, "If-None-Match": full.headers["etag"]}).status_code == 304
+
+        signed = client.post(f"/files/{uploaded['id']}/url", headers=HEADERS).json()["url"]
+        assert client.get(signed).content == data
+        assert client.get(signed.replace("signature=", "signature=0")).status_code == 403
+        assert client.get(url).status_code == 401
+        assert client.get("/files/missing/content", headers=HEADERS).status_code == 404
+
+
+class _Presigner:
+    """Stands in for s3fs' presigning, counting how many URLs it signs."""
+
+    def __init__(self):
+        self.loop = get_loop()
+        self.signed = []
+
+    async def _url(self, path, expires):
+        self.signed.append(path)
+        return f"https://bucket.example/{path}?expires={expires}&n={len(self.signed)}"
+
+
+def test_public_urls_are_signed_in_batches_and_cached(monkeypatch):
+    presigner = _Presigner()
+    monkeypatch.setattr(files_module, "FILE_STORAGE_BACKEND", "s3")
+    monkeypatch.setattr(file_service, "fs", presigner)
+    monkeypatch.setattr(file_service, "base", "bucket")
+    monkeypatch.setattr(file_service, "_urls", OrderedDict())
+
+    first = file_service.public_urls(["a", "b", "a"])
+    assert sorted(presigner.signed) == ["bucket/a", "bucket/b"]
+    assert file_service.public_urls(["b", "a"]) == first
+    assert file_service.public_url("a") == first["a"] and len(presigner.signed) == 2
+
+    # Re-signed once less than a quarter of the lifetime is left
+    now = time.time()
+    monkeypatch.setattr(files_module.time, "time", lambda: now + files_module.FILE_URL_TTL * 0.8)
+    assert file_service.public_url("a") != first["a"] and len(presigner.signed) == 3
+
+    # A public base URL needs no signing at all
+    monkeypatch.setattr(files_module, "FILE_PUBLIC_BASE_URL", "https://cdn.example/")
+    assert file_service.public_urls(["c"]) == {"c": "https://cdn.example/c"} and len(presigner.signed) == 3
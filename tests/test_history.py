@@ -0,0 +1,81 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.db import AsyncSessionLocal, SessionLocal, async_engine
+from app.models import Conversation, Message
+from app.services.history import context_budget, load_history, recent_path
+from app.tokens import estimate_tokens
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+
+def _seed(contents):
+    db = SessionLocal()
+    convo = Conversation(title="t")
+    db.add(convo)
+    db.flush()
+    msgs = [Message(conversation_id=convo.id, role=role, content=text) for role, text in contents]
+    db.add_all(msgs)
+    db.commit()
+    counts = [m.token_count for m in msgs]
+    cid = convo.id
+    db.close()
+    return cid, counts
+
+
+def _load(cid, budget):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            out = await load_history(db, cid, budget)
+        await async_engine.dispose()
+        return out
+
+    return asyncio.run(scenario())
+
+
+def test_keeps_system_and_newest_turns_within_budget():
+    turns = [("system", "be brief")] + [("user" if i % 2 else "assistant", f"message {i} " * 10) for i in range(1, 11)]
+    cid, counts = _seed(turns)
+    assert counts == [estimate_tokens(text) for _, text in turns]
+
+    budget = counts[0] + sum(counts[-3:])
+    history = _load(cid, budget)
+    assert [m["content"] for m in history] == [turns[0][1]] + [text for _, text in turns[-3:]]
+
+
+def test_walk_stops_once_past_the_budget():
+    cid, counts = _seed([("user" if i % 2 else "assistant", f"message {i} " * 10) for i in range(50)])
+    budget = sum(counts[-3:])
+    db = SessionLocal()
+    walked = db.execute(recent_path(cid, budget)).all()
+    db.close()
+    # The three that fit and the one that tipped it over
+    assert [row.seq for row in walked] == [50, 49, 48, 47]
+    assert len(_load(cid, budget)) == 3
+
+
+def test_newest_message_is_kept_even_over_budget():
+    cid, _ = _seed([("user", "old"), ("user", "x" * 400)])
+    assert _load(cid, 10) == [{"role": "user", "content": "x" * 400}]
+
+
+def test_context_budget_prefers_request_options():
+    assert context_budget("m", {"num_ctx": 2048, "num_predict": 48}) == 2000
+
+
+def test_history_follows_the_active_branch():
+    cid, _ = _seed([("user", "a"), ("assistant", "b"), ("user", "c")])
+    db = SessionLocal()
+    first = db.query(Message).filter_by(conversation_id=cid, seq=1).one()
+    db.add(Message(conversation_id=cid, role="assistant", content="b2", parent_id=first.id))
+    db.commit()
+    db.add(Message(conversation_id=cid, role="user", content="c2"))
+    db.commit()
+    assert [m.seq for m in db.get(Conversation, cid).messages] == [1, 2, 3, 4, 5]
+    db.close()
+    assert [m["content"] for m in _load(cid, 4096)] == ["a", "b2", "c2"]
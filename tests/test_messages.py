@@ -38,7 +38,7 @@ def _create_user():
     return user
 
 
-def test_edit_message_deletes_following():
+def test_edit_message_branches_off():
     user = _create_user()
     headers = {"Authorization": f"Bearer {user.api_key}"}
 
@@ -68,13 +68,21 @@ def test_edit_message_deletes_following():
         headers=headers,
     )
     assert resp.status_code == 200
+    edited = resp.json()
+    assert edited["id"] != m1["id"]
 
     resp = client.get(f"/conversations/{convo_id}/messages", headers=headers)
     msgs = resp.json()
     assert len(msgs) == 1
-    assert msgs[0]["id"] == m1["id"]
+    assert msgs[0]["id"] == edited["id"]
     assert msgs[0]["content"] == "hi"
 
+    # The original branch is kept and can be switched back to
+    branches = client.get(f"/conversations/{convo_id}/branches", headers=headers).json()
+    assert [b["active"] for b in branches] == [False, True]
+    convo = client.post(f"/conversations/{convo_id}/branches/{m1['id']}", headers=headers).json()
+    assert [m["content"] for m in convo["messages"]] == ["hello", "world", "bye"]
+
     # Clean up the temporary database file
     DB_PATH.unlink()
 
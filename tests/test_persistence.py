@@ -0,0 +1,73 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.db import SessionLocal, async_engine
+from app.models import Conversation, Message
+from app.services.persistence import MessageWriter
+
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+
+def _conversation() -> str:
+    db = SessionLocal()
+    convo = Conversation(title="t")
+    db.add(convo)
+    db.commit()
+    cid = convo.id
+    db.close()
+    return cid
+
+
+def _stored(cid: str):
+    db = SessionLocal()
+    try:
+        return {m.id: m.content for m in db.query(Message).filter(Message.conversation_id == cid)}
+    finally:
+        db.close()
+
+
+def test_queued_turns_are_group_committed_on_stop():
+    cid = _conversation()
+
+    async def scenario():
+        writer = MessageWriter(max_batch=100, flush_ms=10_000, max_queue=10)
+        writer.start()
+        msgs = []
+        for i in range(3):
+            turn = (
+                Message(conversation_id=cid, role="user", content=f"q{i}", files=[]),
+                Message(conversation_id=cid, role="assistant", content=f"a{i}", files=[]),
+            )
+            await writer.submit(*turn)
+            msgs.extend(turn)
+        # Ids are known before anything is committed
+        ids = {m.id: m.content for m in msgs}
+        assert all(ids) and not _stored(cid)
+        await writer.stop()
+        await async_engine.dispose()
+        return writer.stats(), ids
+
+    stats, ids = asyncio.run(scenario())
+    assert _stored(cid) == ids
+    assert stats["batches"] == 1 and stats["rows"] == 6 and stats["sync_writes"] == 0
+
+
+def test_writes_inline_when_worker_is_not_running():
+    cid = _conversation()
+
+    async def scenario():
+        writer = MessageWriter(max_batch=100, flush_ms=10_000, max_queue=10)
+        msg = Message(conversation_id=cid, role="assistant", content="hi", files=[])
+        await writer.submit(msg)
+        await async_engine.dispose()
+        return writer.stats(), msg.id
+
+    stats, mid = asyncio.run(scenario())
+    assert _stored(cid) == {mid: "hi"}
+    assert stats["sync_writes"] == 1 and stats["batches"] == 0
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal
+from app.models import Conversation, File, Message, User
+from app.models.file import message_files
+from app.routers import conversations
+from app.services import conversation_purger
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+
+HEADERS = {"Authorization": "Bearer purge-key"}
+
+
+def _seed(n):
+    db = SessionLocal()
+    user = User(username="purger", password_hash="p", api_key="purge-key")
+    db.add(user)
+    db.flush()
+    doc = File(mime_type="text/plain", size=1, name="a.txt", path="a.txt", owner=user.id)
+    ids = []
+    for i in range(n):
+        convo = Conversation(title=f"c{i}", user_id=user.id)
+        db.add(convo)
+        db.flush()
+        db.add_all(Message(conversation_id=convo.id, role="user", content=str(j)) for j in range(3))
+        db.add(Message(conversation_id=convo.id, role="user", content="with file", files=[doc]))
+        ids.append(convo.id)
+    db.commit()
+    db.close()
+    return ids
+
+
+def _counts():
+    db = SessionLocal()
+    out = (
+        db.query(Conversation).count(),
+        db.query(Message).count(),
+        db.query(message_files).count(),
+    )
+    db.close()
+    return out
+
+
+def test_bulk_delete_inline_and_as_background_job(monkeypatch):
+    ids = _seed(4)
+    monkeypatch.setattr(conversation_purger, "batch_size", 2)
+    with TestClient(app) as client:
+        assert client.delete("/conversations", headers=HEADERS).status_code == 400
+
+        r = client.delete("/conversations", params={"ids": ids[:2]}, headers=HEADERS)
+        assert r.status_code == 200
+        assert (r.json()["status"], r.json()["conversations_deleted"], r.json()["messages_deleted"]) == ("done", 2, 8)
+        assert _counts() == (2, 8, 2)
+
+        client.delete(f"/conversations/{ids[2]}", headers=HEADERS)
+        assert _counts() == (1, 4, 1)
+
+        monkeypatch.setattr(conversation_purger, "inline_max_messages", 0)
+        r = client.delete("/conversations", params={"created_before": "2999-01-01T00:00:00"}, headers=HEADERS)
+        assert r.status_code == 202
+        status = client.get(r.headers["Location"], headers=HEADERS).json()
+        assert (status["status"], status["conversations_deleted"]) == ("done", 1)
+        assert _counts() == (0, 0, 0)
+
+
+def test_plan_counts_every_branch():
+    [cid] = _seed(1)
+    db = SessionLocal()
+    first = db.query(Message).filter_by(conversation_id=cid).order_by(Message.seq).first()
+    # An edit of the second message: a second branch the active one doesn't count
+    db.add(Message(conversation_id=cid, role="user", content="edited", parent_id=first.id))
+    db.commit()
+    assert db.get(Conversation, cid).message_count == 2
+    user_id = db.get(Conversation, cid).user_id
+    assert conversation_purger.plan(db, user_id, ids=[cid]).messages == 5
+    assert conversation_purger.plan(db, user_id, ids=["missing"]).messages == 0
+    db.close()
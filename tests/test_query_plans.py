@@ -0,0 +1,126 @@
+import re
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert, text
+
+from app.auth import auth_middleware
+from app.db import engine
+from app.models import Conversation, File, Message, User
+from app.models.file import message_files
+from app.routers import conversations, files
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+app.include_router(files.router)
+
+HEADERS = {"Authorization": "Bearer plans-key"}
+USERS, CONVERSATIONS_PER_USER, MESSAGES_PER_CONVERSATION = 20, 50, 10
+TABLES = {
+    "users", "conversations", "messages", "files", "message_files", "conversation_contexts", "conversation_archives",
+}
+
+
+def _seed():
+    """Bulk-insert enough rows that a missing index shows up as a scan."""
+    users = [{"id": f"u{u}", "username": f"user{u}", "password_hash": "p", "api_key": f"key{u}"} for u in range(USERS)]
+    users[0]["api_key"] = "plans-key"
+    convos, msgs, blobs, links = [], [], [], []
+    for u in range(USERS):
+        for c in range(CONVERSATIONS_PER_USER):
+            cid = f"c{u}x{c}"
+            convos.append({"id": cid, "user_id": f"u{u}", "title": f"topic {c}", "archived": c % 5 == 0,
+                           "last_seq": MESSAGES_PER_CONVERSATION,
+                           "active_leaf_id": f"{cid}m{MESSAGES_PER_CONVERSATION}"})
+            for s in range(1, MESSAGES_PER_CONVERSATION + 1):
+                mid = f"{cid}m{s}"
+                msgs.append({"id": mid, "conversation_id": cid, "parent_id": f"{cid}m{s - 1}" if s > 1 else None,
+                             "role": "user" if s % 2 else "assistant",
+                             "content": f"message {s} about topic {c}", "token_count": 8, "seq": s})
+            blobs.append({"id": f"f{cid}", "mime_type": "text/plain", "size": 1, "name": "a.txt",
+                          "path": f"missing/{cid}", "owner": f"u{u}"})
+            links.append({"message_id": f"{cid}m1", "file_id": f"f{cid}"})
+    with engine.begin() as conn:
+        conn.execute(insert(User), users)
+        conn.execute(insert(Conversation), convos)
+        conn.execute(insert(Message), msgs)
+        conn.execute(insert(File), blobs)
+        conn.execute(insert(message_files), links)
+        if conn.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+
+
+@contextmanager
+def _captured():
+    statements = []
+
+    def record(conn, cursor, statement, params, context, executemany):
+        if statement.lstrip().split(None, 1)[0].upper() in {"SELECT", "UPDATE", "DELETE", "WITH"}:
+            statements.append((statement, params[0] if executemany else params))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def _full_scans(conn, statement, params):
+    """Tables the planner reads in full for ``statement``."""
+    raw = conn.connection.dbapi_connection.cursor()
+    if conn.dialect.name == "sqlite":
+        raw.execute("EXPLAIN QUERY PLAN " + statement, params)
+        aliases = dict(re.findall(r"\b(\w+)\s+AS\s+(\w+)", statement, re.IGNORECASE))
+        aliases = {alias: table for table, alias in aliases.items()}
+        scans = [re.match(r"SCAN (\w+)", row[3]) for row in raw.fetchall()]
+        return {aliases.get(m.group(1), m.group(1)) for m in scans if m} & TABLES
+    # With sequential scans priced out, any left over have no usable index
+    raw.execute("SET LOCAL enable_seqscan = off")
+    raw.execute("EXPLAIN " + statement, params)
+    return {m.group(1) for (line,) in raw.fetchall() for m in [re.search(r"Seq Scan on (\w+)", line)] if m} & TABLES
+
+
+@pytest.mark.usefixtures("search_index")
+def test_endpoint_queries_use_indexes():
+    _seed()
+    with TestClient(app) as client, _captured() as statements:
+        cid = "c0x1"
+        client.get("/conversations", headers=HEADERS)
+        client.get("/conversations", params={"include_archived": True, "limit": 10}, headers=HEADERS)
+        client.get("/conversations", params={"limit": 10, "cursor": "c0x7"}, headers=HEADERS)
+        client.get("/conversations", params={"search": "topic"}, headers=HEADERS)
+        client.get("/conversations/search", params={"q": "message"}, headers=HEADERS)
+        client.get("/conversations/search", params={"q": "message", "include_archived": True}, headers=HEADERS)
+        client.get("/conversations", params={"search": "topic", "include_archived": True}, headers=HEADERS)
+        client.get(f"/conversations/{cid}", headers=HEADERS)
+        client.get(f"/conversations/{cid}/messages", headers=HEADERS)
+        client.post(f"/conversations/{cid}/messages", json={"role": "user", "content": "more"}, headers=HEADERS)
+        client.patch(f"/conversations/{cid}/messages/{cid}m3", json={"content": "edited"}, headers=HEADERS)
+        client.get(f"/conversations/{cid}/branches", headers=HEADERS)
+        client.post(f"/conversations/{cid}/branches/{cid}m2", headers=HEADERS)
+        client.patch(f"/conversations/{cid}", json={"archived": True}, headers=HEADERS)
+        client.post("/files/by-hash", json={"sha256": "0" * 64, "name": "a.txt"}, headers=HEADERS)
+        client.get(f"/files/f{cid}/content", headers=HEADERS)
+        client.delete(f"/files/f{cid}", headers=HEADERS)
+        client.delete("/conversations/c0x2", headers=HEADERS)
+        client.delete("/conversations", params={"ids": ["c0x3", "c0x4"]}, headers=HEADERS)
+        client.delete("/conversations", params={"archived_before": "2000-01-01T00:00:00"}, headers=HEADERS)
+    assert len(statements) > 20
+
+    offenders = {}
+    with engine.begin() as conn:
+        for statement, params in statements:
+            scans = _full_scans(conn, statement, params)
+            if scans:
+                offenders[statement] = scans
+    assert not offenders
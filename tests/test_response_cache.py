@@ -0,0 +1,42 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.response_cache import ResponseCache, cache_key
+
+
+def test_coalesces_identical_in_flight_requests():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"response": "hi", "eval_count": 1, "context": [1, 2, 3]}
+
+    async def scenario():
+        cache = ResponseCache(True, 1024, 60, "", 0)
+        key = cache_key("completion", "m", "p", {"temperature": 0})
+        results = await asyncio.gather(*(cache.get_or_fetch(key, fetch) for _ in range(5)))
+        again = await cache.get(key)
+        return results, again, cache.stats()
+
+    results, again, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert all(r["response"] == "hi" for r in results)
+    assert again == {"response": "hi", "eval_count": 1}
+    assert stats["coalesced"] == 4
+
+
+def test_disk_tier_survives_memory_eviction(tmp_path):
+    async def scenario():
+        cache = ResponseCache(True, 64, 60, str(tmp_path / "cache.db"), 1024 * 1024)
+        await cache.set("a", {"response": "x" * 40})
+        await cache.set("b", {"response": "y" * 40})
+        return await cache.get("a"), cache.stats()
+
+    value, stats = asyncio.run(scenario())
+    assert value == {"response": "x" * 40}
+    assert stats["disk_hits"] == 1
@@ -0,0 +1,52 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.scheduler import AdmissionController, AdmissionRejected
+
+
+def test_round_robin_across_users():
+    async def scenario():
+        ctl = AdmissionController()
+        ctl._queue("m").limit = 1
+        holder = await ctl.acquire("m", "heavy", None)
+        order = []
+
+        async def worker(user, tag):
+            slot = await ctl.acquire("m", user, None)
+            order.append(tag)
+            slot.release()
+
+        tasks = [asyncio.create_task(worker("heavy", f"h{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(worker("light", "l0")))
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, ctl.stats()["m"]
+
+    order, stats = asyncio.run(scenario())
+    assert order[:2] == ["h0", "l0"]
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_rejects_when_estimated_wait_exceeds_timeout():
+    async def scenario():
+        ctl = AdmissionController()
+        q = ctl._queue("m")
+        q.limit = 1
+        q.service_time = 30.0
+        slot = await ctl.acquire("m", "u", None)
+        try:
+            with pytest.raises(AdmissionRejected) as exc:
+                await ctl.acquire("m", "u", timeout=5)
+            return exc.value.retry_after
+        finally:
+            slot.release()
+
+    assert asyncio.run(scenario()) == 30
@@ -0,0 +1,82 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal, engine
+from app.models import Conversation, Message, User
+from app.routers import conversations
+
+pytestmark = pytest.mark.usefixtures("fresh_db")
+
+app = FastAPI()
+app.middleware("http")(auth_middleware)
+app.include_router(conversations.router)
+
+HEADERS = {"Authorization": "Bearer search-key"}
+
+
+@pytest.fixture(params=["fts", "ilike"])
+def backend(request):
+    db = SessionLocal()
+    db.add(User(username="searcher", password_hash="p", api_key="search-key"))
+    db.commit()
+    db.close()
+    if request.param == "fts":
+        request.getfixturevalue("search_index")
+    return request.param
+
+
+def test_search_endpoint_and_search_params(backend):
+    with TestClient(app) as client:
+        trip = client.post("/conversations", json={"title": "Holiday planning"}, headers=HEADERS).json()["id"]
+        other = client.post("/conversations", json={"title": "Groceries"}, headers=HEADERS).json()["id"]
+        client.post(f"/conversations/{trip}/messages", json={"role": "user", "content": "Book a train to Lisbon"}, headers=HEADERS)
+        client.post(f"/conversations/{other}/messages", json={"role": "user", "content": "Milk and bread"}, headers=HEADERS)
+
+        hits = client.get("/conversations/search", params={"q": "lisbon"}, headers=HEADERS).json()
+        assert [(h["conversation_id"], h["role"]) for h in hits] == [(trip, "user")]
+        assert "<mark>" in hits[0]["snippet"]
+
+        first = client.get("/conversations/search", params={"q": "b", "limit": 1}, headers=HEADERS)
+        assert len(first.json()) == 1 and first.headers.get("X-Next-Cursor")
+
+        listed = client.get("/conversations", params={"search": "holiday"}, headers=HEADERS).json()
+        assert [c["id"] for c in listed] == [trip]
+        listed = client.get("/conversations", params={"search": "bread"}, headers=HEADERS).json()
+        assert [c["id"] for c in listed] == [other]
+        msgs = client.get(f"/conversations/{trip}/messages", params={"search": "train"}, headers=HEADERS).json()
+        assert [m["content"] for m in msgs] == ["Book a train to Lisbon"]
+
+
+@pytest.mark.usefixtures("search_index")
+def test_search_survives_renumbered_rowids():
+    db = SessionLocal()
+    user = User(username="vacuumer", password_hash="p", api_key="vacuum-key")
+    db.add(user)
+    db.commit()
+    convo = Conversation(title="Notes", user_id=user.id)
+    db.add(convo)
+    db.flush()
+    msgs = [Message(conversation_id=convo.id, role="user", content=word) for word in ("alpha", "bravo", "charlie")]
+    db.add_all(msgs)
+    db.commit()
+    cid, charlie = convo.id, msgs[-1].id
+    db.close()
+    # What VACUUM or a table rebuild may do to tables without an INTEGER PRIMARY KEY
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE messages SET rowid = 1000 - rowid")
+        conn.exec_driver_sql("UPDATE conversations SET rowid = 1000 - rowid")
+
+    with TestClient(app) as client:
+        headers = {"Authorization": "Bearer vacuum-key"}
+        hits = client.get("/conversations/search", params={"q": "charlie"}, headers=headers).json()
+        listed = client.get("/conversations", params={"search": "notes"}, headers=headers).json()
+    assert [h["message_id"] for h in hits] == [charlie]
+    assert [c["id"] for c in listed] == [cid]
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import sse
+
+
+def test_chat_delta_frame_matches_full_chunk():
+    enc = sse.chat_encoder("chatcmpl-1", 123, "m")
+    frame = enc.delta('he said "hi"\n')
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert json.loads(frame[6:]) == {
+        "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 123, "model": "m",
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": 'he said "hi"\n'}, "finish_reason": None}],
+    }
+
+
+def test_frame_buffer_coalesces_by_count():
+    frames = sse.FrameBuffer(max_frames=3, max_delay_ms=10_000)
+    assert frames.push(b"a") is None
+    assert frames.push(b"b") is None
+    assert frames.push(b"c") == b"abc"
+    assert frames.push(b"d") is None
+    assert frames.flush() == b"d"
+
+
+def test_frame_buffer_flushes_at_deadline_when_upstream_stalls():
+    frames = sse.FrameBuffer(max_frames=10, max_delay_ms=20)
+    released = asyncio.Event()
+
+    async def upstream():
+        yield "a"
+        # Stalls until the pending frame has gone out on its own
+        await released.wait()
+        yield "b"
+
+    async def scenario():
+        seen = []
+        async for line, due in frames.paced(upstream()):
+            if due:
+                seen.append(due)
+                released.set()
+            if line:
+                seen.append(line)
+                assert frames.push(line.encode()) is None
+        return seen
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 5)) == ["a", b"a", "b"]
+    assert frames.flush() == b"b"
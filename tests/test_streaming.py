@@ -0,0 +1,110 @@
+import asyncio
+import json
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import auth_middleware
+from app.db import SessionLocal
+from app.models import User
+from app.routers import conversations
+from app.routers.openai_proxy import turn_messages
+from app.services import message_writer, ollama_client
+from app.services.streaming import StreamWatcher, stream_stats
+
+
+class _GoneRequest:
+    async def is_disconnected(self):
+        return True
+
+
+def test_disconnect_counts_abandoned_stream_and_runs_policy():
+    persisted = []
+    before = stream_stats.stats()
+
+    async def scenario():
+        watcher = StreamWatcher(_GoneRequest(), "m", num_predict=100, on_abandon=lambda: persisted.append(True))
+        async with watcher:
+            for _ in range(10):
+                if await watcher.disconnected():
+                    break
+                watcher.token()
+        return watcher
+
+    watcher = asyncio.run(scenario())
+    after = stream_stats.stats()
+    assert watcher.gone and not watcher.completed
+    assert persisted == [True]
+    assert after["abandoned"] == before["abandoned"] + 1
+    assert after["tokens_saved"] == before["tokens_saved"] + 100
+
+
+def test_completed_stream_is_not_abandoned():
+    before = stream_stats.stats()
+
+    async def scenario():
+        watcher = StreamWatcher(_GoneRequest(), "m2")
+        async with watcher:
+            watcher.token()
+            watcher.complete({"eval_count": 1})
+
+    asyncio.run(scenario())
+    after = stream_stats.stats()
+    assert after["abandoned"] == before["abandoned"]
+    assert after["completed"] == before["completed"] + 1
+
+
+def _upstream(request: httpx.Request) -> httpx.Response:
+    lines = [{"message": {"content": "hi"}, "done": False}, {"done": True, "eval_count": 1}]
+    return httpx.Response(200, content="".join(json.dumps(line) + "\n" for line in lines))
+
+
+@pytest.mark.usefixtures("fresh_db")
+def test_reply_done_event_reports_its_parent():
+    db = SessionLocal()
+    db.add(User(username="replier", password_hash="p", api_key="reply-key"))
+    db.commit()
+    db.close()
+
+    @asynccontextmanager
+    async def lifespan(_):
+        # Replies are written behind the response, as in the app
+        message_writer.start()
+        yield
+        await message_writer.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(auth_middleware)
+    app.include_router(conversations.router)
+    headers = {"Authorization": "Bearer reply-key"}
+
+    ollama_client._client = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+    try:
+        with TestClient(app) as client:
+            cid = client.post("/conversations", json={"title": "t"}, headers=headers).json()["id"]
+            question = client.post(
+                f"/conversations/{cid}/messages", json={"role": "user", "content": "hello"}, headers=headers
+            ).json()
+            resp = client.post(f"/conversations/{cid}/reply", headers=headers)
+            stored = client.get(f"/conversations/{cid}/messages", headers=headers).json()
+    finally:
+        asyncio.run(ollama_client.aclose())
+
+    events = [json.loads(line[len("data: "):]) for line in resp.text.splitlines() if line.startswith("data: ")]
+    reply = events[-1]["message"]
+    assert events[-1]["done"] and reply["content"] == "hi"
+    assert reply["parent_id"] == question["id"]
+    assert stored[-1] == reply
+
+
+def test_turn_messages_chain_under_the_leaf():
+    rows = turn_messages("c", [{"role": "user", "content": "q"}], "a", "leaf")
+    assert [r.parent_id for r in rows] == ["leaf", rows[0].id]